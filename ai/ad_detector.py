@@ -6,6 +6,7 @@ import logging
 from openai import AsyncOpenAI
 import os
 from dotenv import load_dotenv
+from utils.metrics import openai_call
 
 load_dotenv()
 
@@ -33,9 +34,14 @@ async def is_advertisement(text: str) -> dict:
         
         client = AsyncOpenAI(
             api_key=OPENAI_API_KEY,
-            base_url="https://api.openai.com/v1",
+            base_url=os.getenv('OPENAI_BASE_URL', "https://api.openai.com/v1"),
         )
         
+        # Подписи не удаляем: контакты и ссылки в конце поста - важный признак рекламы
+        from ai.gpt.token_budget import prepare_text, token_accounting
+        from config.settings import AD_CHECK_MAX_INPUT_TOKENS
+        budget_text = prepare_text(text, AD_CHECK_MAX_INPUT_TOKENS, "ad_detector", model="gpt-4", strip_footer=False)
+        
         messages = [
             {
                 "role": "system",
@@ -68,17 +74,19 @@ async def is_advertisement(text: str) -> dict:
             },
             {
                 "role": "user",
-                "content": f"Проанализируй текст:\n\n{text}"
+                "content": f"Проанализируй текст:\n\n{budget_text}"
             }
         ]
         
-        response = await client.chat.completions.create(
-            model="gpt-4-1106-preview",
-            messages=messages,
-            temperature=0.1,  # Низкая температура для точности
-            max_tokens=200
-        )
+        async with openai_call("gpt.ad_check"):
+            response = await client.chat.completions.create(
+                model="gpt-4-1106-preview",
+                messages=messages,
+                temperature=0.1,  # Низкая температура для точности
+                max_tokens=200
+            )
         
+        token_accounting.record_usage("ad_detector", getattr(response, 'usage', None))
         result_text = response.choices[0].message.content.strip()
         logger.info(f"🤖 GPT ответ на детекцию рекламы: {result_text}")
         
@@ -1,8 +1,13 @@
 import asyncio
 import os
 import logging
-from config.settings import OPENAI_API_KEY
+from config.settings import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, REWRITER_MAX_INPUT_TOKENS, REWRITER_MAX_ROLE_TOKENS, REWRITER_MAX_OUTPUT_TOKENS,
+    GENERATE_IMAGES_FOR_TEXT_POSTS
+)
 from database.DatabaseManager import DatabaseManager
+from ai.gpt.token_budget import prepare_text, token_accounting
+from utils.metrics import openai_call
 
 logger = logging.getLogger(__name__)
 
@@ -10,13 +15,14 @@ class TextRewriter:
     def __init__(self):
         # Оставляем старый клиент для обратной совместимости
         import openai
-        self.client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_BASE_URL)
 
     def rewrite_text(self, text, post_link):
         """
         Переписывает текст с помощью GPT-4o
         """
         try:
+            text = prepare_text(text, REWRITER_MAX_INPUT_TOKENS, "rewrite_text")
             response = self.client.chat.completions.create(
                 model="gpt-4o",
                 messages=[
@@ -24,6 +30,7 @@ class TextRewriter:
                     {"role": "user", "content": f"Перепиши этот текст: {text}\n\nДобавь в конец ссылку на оригинальный пост: {post_link}"}
                 ]
             )
+            token_accounting.record_usage("rewrite_text", getattr(response, 'usage', None))
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"Ошибка при переписывании текста: {str(e)}")
@@ -31,33 +38,14 @@ class TextRewriter:
 
 async def generate_image_with_dalle(client, prompt):
     """
-    Генерирует изображение с помощью DALL-E
+    Генерирует изображение с помощью DALL-E.
+    Аргумент client оставлен для обратной совместимости: генерация идет через
+    асинхронный ImageGenerator с кэшем, возвращается путь к локальному файлу.
     """
-    try:
-        response = client.images.generate(
-            model="dall-e-3",  # Используем DALL-E 3
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
-        return response.data[0].url
-    except Exception as e:
-        logger.error(f"Ошибка при генерации изображения DALL-E 3: {str(e)}")
-        try:
-            # Пробуем DALL-E 2 как запасной вариант
-            response = client.images.generate(
-                model="dall-e-2",
-                prompt=prompt,
-                size="1024x1024",
-                n=1,
-            )
-            return response.data[0].url
-        except Exception as e2:
-            logger.error(f"Ошибка при генерации изображения DALL-E 2: {str(e2)}")
-            return None
+    from ai.image_generator import image_generator
+    return await image_generator.generate_image(prompt)
 
-async def rewriter(text, post_link, user_id, photo_url=None, group_link=None):
+async def rewriter(text, post_link, user_id, photo_url=None, group_link=None, source_link=None):
     """
     Переписывает текст и обрабатывает медиафайлы для поста.
     
@@ -67,6 +55,7 @@ async def rewriter(text, post_link, user_id, photo_url=None, group_link=None):
         user_id (int): ID пользователя для получения его роли
         photo_url (str, optional): URL фото или видео из оригинального поста
         group_link (str, optional): Ссылка на группу для получения роли
+        source_link (str, optional): Ссылка на источник поста (group_link из posts) для поиска шаблонного текста
         
     Returns:
         dict: Словарь с результатами:
@@ -92,11 +81,17 @@ async def rewriter(text, post_link, user_id, photo_url=None, group_link=None):
                     "blocked_reason": f"Контент содержит заблокированные темы: {blocked_topics}"
                 }
         
+        # Сокращаем вход до бюджета токенов: убираем подписи, шаблонный текст, обрезаем по предложениям
+        # Без источника шаблонные строки не ищем: по ссылке на пост VK все сообщества дали бы один ключ vk.com
+        budget_text = prepare_text(text, REWRITER_MAX_INPUT_TOKENS, "rewriter:text", source=source_link,
+                                   post_key=post_link or None)
+        role_text = prepare_text(role_text, REWRITER_MAX_ROLE_TOKENS, "rewriter:role", strip_footer=False)
+        
         # Используем АСИНХРОННЫЙ OpenAI клиент!
         from openai import AsyncOpenAI
         client = AsyncOpenAI(
             api_key=OPENAI_API_KEY,
-            base_url="https://api.openai.com/v1",
+            base_url=OPENAI_BASE_URL,
         )
         
         # Генерируем новый текст с учетом роли пользователя
@@ -111,15 +106,18 @@ async def rewriter(text, post_link, user_id, photo_url=None, group_link=None):
             },
             {
                 "role": "user",  # Второе сообщение всегда user
-                "content": f"Новость: {text}"
+                "content": f"Новость: {budget_text}"
             }
         ]
         
         # АСИНХРОННЫЙ запрос к GPT
-        response = await client.chat.completions.create(
-            model="gpt-4o", 
-            messages=messages
-        )
+        async with openai_call("gpt.rewrite"):
+            response = await client.chat.completions.create(
+                model="gpt-4o", 
+                messages=messages,
+                max_tokens=REWRITER_MAX_OUTPUT_TOKENS
+            )
+        token_accounting.record_usage("rewriter", getattr(response, 'usage', None))
         new_text = response.choices[0].message.content.strip()
         
         result = {"text": new_text, "blocked": False}
@@ -130,6 +128,14 @@ async def rewriter(text, post_link, user_id, photo_url=None, group_link=None):
             result["is_original"] = True
             # Проверяем, является ли файл видео по его пути
             result["is_video"] = '/videos/' in photo_url
+        elif GENERATE_IMAGES_FOR_TEXT_POSTS:
+            # Для постов без фото генерируем картинку по заголовку нового текста
+            title = new_text.split('\n', 1)[0].strip('*_ ')
+            image_path = await generate_image_with_dalle(None, title[:300])
+            if image_path:
+                result["image_url"] = image_path
+                result["is_original"] = False
+                result["is_video"] = False
         
         return result
         
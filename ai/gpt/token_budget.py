@@ -0,0 +1,290 @@
+"""
+Бюджетирование токенов для запросов к GPT.
+
+Перед каждым вызовом модели входной текст проходит через несколько этапов:
+удаление подписей канала и футеров, удаление повторяющегося "шаблонного" текста,
+обрезка по границам предложений до заданного бюджета токенов.
+Все сэкономленные токены учитываются и попадают в отчет.
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional
+
+from config.settings import TOKEN_BUDGET_REPORT_EVERY
+
+try:
+    import tiktoken
+except ImportError:
+    # Если tiktoken не установлен, используем приблизительный подсчет
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Среднее количество символов на токен для русского текста (для приблизительного подсчета)
+APPROX_CHARS_PER_TOKEN = 3.0
+
+# Строки-подписи, которые каналы добавляют в конец каждого поста
+SIGNATURE_PATTERNS = [
+    re.compile(r'^\W*(подпис(аться|ывайтесь|ывайся|ка)|подпишись|подпишитесь)\b', re.IGNORECASE),
+    re.compile(r'^\W*(прислать|предложить|отправить)\s+(новость|пост|материал)', re.IGNORECASE),
+    re.compile(r'^\W*(наш|мы в)\s+(канал|телеграм|telegram|вк|vk|чат)', re.IGNORECASE),
+    re.compile(r'^\W*(источник|фото|видео)\s*:\s*\S+$', re.IGNORECASE),
+    re.compile(r'^\W*@[A-Za-z0-9_]{4,}\W*$'),
+    re.compile(r'^\W*(https?://)?(t\.me|vk\.com|vk\.cc)/\S+\W*$', re.IGNORECASE),
+]
+
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+')
+
+_encodings = {}
+
+
+def _get_encoding(model: str):
+    """Возвращает (и кэширует) токенизатор для модели"""
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Подсчитывает количество токенов в тексте"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def strip_signatures(text: str) -> str:
+    """Удаляет подписи канала и футеры (ссылки на канал, "подписаться", "прислать новость")"""
+    lines = text.splitlines()
+
+    # Футер всегда в конце поста, поэтому снимаем строки с конца, пока они похожи на подпись
+    while lines:
+        line = lines[-1].strip()
+        if not line or any(pattern.search(line) for pattern in SIGNATURE_PATTERNS):
+            lines.pop()
+        else:
+            break
+
+    return "\n".join(lines)
+
+
+class BoilerplateTracker:
+    """
+    Запоминает строки, которые повторяются в разных постах одного источника.
+    Строка, встретившаяся в нескольких постах, считается шаблонной и удаляется.
+    Каждый пост учитывается один раз: переписывание одного поста для нескольких групп
+    не должно делать его собственные строки шаблонными.
+    """
+
+    def __init__(self, min_posts: int = 3, max_sources: int = 500, max_lines_per_source: int = 2000,
+                 max_seen_posts: int = 10000):
+        self.min_posts = min_posts
+        self.max_sources = max_sources
+        self.max_lines_per_source = max_lines_per_source
+        self.max_seen_posts = max_seen_posts
+        self._sources: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self._seen_posts: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(line: str) -> str:
+        return re.sub(r'\s+', ' ', line.strip().lower())
+
+    def observe(self, source: str, text: str, post_key: Optional[str] = None) -> None:
+        """Учитывает строки поста в статистике источника; пост с уже учтенным post_key пропускается"""
+        if not source or not text:
+            return
+        unique_lines = {self._normalize(line) for line in text.splitlines() if line.strip()}
+        with self._lock:
+            if post_key:
+                if post_key in self._seen_posts:
+                    self._seen_posts.move_to_end(post_key)
+                    return
+                self._seen_posts[post_key] = None
+                while len(self._seen_posts) > self.max_seen_posts:
+                    self._seen_posts.popitem(last=False)
+            counters = self._sources.pop(source, {})
+            for line in unique_lines:
+                counters[line] = counters.get(line, 0) + 1
+            if len(counters) > self.max_lines_per_source:
+                # Оставляем только самые частые строки
+                counters = dict(sorted(counters.items(), key=lambda item: item[1], reverse=True)[:self.max_lines_per_source // 2])
+            self._sources[source] = counters
+            while len(self._sources) > self.max_sources:
+                self._sources.popitem(last=False)
+
+    def remove(self, source: str, text: str) -> str:
+        """Удаляет из текста шаблонные строки источника и повторы строк внутри поста"""
+        with self._lock:
+            counters = dict(self._sources.get(source, {})) if source else {}
+
+        seen = set()
+        result = []
+        for line in text.splitlines():
+            normalized = self._normalize(line)
+            if normalized:
+                if normalized in seen:
+                    continue  # Повтор внутри одного поста
+                if counters.get(normalized, 0) >= self.min_posts:
+                    continue  # Шаблонная строка источника
+                seen.add(normalized)
+            result.append(line)
+        return "\n".join(result)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """Обрезает текст до max_tokens по границам предложений"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    paragraphs = []
+    used = 0
+    for paragraph in text.split("\n"):
+        sentences = []
+        for sentence in SENTENCE_SPLIT_RE.split(paragraph):
+            if not sentence.strip():
+                continue
+            sentence_tokens = count_tokens(sentence + " ", model)
+            if used + sentence_tokens > max_tokens:
+                if not paragraphs and not sentences:
+                    # Даже первое предложение не помещается - режем по словам
+                    return _truncate_words(sentence, max_tokens, model)
+                if sentences:
+                    paragraphs.append(" ".join(sentences))
+                return "\n".join(paragraphs).strip()
+            sentences.append(sentence)
+            used += sentence_tokens
+        paragraphs.append(" ".join(sentences))
+        used += 1  # перевод строки
+    return "\n".join(paragraphs).strip()
+
+
+def _truncate_words(text: str, max_tokens: int, model: str) -> str:
+    words = text.split()
+    result = []
+    used = 0
+    for word in words:
+        word_tokens = count_tokens(word + " ", model)
+        if used + word_tokens > max_tokens:
+            break
+        result.append(word)
+        used += word_tokens
+    return " ".join(result) + "…"
+
+
+class TokenAccounting:
+    """Учет токенов по всем запросам к GPT: сколько было, сколько отправлено, сколько сэкономлено"""
+
+    def __init__(self, report_every: int = 50):
+        self.report_every = report_every
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {
+            'requests': 0,
+            'original_tokens': 0,
+            'sent_tokens': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+        })
+        self._total_requests = 0
+
+    def record_input(self, label: str, original_tokens: int, sent_tokens: int) -> None:
+        with self._lock:
+            stats = self._stats[label]
+            stats['requests'] += 1
+            stats['original_tokens'] += original_tokens
+            stats['sent_tokens'] += sent_tokens
+            self._total_requests += 1
+            need_report = self.report_every and self._total_requests % self.report_every == 0
+
+        logger.info(f"🧮 [{label}] токены на входе: {original_tokens} -> {sent_tokens} (сэкономлено {original_tokens - sent_tokens})")
+        if need_report:
+            logger.info(self.format_report())
+
+    def record_usage(self, label: str, usage) -> None:
+        """Учитывает фактическое потребление по ответу API (response.usage)"""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        with self._lock:
+            stats = self._stats[label]
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+        logger.info(f"🧮 [{label}] фактически: prompt={prompt_tokens}, completion={completion_tokens}")
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """Возвращает копию статистики по меткам"""
+        with self._lock:
+            result = {}
+            for label, stats in self._stats.items():
+                result[label] = dict(stats)
+                result[label]['saved_tokens'] = stats['original_tokens'] - stats['sent_tokens']
+            return result
+
+    def format_report(self) -> str:
+        """Текстовый отчет о сэкономленных токенах"""
+        report = self.report()
+        if not report:
+            return "📊 Отчет по токенам: запросов еще не было"
+        lines = ["📊 Отчет по токенам GPT:"]
+        for label, stats in sorted(report.items()):
+            original = stats['original_tokens']
+            saved_percent = (stats['saved_tokens'] / original * 100) if original else 0.0
+            lines.append(
+                f"   {label}: запросов {stats['requests']}, вход {original} -> {stats['sent_tokens']} "
+                f"(сэкономлено {stats['saved_tokens']}, {saved_percent:.1f}%), "
+                f"prompt {stats['prompt_tokens']}, completion {stats['completion_tokens']}"
+            )
+        return "\n".join(lines)
+
+
+boilerplate_tracker = BoilerplateTracker()
+token_accounting = TokenAccounting(report_every=TOKEN_BUDGET_REPORT_EVERY)
+
+
+def prepare_text(text: str, max_tokens: int, label: str, source: Optional[str] = None,
+                 model: str = "gpt-4o", strip_footer: bool = True, post_key: Optional[str] = None) -> str:
+    """
+    Готовит текст к отправке в GPT: удаляет подписи и шаблонные строки,
+    обрезает до бюджета и записывает учет токенов.
+
+    Args:
+        text: исходный текст
+        max_tokens: бюджет токенов для текста
+        label: метка запроса для отчета (rewriter, blocked_check, ...)
+        source: источник поста (для поиска шаблонных строк)
+        model: модель, для которой считаются токены
+        strip_footer: удалять ли подписи канала в конце поста
+        post_key: ключ поста (ссылка на пост), чтобы учитывать его в статистике источника один раз
+    """
+    if not text:
+        return text
+
+    original_tokens = count_tokens(text, model)
+
+    prepared = text.strip()
+    if strip_footer:
+        prepared = strip_signatures(prepared)
+    if source:
+        boilerplate_tracker.observe(source, prepared, post_key)
+    prepared = boilerplate_tracker.remove(source, prepared)
+    prepared = truncate_to_tokens(prepared, max_tokens, model)
+
+    # Если после очистки ничего не осталось, отправляем исходный текст в пределах бюджета
+    if not prepared.strip():
+        prepared = truncate_to_tokens(text.strip(), max_tokens, model)
+
+    token_accounting.record_input(label, original_tokens, count_tokens(prepared, model))
+    return prepared
+
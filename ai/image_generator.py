@@ -1,54 +1,170 @@
-import openai
+import asyncio
+import hashlib
 import logging
 import os
-from config.settings import OPENAI_API_KEY
+import time
+from typing import Dict, Optional
+
+import aiohttp
+from openai import AsyncOpenAI
+
+from utils.metrics import span, openai_call
+from config.settings import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, DALLE_DEFAULT_MODEL,
+    IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_FILES, IMAGE_CACHE_MAX_MB, IMAGE_GENERATION_CONCURRENCY
+)
 
 logger = logging.getLogger(__name__)
 
+# Добавляем инструкцию избегать текста
+NO_TEXT_SUFFIX = ". NO TEXT, NO WRITING, NO LETTERS, NO SIGNS, NO BILLBOARDS, completely text-free image."
+
+
 class ImageGenerator:
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
-    async def generate_image(self, prompt, model="dall-e-3"):
+    """
+    Асинхронная генерация изображений через DALL-E с локальным кэшем.
+
+    Сгенерированные картинки сохраняются на диск под хэшем промпта (ссылки OpenAI живут около часа),
+    повторный запрос с тем же промптом отдается из кэша. Кэш ограничен по числу файлов и размеру,
+    старые файлы вытесняются по времени последнего использования.
+    """
+
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR, max_files: int = IMAGE_CACHE_MAX_FILES,
+                 max_bytes: int = IMAGE_CACHE_MAX_MB * 1024 * 1024, concurrency: int = IMAGE_GENERATION_CONCURRENCY):
+        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight: Dict[str, asyncio.Future] = {}  # одна генерация на промпт, даже при параллельных запросах
+        self._session: Optional[aiohttp.ClientSession] = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def prompt_hash(prompt: str) -> str:
+        return hashlib.sha256(prompt.strip().encode('utf-8')).hexdigest()
+
+    def cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    async def generate_image(self, prompt, model=DALLE_DEFAULT_MODEL):
         """
         Генерирует изображение используя DALL-E
-        
+
         Args:
             prompt (str): Описание изображения для генерации
             model (str): Модель для генерации ("dall-e-3" или "dall-e-2")
-            
+
         Returns:
-            str: URL сгенерированного изображения или None в случае ошибки
+            str: путь к локальному файлу изображения или None в случае ошибки
         """
+        key = self.prompt_hash(prompt)
+        path = self.cache_path(key)
+
+        if os.path.exists(path):
+            # Обновляем время доступа для вытеснения по LRU
+            os.utime(path, None)
+            logger.info(f"🖼️ Изображение взято из кэша: {path}")
+            return path
+
+        # Если такой же промпт уже генерируется, ждем его результат
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
         try:
-            # Добавляем инструкцию избегать текста
-            enhanced_prompt = f"{prompt}. NO TEXT, NO WRITING, NO LETTERS, NO SIGNS, NO BILLBOARDS, completely text-free image."
-            
-            # Пробуем сначала DALL-E 3
-            if model == "dall-e-3":
-                try:
-                    response = self.client.images.generate(
-                        model="dall-e-3",
-                        prompt=enhanced_prompt,
-                        size="1024x1024",
-                        quality="standard",
-                        n=1
-                    )
-                    return response.data[0].url
-                except Exception as e:
-                    logger.warning(f"Ошибка при использовании DALL-E 3: {e}. Пробуем DALL-E 2")
-                    model = "dall-e-2"
-            
-            # Если DALL-E 3 недоступен или произошла ошибка, используем DALL-E 2
-            if model == "dall-e-2":
-                response = self.client.images.generate(
-                    model="dall-e-2",
-                    prompt=enhanced_prompt,
+            result = await self._generate_and_store(prompt, model, path)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            logger.error(f"Ошибка при генерации изображения: {e}")
+            future.set_result(None)
+            return None
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+
+    async def _generate_and_store(self, prompt: str, model: str, path: str) -> Optional[str]:
+        enhanced_prompt = f"{prompt}{NO_TEXT_SUFFIX}"
+
+        async with self._semaphore:
+            started = time.monotonic()
+            async with openai_call("dalle.generate"):
+                url = await self._request_with_fallback(enhanced_prompt, model)
+            if not url:
+                return None
+            async with span("dalle.download"):
+                data = await self._download(url)
+            logger.info(f"🎨 Изображение сгенерировано за {time.monotonic() - started:.1f}с")
+
+        await asyncio.to_thread(self._write_atomic, path, data)
+        await asyncio.to_thread(self._evict)
+        return path
+
+    async def _request_with_fallback(self, prompt: str, model: str) -> Optional[str]:
+        """Пробуем сначала DALL-E 3, при ошибке - DALL-E 2"""
+        if model == "dall-e-3":
+            try:
+                response = await self.client.images.generate(
+                    model="dall-e-3",
+                    prompt=prompt,
                     size="1024x1024",
+                    quality="standard",
                     n=1
                 )
                 return response.data[0].url
-                
+            except Exception as e:
+                logger.warning(f"Ошибка при использовании DALL-E 3: {e}. Пробуем DALL-E 2")
+
+        response = await self.client.images.generate(
+            model="dall-e-2",
+            prompt=prompt,
+            size="1024x1024",
+            n=1
+        )
+        return response.data[0].url
+
+    async def _download(self, url: str) -> bytes:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        async with self._session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        """Удаляет самые давно использованные файлы, пока кэш не уложится в лимиты"""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.png'):
+                    continue
+                full_path = os.path.join(self.cache_dir, name)
+                stat = os.stat(full_path)
+                entries.append((stat.st_mtime, stat.st_size, full_path))
+
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            while entries and (len(entries) > self.max_files or total_bytes > self.max_bytes):
+                _, size, full_path = entries.pop(0)
+                os.remove(full_path)
+                total_bytes -= size
+                logger.debug(f"🗑️ Из кэша изображений удален {full_path}")
         except Exception as e:
-            logger.error(f"Ошибка при генерации изображения: {e}")
-            return None 
\ No newline at end of file
+            logger.error(f"Ошибка при очистке кэша изображений: {e}")
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        await self.client.close()
+
+
+image_generator = ImageGenerator()
@@ -3,7 +3,6 @@ from apscheduler.triggers.cron import CronTrigger
 import pytz
 from aiogram import Bot
 from aiogram.enums import ParseMode
-from parse_all_sources import parse_all_sources
 from database.DatabaseManager import DatabaseManager
 from ai.gpt.text_rewriter import rewriter
 import aiohttp
@@ -30,12 +29,7 @@ class Scheduled:
         self.admin = [5147054199]  # ID админа
         self.db_manager = DatabaseManager()
 
-        # Задача парсинга постов каждые 30 минут
-        self.scheduler.add_job(
-            self.parse_sources,
-            CronTrigger.from_crontab('*/1 * * * *', timezone=pytz.timezone('Europe/Moscow'))
-        )
-        logger.info("Планировщик настроен на парсинг каждые 30 минут")
+        # Парсинг источников выполняется отдельным процессом (run_parser.py), а не из бота
 
         # Задача обработки постов каждые 10 минут
         self.scheduler.add_job(
@@ -44,32 +38,6 @@ class Scheduled:
         )
         logger.info("Планировщик настроен на обработку постов каждые 10 минут")
 
-    async def parse_sources(self):
-        """Парсинг всех источников"""
-        try:
-            logger.info("Начинаем парсинг источников")
-            # Получаем все источники из links
-            sources = self.db_manager.get_links()
-            if not sources:
-                logger.info("Нет источников для парсинга")
-                return
-
-            # Запускаем парсинг
-            await parse_all_sources()
-            logger.info("Парсинг источников успешно завершен")
-
-        except Exception as e:
-            logger.error(f"Ошибка при парсинге источников: {str(e)}")
-            # Отправляем сообщение об ошибке админу
-            for admin_id in self.admin:
-                try:
-                    await self.bot.send_message(
-                        admin_id,
-                        f"❌ Произошла ошибка при парсинге источников: {str(e)}"
-                    )
-                except Exception as send_error:
-                    logger.error(f"Ошибка при отправке сообщения об ошибке админу {admin_id}: {str(send_error)}")
-
     async def run_parser(self):
         """
         Запускает парсер и отправляет результаты админу
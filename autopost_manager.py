@@ -7,30 +7,47 @@ import os
 import psutil
 import gc
 from aiogram import Bot
-from aiogram.types import URLInputFile, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
 from database.DatabaseManager import DatabaseManager
 from utils.telegram_client import TelegramClientManager
 from bot.keyboards.source_keyboards import get_autopost_approval_keyboard, get_post_approval_keyboard
 from ai.gpt.rewriter import rewriter
+from utils.metrics import span, QUEUE_DEPTH, PUBLISHED_POSTS, PUBLISH_FAILURES
+from utils.resolver_cache import resolve_bot_chat_id
+from utils.telegram_file_cache import send_cached_media
+from utils.bot_publisher import bot_publisher, PRIORITY_PUBLISH, PRIORITY_PREVIEW, PRIORITY_NOTIFY
+from utils.posting_planner import PostingPlanner
 import aiohttp
 import tempfile
 import pytz
 
 logger = logging.getLogger(__name__)
 
+QUEUE_STATUSES = ('pending', 'sent_for_approval', 'approved', 'published', 'cancelled', 'publishing', 'failed', 'expired')
+
 
 class AutopostManager:
     
-    def __init__(self, bot: Bot, db: DatabaseManager = None, telegram_manager: TelegramClientManager = None):
+    def __init__(self, bot: Bot, db: DatabaseManager = None, telegram_manager: TelegramClientManager = None,
+                 new_posts_listener=None):
         """Инициализация менеджера автопостинга"""
         self.bot = bot
         self.db = db or DatabaseManager()
         self.telegram_manager = telegram_manager
+        # Уведомления процесса парсера о новых постах (utils.db_notify.NotificationListener)
+        self.new_posts_listener = new_posts_listener
         self.is_running = False
         self.processing_posts: Set[str] = set()  # Для предотвращения дублирования
         self.autopost_task = None
         self.pending_posts_task = None
+        self.planner = PostingPlanner(self.db)
+        self.planner_task = None
+
+    def collect_queue_metrics(self):
+        """Обновляет метрику глубины очереди по статусам (вызывается перед выгрузкой метрик)"""
+        counts = self.db.get_queue_status_counts()
+        QUEUE_DEPTH.replace(({'status': status}, counts.get(status, 0)) for status in QUEUE_STATUSES)
 
     def is_post_used(self, text: str) -> bool:
         """Проверяет, был ли пост уже использован"""
@@ -53,6 +70,13 @@ class AutopostManager:
             self.is_running = True
             logger.info("🚀 Запуск цикла автопостинга")
             
+            # План публикаций на день строится до первого цикла, чтобы next_post_time брался из него
+            try:
+                await self.planner.plan_day()
+            except Exception as e:
+                logger.error(f"❌ Не удалось построить план публикаций: {e}")
+            self.planner_task = asyncio.create_task(self.planner.start_periodic())
+
             # Запускаем основной цикл автопостинга
             self.autopost_task = asyncio.create_task(self.process_autopost_cycle())
             
@@ -60,7 +84,7 @@ class AutopostManager:
             self.pending_posts_task = asyncio.create_task(self.process_pending_posts_cycle())
             
             # Ждем завершения задач
-            await asyncio.gather(self.autopost_task, self.pending_posts_task)
+            await asyncio.gather(self.autopost_task, self.pending_posts_task, self.planner_task)
             
         except Exception as e:
             logger.error(f"❌ Ошибка в цикле автопостинга: {e}")
@@ -74,6 +98,8 @@ class AutopostManager:
             self.autopost_task.cancel()
         if self.pending_posts_task:
             self.pending_posts_task.cancel()
+        if self.planner_task:
+            self.planner_task.cancel()
         logger.info("🛑 Автопостинг остановлен")
 
     async def process_autopost_cycle(self):
@@ -102,68 +128,87 @@ class AutopostManager:
                         logger.error(f"❌ Ошибка обработки группы {group['group_link']}: {e}")
                         continue
                 
-                # Пауза перед следующим циклом
-                await asyncio.sleep(30)  # Проверяем каждые 30 секунд
+                # Пауза перед следующим циклом: 30 секунд или раньше, если парсер сохранил новые посты
+                await self.wait_next_cycle(30)
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка в цикле автопостинга: {e}")
                 await asyncio.sleep(60)
 
+    async def wait_next_cycle(self, interval: float, min_pause: float = 5):
+        """Ждет interval секунд; уведомление о новых постах сокращает ожидание до min_pause"""
+        if not self.new_posts_listener:
+            await asyncio.sleep(interval)
+            return
+        await asyncio.sleep(min_pause)
+        if await self.new_posts_listener.wait(interval - min_pause):
+            logger.info("📬 Парсер сохранил новые посты, запускаем цикл автопостинга раньше")
+
     async def process_group_autopost(self, user_id: int, group_link: str, mode: str):
         """
         Обрабатывает автопостинг для группы, перебирая посты до первого успешного.
         """
+        with span("autopost.total", group=group_link, user=user_id, mode=mode):
+            await self._process_group_autopost(user_id, group_link, mode)
+
+    async def _process_group_autopost(self, user_id: int, group_link: str, mode: str):
+        labels = {'group': group_link, 'user': user_id}
         try:
             logger.info(f"🚀 Начинаем автопостинг для группы: {group_link} (режим: {mode})")
             
             # 1. Получаем до 10 постов-кандидатов
-            candidate_posts = self.db.get_multiple_theme_posts(user_id, group_link, limit=10)
+            with span("autopost.candidate_select", **labels):
+                candidate_posts = self.db.get_multiple_theme_posts(user_id, group_link, limit=10)
             if not candidate_posts:
                 logger.warning(f"🤷‍♂️ Не найдены посты-кандидаты для {group_link}")
                 return
 
             # 2. Получаем оригинальные тексты уже опубликованных сегодня постов
-            published_today = self.db.get_published_posts_today(group_link)
+            with span("autopost.published_today", **labels):
+                published_today = self.db.get_published_posts_today(group_link)
             published_texts = [p.get('text', '') for p in published_today]
             logger.info(f"📊 Найдено {len(candidate_posts)} кандидатов. Опубликовано сегодня: {len(published_today)}. Начинаем проверку на уникальность.")
 
             # 3. Перебираем кандидатов в поисках уникального
-            post_to_process = None
-            for post in candidate_posts:
-                is_duplicate = False
-                candidate_text = post.get('text', '')
-                if not candidate_text:
-                    continue
+            with span("autopost.dedupe", **labels):
+                post_to_process = None
+                for post in candidate_posts:
+                    is_duplicate = False
+                    candidate_text = post.get('text', '')
+                    if not candidate_text:
+                        continue
 
-                for published_text in published_texts:
-                    # Порог схожести можно настроить, 0.8 - довольно строгий
-                    if self.db.compare_texts(candidate_text, published_text, threshold=0.85):
-                        logger.info(f"   - Кандидат {post['post_link'][:40]}... похож на уже опубликованный пост. Пропускаем.")
-                        is_duplicate = True
-                        break
+                    for published_text in published_texts:
+                        # Порог схожести можно настроить, 0.8 - довольно строгий
+                        if self.db.compare_texts(candidate_text, published_text, threshold=0.85):
+                            logger.info(f"   - Кандидат {post['post_link'][:40]}... похож на уже опубликованный пост. Пропускаем.")
+                            is_duplicate = True
+                            break
                 
-                if not is_duplicate:
-                    logger.info(f"✅ Найден уникальный пост для обработки: {post['post_link']}")
-                    post_to_process = post
-                    break  # Нашли уникальный пост, выходим из цикла проверки
+                    if not is_duplicate:
+                        logger.info(f"✅ Найден уникальный пост для обработки: {post['post_link']}")
+                        post_to_process = post
+                        break  # Нашли уникальный пост, выходим из цикла проверки
 
             # 4. Если уникальный пост не найден после проверки всех кандидатов
             if not post_to_process:
                 logger.warning(f"🙅‍♂️ Уникальные посты не найдены для {group_link} после проверки {len(candidate_posts)} кандидатов.")
                 # Обновляем время, чтобы не проверять эту же группу слишком часто
-                self.db.update_next_post_time(group_link)
+                self.db.update_next_post_time(user_id, group_link)
                 return
 
             # 5. Обрабатываем найденный уникальный пост
             logger.info(f"✍️ Отправляем на переработку пост: {post_to_process['post_link']}")
             
-            rewriter_result = await rewriter(
-                text=post_to_process['text'],
-                post_link=post_to_process['post_link'],
-                user_id=user_id,
-                photo_url=post_to_process.get('photo_url'),
-                group_link=group_link
-            )
+            async with span("autopost.rewrite", **labels):
+                rewriter_result = await rewriter(
+                    text=post_to_process['text'],
+                    post_link=post_to_process['post_link'],
+                    user_id=user_id,
+                    photo_url=post_to_process.get('photo_url'),
+                    group_link=group_link,
+                    source_link=post_to_process.get('group_link')
+                )
             
             # Проверяем, заблокирован ли пост
             if rewriter_result.get('blocked'):
@@ -181,30 +226,32 @@ class AutopostManager:
             # 6. Отправляем на публикацию или на проверку
             scheduled_time = datetime.now(pytz.timezone('Europe/Moscow'))
             
-            queue_id = self.db.add_autopost_to_queue(
-                user_id=user_id,
-                group_link=group_link,
-                original_post_url=post_to_process['post_link'],
-                text=new_text,
-                image_url=rewriter_result.get('image_url'),
-                is_video=rewriter_result.get('is_video', False),
-                scheduled_time=scheduled_time,
-                mode=mode
-            )
+            with span("autopost.enqueue", **labels):
+                queue_id = self.db.add_autopost_to_queue(
+                    user_id=user_id,
+                    group_link=group_link,
+                    original_post_url=post_to_process['post_link'],
+                    text=new_text,
+                    image_url=rewriter_result.get('image_url'),
+                    is_video=rewriter_result.get('is_video', False),
+                    scheduled_time=scheduled_time,
+                    mode=mode
+                )
 
             if mode == 'automatic':
                 self.db.update_queue_status(queue_id, 'approved')
                 logger.info(f"✅ Пост ID {queue_id} для {group_link} добавлен и сразу одобрен.")
             else:
                 self.db.update_queue_status(queue_id, 'sent_for_approval')
-                await self.send_post_for_approval(
-                    user_id=user_id, 
-                    group_link=group_link, 
-                    text=new_text, 
-                    image_url=rewriter_result.get('image_url'), 
-                    is_video=rewriter_result.get('is_video', False),
-                    queue_id=queue_id
-                )
+                async with span("autopost.send_for_approval", **labels):
+                    await self.send_post_for_approval(
+                        user_id=user_id, 
+                        group_link=group_link, 
+                        text=new_text, 
+                        image_url=rewriter_result.get('image_url'), 
+                        is_video=rewriter_result.get('is_video', False),
+                        queue_id=queue_id
+                    )
                 logger.info(f"✅ Пост ID {queue_id} для {group_link} отправлен на одобрение.")
 
             # Помечаем исходный пост как использованный, чтобы не брать его снова
@@ -212,7 +259,7 @@ class AutopostManager:
             
             # Обновляем время следующего поста, чтобы предотвратить спам
             logger.info(f"⏰ Обновляем время следующего поста для группы {group_link}.")
-            self.db.update_next_post_time(group_link)
+            self.db.update_next_post_time(user_id, group_link)
 
         except Exception as e:
             logger.error(f"❌ Критическая ошибка в process_group_autopost для {group_link}: {e}")
@@ -240,55 +287,26 @@ class AutopostManager:
                 if os.path.exists(image_url):
                     # Локальный файл - проверяем его существование
                     if os.path.isfile(image_url):
-                        media_file = FSInputFile(image_url)
+                        media_file = image_url
                         logger.info(f"📁 Используем локальный файл: {image_url}")
                     else:
                         logger.warning(f"⚠️ Указанный путь не является файлом: {image_url}")
                 else:
                     # Это URL - проверяем, что это действительно URL
                     if image_url.startswith(('http://', 'https://')):
-                        media_file = URLInputFile(image_url)
+                        media_file = image_url
                         logger.info(f"🌐 Используем URL файл: {image_url}")
                     else:
                         logger.warning(f"⚠️ Некорректный URL или путь: {image_url}")
 
-            if media_file:
-                try:
-                    if is_video:
-                        await self.bot.send_video(
-                            user_id,
-                            media_file,
-                            caption=message_text,
-                            reply_markup=keyboard,
-                            parse_mode="Markdown"
-                        )
-                    else:
-                        await self.bot.send_photo(
-                            user_id,
-                            media_file,
-                            caption=message_text,
-                            reply_markup=keyboard,
-                            parse_mode="Markdown"
-                        )
-                    logger.info(f"✅ Пост с медиафайлом отправлен на одобрение (ID: {queue_id})")
-                except Exception as media_error:
-                    logger.error(f"Ошибка при отправке поста с медиафайлом (ID: {queue_id}): {media_error}")
-                    # Fallback: отправляем только текст
-                    await self.bot.send_message(
-                        user_id,
-                        message_text,
-                        reply_markup=keyboard,
-                        parse_mode="Markdown"
-                    )
-                    logger.info(f"✅ Пост без медиафайла отправлен на одобрение (ID: {queue_id})")
+            # Превью уступают очередь публикациям запланированных постов
+            with_media = await self._send_post(
+                user_id, message_text, media_file, 'video' if is_video else 'photo',
+                priority=PRIORITY_PREVIEW, reply_markup=keyboard
+            )
+            if with_media:
+                logger.info(f"✅ Пост с медиафайлом отправлен на одобрение (ID: {queue_id})")
             else:
-                # Отправляем только текст
-                await self.bot.send_message(
-                    user_id,
-                    message_text,
-                    reply_markup=keyboard,
-                    parse_mode="Markdown"
-                )
                 logger.info(f"✅ Пост без медиафайла отправлен на одобрение (ID: {queue_id})")
 
             if result:
@@ -309,20 +327,10 @@ class AutopostManager:
     async def publish_to_group(self, user_id: int, group_link: str, text: str, image_url: str = None, is_video: bool = False):
         """Публикует пост в группу и уведомляет пользователя."""
         try:
-            # Получаем telegram_id из group_link
-            try:
-                # Если ссылка вида https://t.me/channel_name
-                if 't.me/' in group_link:
-                    target_id = f"@{group_link.split('t.me/')[1]}"
-                # Если ссылка вида @channel_name
-                elif group_link.startswith('@'):
-                    target_id = group_link
-                # Если числовой ID
-                else:
-                    target_id = int(group_link)
-            except Exception as e:
-                logger.error(f"Некорректный формат group_link: {group_link} - {e}")
-                await self.bot.send_message(user_id, f"❌ Некорректный формат ссылки на группу: {group_link}")
+            # Получаем chat_id из group_link (через кэш разрешения имен)
+            target_id = await self.resolve_target(group_link)
+            if target_id is None:
+                await self.notify_user(user_id, f"❌ Группа не найдена или ссылка некорректна: {group_link}")
                 return False
 
             logger.info(f"Попытка публикации в: {target_id}")
@@ -330,35 +338,85 @@ class AutopostManager:
             media_to_send = None
             if image_url:
                 if os.path.exists(image_url) and os.path.isfile(image_url):
-                    media_to_send = FSInputFile(image_url)
+                    media_to_send = image_url
                     logger.info(f"🖼️ Используем локальный файл: {image_url}")
                 elif image_url.startswith(('http://', 'https://')):
-                    media_to_send = URLInputFile(image_url)
+                    media_to_send = image_url
                     logger.info(f"🖼️ Используем URL: {image_url}")
                 else:
                     logger.warning(f"⚠️ Файл не найден локально и не является валидным URL: {image_url}. Публикуем без медиа.")
 
-            if media_to_send:
-                try:
-                    # В текущей версии aiogram нет is_video в send_photo, 
-                    # и нет универсального send_media. Поэтому упрощаем до фото.
-                    # Если понадобится видео, нужно будет добавить отдельную логику.
-                    await self.bot.send_photo(target_id, media_to_send, caption=text, parse_mode="Markdown")
-                except Exception as media_error:
-                    logger.error(f"❌ Ошибка отправки медиафайла, пробуем отправить только текст. Ошибка: {media_error}")
-                    await self.bot.send_message(target_id, text, parse_mode="Markdown")
-            else:
+            if not media_to_send:
                 logger.info("📝 Публикуем без медиафайла")
-                await self.bot.send_message(target_id, text, parse_mode="Markdown")
+            # В текущей версии aiogram нет универсального send_media, поэтому медиа публикуется как фото
+            await self._send_post(target_id, text, media_to_send, 'photo', priority=PRIORITY_PUBLISH)
             
             logger.info(f"✅ Пост успешно опубликован в группе {group_link}")
             return True
 
         except Exception as e:
             logger.error(f"❌ Ошибка публикации в {group_link}: {e}")
-            await self.bot.send_message(user_id, f"❌ Не удалось опубликовать пост в группе {group_link}. Проверьте, что бот добавлен в администраторы с правами на публикацию.")
+            await self.notify_user(user_id, f"❌ Не удалось опубликовать пост в группе {group_link}. Проверьте, что бот добавлен в администраторы с правами на публикацию.")
             return False
 
+    async def _send_post(self, chat_id, text: str, media: str = None, kind: str = 'photo',
+                         priority: int = PRIORITY_PUBLISH, reply_markup=None) -> bool:
+        """
+        Отправляет пост через очередь издателя (лимиты Telegram, порядок сообщений в чате).
+        Медиа и запасная отправка только текста - одна задача, чтобы другие сообщения чата не вклинились между ними.
+        Возвращает True, если пост ушел с медиа.
+        """
+        async def send():
+            if media:
+                method = self.bot.send_video if kind == 'video' else self.bot.send_photo
+                try:
+                    # file_id сохраняется и переиспользуется при повторных отправках того же медиа
+                    await send_cached_media(lambda file: method(
+                        chat_id, file, caption=text, reply_markup=reply_markup, parse_mode="Markdown"
+                    ), media, kind)
+                    return True
+                except TelegramRetryAfter:
+                    raise
+                except Exception as media_error:
+                    logger.error(f"❌ Ошибка отправки медиафайла, отправляем только текст. Ошибка: {media_error}")
+            await self.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode="Markdown")
+            return False
+
+        return await bot_publisher.send(chat_id, send, priority)
+
+    async def notify_user(self, user_id: int, text: str):
+        """Служебное уведомление пользователю через очередь издателя (ниже приоритетом, чем посты)"""
+        try:
+            await bot_publisher.send(user_id, lambda: self.bot.send_message(user_id, text), PRIORITY_NOTIFY)
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+
+    async def resolve_target(self, group_link: str):
+        """
+        Возвращает chat_id группы для Bot API или None, если группа не найдена.
+        Числовой id берется из кэша разрешения имен, чтобы не разрешать username при каждой публикации.
+        """
+        if 't.me/' in group_link:
+            username = group_link.split('t.me/')[1].strip('/')
+        elif group_link.startswith('@'):
+            username = group_link[1:]
+        else:
+            try:
+                return int(group_link)
+            except ValueError:
+                logger.error(f"Некорректный формат group_link: {group_link}")
+                return None
+
+        try:
+            chat_id = await resolve_bot_chat_id(self.bot, username)
+            if chat_id is None:
+                logger.error(f"Группа {group_link} не найдена")
+            return chat_id
+        except Exception as e:
+            # Не удалось разрешить имя (сеть, лимиты) - публикуем по username, как раньше
+            logger.warning(f"Не удалось получить chat_id для {group_link}: {e}")
+            return f"@{username}"
+
     def get_media_file(self, media_path: str):
         """
         Проверяет существование медиафайла и возвращает его.
@@ -405,22 +463,26 @@ class AutopostManager:
                 
                 try:
                     # Публикуем пост
-                    published = await self.publish_post(group_link, post)
+                    async with span("autopost.publish", group=group_link):
+                        published = await self.publish_post(group_link, post)
                     
                     if published:
+                        PUBLISHED_POSTS.inc(group=group_link)
                         # Обновляем статус в очереди и добавляем в опубликованные
                         self.db.update_queue_status(post_id, 'published')
                         self.db.add_published_post(group_link, post.get('original_post_url', 'N/A'), post['post_text'])
                         
                         # Обновляем время следующего поста
-                        self.db.update_next_post_time(group_link)
+                        self.db.update_next_post_time(post['user_id'], group_link)
                         logger.info(f"✅ Пост ID {post_id} успешно опубликован в {group_link}.")
                     else:
+                        PUBLISH_FAILURES.inc(group=group_link)
                         # Если публикация не удалась
                         self.db.update_queue_status(post_id, 'failed')
                         logger.error(f"❌ Не удалось опубликовать пост ID {post_id} в {group_link}.")
                         
                 except Exception as e:
+                    PUBLISH_FAILURES.inc(group=group_link)
                     self.db.update_queue_status(post_id, 'failed')
                     logger.error(f"❌ Критическая ошибка при публикации поста ID {post_id}: {e}")
                 finally:
@@ -476,19 +538,9 @@ class AutopostManager:
             photo_url = post.get('post_image')  # Используем post_image из очереди
             post_link = post.get('original_post_url')  # Используем original_post_url из очереди
             
-            # Получаем telegram_id из group_link
-            try:
-                # Если ссылка вида https://t.me/channel_name
-                if 't.me/' in group_link:
-                    target_id = f"@{group_link.split('t.me/')[1]}"
-                # Если ссылка вида @channel_name
-                elif group_link.startswith('@'):
-                    target_id = group_link
-                # Если числовой ID
-                else:
-                    target_id = int(group_link)
-            except Exception as e:
-                logger.error(f"Некорректный формат group_link: {group_link} - {e}")
+            # Получаем chat_id из group_link (через кэш разрешения имен)
+            target_id = await self.resolve_target(group_link)
+            if target_id is None:
                 return False
 
             logger.info(f"Попытка публикации в: {target_id}")
@@ -496,26 +548,18 @@ class AutopostManager:
             media_to_send = None
             if photo_url:
                 if os.path.exists(photo_url) and os.path.isfile(photo_url):
-                    media_to_send = FSInputFile(photo_url)
+                    media_to_send = photo_url
                     logger.info(f"🖼️ Используем локальный файл: {photo_url}")
                 elif photo_url.startswith(('http://', 'https://')):
-                    media_to_send = URLInputFile(photo_url)
+                    media_to_send = photo_url
                     logger.info(f"🖼️ Используем URL: {photo_url}")
                 else:
                     logger.warning(f"⚠️ Файл не найден локально и не является валидным URL: {photo_url}. Публикуем без медиа.")
 
-            if media_to_send:
-                try:
-                    # В текущей версии aiogram нет is_video в send_photo, 
-                    # и нет универсального send_media. Поэтому упрощаем до фото.
-                    # Если понадобится видео, нужно будет добавить отдельную логику.
-                    await self.bot.send_photo(target_id, media_to_send, caption=text, parse_mode="Markdown")
-                except Exception as media_error:
-                    logger.error(f"❌ Ошибка отправки медиафайла, пробуем отправить только текст. Ошибка: {media_error}")
-                    await self.bot.send_message(target_id, text, parse_mode="Markdown")
-            else:
+            if not media_to_send:
                 logger.info("📝 Публикуем без медиафайла")
-                await self.bot.send_message(target_id, text, parse_mode="Markdown")
+            # В текущей версии aiogram нет универсального send_media, поэтому медиа публикуется как фото
+            await self._send_post(target_id, text, media_to_send, 'photo', priority=PRIORITY_PUBLISH)
             
             logger.info(f"✅ Пост успешно опубликован в группе {group_link}")
             # Добавляем запись о публикации
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сквозной бенчмарк задержек пайплайна переписывания.
+
+Запускает локальный fake OpenAI сервер, заполняет тестовую схему локального Postgres
+и многократно вызывает AutopostManager.process_group_autopost, измеряя время этапов:
+выбор кандидатов, проверка на дубликаты, проверка заблокированных тем, переписывание, постановка в очередь.
+
+Пример запуска (нужен локальный Postgres):
+    DB_HOST=localhost USER_DB=postgres USER_PWD=postgres BOT_TOKEN=x OPENAI_API_KEY=x \\
+        python -m benchmarks.bench_rewrite_pipeline --iterations 200 --latency lognormal:800:0.5 --rate-limit-rate 0.05
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import FakeOpenAIServer, build_arg_parser, config_from_args
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['candidate_select', 'dedupe', 'blocked_check', 'rewrite', 'enqueue', 'total']
+
+WORDS = (
+    "город власти жители парк дорога ремонт школа фестиваль погода транспорт больница "
+    "выставка спорт команда матч концерт театр музей улица проект строительство бюджет"
+).split()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class StageRecorder:
+    """Накапливает время этапов внутри одного прогона и хранит выборки по всем прогонам"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._current: Dict[str, float] = defaultdict(float)
+
+    def begin_run(self):
+        self._current = defaultdict(float)
+
+    def end_run(self, total: float):
+        # Проверка заблокированных тем выполняется внутри rewriter, вычитаем ее из переписывания
+        self._current['rewrite'] -= self._current['blocked_check']
+        self._current['total'] = total
+        for stage in STAGES:
+            self.samples[stage].append(self._current[stage])
+
+    def wrap_sync(self, stage: str, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._current[stage] += time.perf_counter() - start
+        return wrapper
+
+    def wrap_async(self, stage: str, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self._current[stage] += time.perf_counter() - start
+        return wrapper
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for stage in STAGES:
+            values = self.samples.get(stage, [])
+            result[stage] = {
+                'count': len(values),
+                'mean_ms': (sum(values) / len(values) * 1000) if values else 0.0,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+            }
+        return result
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(6, 14))
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def seed_database(db, user_id: int, group_link: str, sources: int, posts_per_source: int, published: int, seed: int):
+    """Создает тестовую схему и заполняет ее источниками, постами и уже опубликованными постами"""
+    rng = random.Random(seed)
+    db.init_db()
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            for table in ('posts', 'links', 'user_groups', 'autopost_settings', 'autopost_queue', 'published_posts'):
+                cur.execute(f"TRUNCATE {db.schema}.{table} RESTART IDENTITY")
+
+            themes = ['Новости']
+            cur.execute(
+                f"INSERT INTO {db.schema}.user_groups (user_id, group_link, themes) VALUES (%s, %s, %s)",
+                (user_id, group_link, themes)
+            )
+            cur.execute(f"""
+                INSERT INTO {db.schema}.autopost_settings
+                (user_id, group_link, mode, is_active, next_post_time, posts_count, blocked_topics)
+                VALUES (%s, %s, 'automatic', true, NOW(), 10, %s)
+            """, (user_id, group_link, 'реклама, казино'))
+
+            post_links = []
+            for i in range(sources):
+                source_link = f"https://t.me/bench_source_{i}"
+                cur.execute(
+                    f"INSERT INTO {db.schema}.links (user_id, link, themes) VALUES (%s, %s, %s)",
+                    (user_id, source_link, themes)
+                )
+                for j in range(posts_per_source):
+                    post_link = f"{source_link}/{j + 1}"
+                    post_links.append(post_link)
+                    cur.execute(f"""
+                        INSERT INTO {db.schema}.posts
+                        (group_link, post_link, text, date, likes, views, comments_count, comments_likes, photo_url, using_post)
+                        VALUES (%s, %s, %s, TO_CHAR(CURRENT_DATE, 'DD.MM.YYYY'), %s, %s, %s, 0, NULL, NULL)
+                    """, (source_link, post_link, random_text(rng, rng.randint(40, 250)),
+                          rng.randint(0, 500), rng.randint(0, 10000), rng.randint(0, 50)))
+
+            for post_link in rng.sample(post_links, min(published, len(post_links))):
+                cur.execute(f"""
+                    INSERT INTO {db.schema}.published_posts (group_link, text, post_link, post_date)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                """, (group_link, random_text(rng, 60), post_link))
+            conn.commit()
+    logger.info(f"🌱 Схема {db.schema} заполнена: {sources} источников, {sources * posts_per_source} постов, {published} опубликованных")
+
+
+def reset_candidates(db):
+    """Возвращает все посты в пул кандидатов перед очередным прогоном"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"UPDATE {db.schema}.posts SET using_post = NULL WHERE using_post IS NOT NULL")
+            conn.commit()
+
+
+def instrument(manager, recorder: StageRecorder):
+    """Оборачивает вызовы этапов таймерами"""
+    import autopost_manager
+    from database.DatabaseManager import DatabaseManager
+
+    db = manager.db
+    db.get_multiple_theme_posts = recorder.wrap_sync('candidate_select', db.get_multiple_theme_posts)
+    db.get_published_posts_today = recorder.wrap_sync('dedupe', db.get_published_posts_today)
+    db.compare_texts = recorder.wrap_sync('dedupe', db.compare_texts)
+    for name in ('add_autopost_to_queue', 'update_queue_status', 'mark_post_as_used', 'update_next_post_time'):
+        setattr(db, name, recorder.wrap_sync('enqueue', getattr(db, name)))
+
+    # rewriter создает собственный DatabaseManager, поэтому оборачиваем метод класса
+    DatabaseManager.check_content_blocked = recorder.wrap_async('blocked_check', DatabaseManager.check_content_blocked)
+    autopost_manager.rewriter = recorder.wrap_async('rewrite', autopost_manager.rewriter)
+
+
+def print_summary(summary: Dict[str, Dict[str, float]], server_stats: Dict[str, int]):
+    print()
+    print(f"{'этап':<18}{'n':>6}{'mean, ms':>12}{'p50, ms':>12}{'p95, ms':>12}{'p99, ms':>12}")
+    for stage in STAGES:
+        row = summary[stage]
+        print(f"{stage:<18}{row['count']:>6}{row['mean_ms']:>12.1f}{row['p50_ms']:>12.1f}{row['p95_ms']:>12.1f}{row['p99_ms']:>12.1f}")
+    print()
+    print(f"Fake OpenAI: {server_stats}")
+
+
+async def run_benchmark(args):
+    if args.schema == 'ii_rewriter':
+        raise SystemExit("Бенчмарк очищает таблицы схемы, используйте отдельную схему (--schema)")
+
+    # Модули загружают .env при импорте (с override), поэтому окружение выставляем после импорта
+    import ai.gpt.rewriter
+    from database.DatabaseManager import DatabaseManager
+    from autopost_manager import AutopostManager
+
+    server = FakeOpenAIServer(config_from_args(args))
+    base_url = await server.start()
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ['DB_SCHEMA'] = args.schema
+    ai.gpt.rewriter.OPENAI_BASE_URL = base_url
+
+    db = DatabaseManager()
+    if not args.skip_seed:
+        seed_database(db, args.user_id, args.group_link, args.sources, args.posts_per_source, args.published, args.seed or 0)
+
+    # В автоматическом режиме бот не используется: пост сразу одобряется в очереди
+    manager = AutopostManager(bot=None, db=db)
+    recorder = StageRecorder()
+    instrument(manager, recorder)
+
+    try:
+        for i in range(args.warmup + args.iterations):
+            reset_candidates(db)
+            recorder.begin_run()
+            start = time.perf_counter()
+            await manager.process_group_autopost(args.user_id, args.group_link, 'automatic')
+            elapsed = time.perf_counter() - start
+            if i >= args.warmup:
+                recorder.end_run(elapsed)
+    finally:
+        await server.stop()
+
+    summary = recorder.summary()
+    print_summary(summary, server.stats)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'stages': summary, 'server': server.stats, 'args': vars(args)}, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = build_arg_parser()
+    parser.description = "Бенчмарк пайплайна переписывания на fake OpenAI и локальном Postgres"
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--sources", type=int, default=20)
+    parser.add_argument("--posts-per-source", type=int, default=30)
+    parser.add_argument("--published", type=int, default=10)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--group-link", default="https://t.me/bench_target")
+    parser.add_argument("--schema", default="ii_rewriter_bench", help="схема Postgres для тестовых данных")
+    parser.add_argument("--skip-seed", action="store_true", help="не пересоздавать тестовые данные")
+    parser.add_argument("--json", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк скорости парсинга Telegram каналов (каналов в минуту).
+
+Сравнивает два режима:
+    per-source - как было раньше: на каждый канал новый клиент на том же файле сессии,
+                 start() -> get_entity/iter_messages -> disconnect(), все каналы через asyncio.gather;
+    shared     - один долгоживущий клиент парсера на все каналы и все циклы.
+
+Нужна авторизованная сессия парсера (TG_PARSER_SESSION_PATH) и TG_PARSER_API_ID/TG_PARSER_API_HASH.
+Пример:
+    BOT_TOKEN=x OPENAI_API_KEY=x python -m benchmarks.bench_telegram_parsing \\
+        --channels durov telegram tginfo --rounds 3 --mode both
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_rewrite_pipeline import percentile
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_timed(parser, channel: str, latencies: List[float], errors: List[str]):
+    start = time.perf_counter()
+    try:
+        await parser.get_posts(channel)
+    except Exception as e:
+        errors.append(f"{channel}: {e}")
+    finally:
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_per_source(channels: List[str], rounds: int, concurrency: int) -> Dict:
+    """Старое поведение: отдельный клиент (и start/disconnect) на каждый канал"""
+    from parsers.telegram.get_tg_posts import TelegramPostParser
+    from parsers.telegram.shared_client import SharedParserClient
+
+    latencies, errors = [], []
+
+    async def one(channel):
+        client = SharedParserClient(concurrency=concurrency)
+        parser = TelegramPostParser(shared_client=client)
+        start = time.perf_counter()
+        try:
+            await parser.ensure_started()
+            await parser.get_posts(channel)
+        except Exception as e:
+            errors.append(f"{channel}: {e}")
+        finally:
+            await client.close()
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(one(channel) for channel in channels))
+    return summarize("per-source", channels, rounds, time.perf_counter() - started, latencies, errors)
+
+
+async def run_shared(channels: List[str], rounds: int, concurrency: int) -> Dict:
+    """Новое поведение: один подключенный клиент на все каналы и циклы"""
+    from parsers.telegram.get_tg_posts import TelegramPostParser
+    from parsers.telegram.shared_client import SharedParserClient
+
+    client = SharedParserClient(concurrency=concurrency)
+    parser = TelegramPostParser(shared_client=client)
+    latencies, errors = [], []
+
+    started = time.perf_counter()
+    try:
+        await parser.ensure_started()
+        for _ in range(rounds):
+            await asyncio.gather(*(fetch_timed(parser, channel, latencies, errors) for channel in channels))
+    finally:
+        await client.close()
+    return summarize("shared", channels, rounds, time.perf_counter() - started, latencies, errors)
+
+
+def summarize(mode: str, channels: List[str], rounds: int, elapsed: float, latencies: List[float], errors: List[str]) -> Dict:
+    processed = len(channels) * rounds
+    return {
+        'mode': mode,
+        'channels': processed,
+        'elapsed_s': elapsed,
+        'channels_per_minute': processed / elapsed * 60 if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+    }
+
+
+def print_result(result: Dict):
+    print(
+        f"{result['mode']:<12} каналов: {result['channels']:>5}  время: {result['elapsed_s']:>7.1f}с  "
+        f"каналов/мин: {result['channels_per_minute']:>7.1f}  p50: {result['p50_ms']:>7.0f}мс  "
+        f"p95: {result['p95_ms']:>7.0f}мс  ошибок: {result['errors']}"
+    )
+    for sample in result['error_samples']:
+        print(f"    ! {sample}")
+
+
+def load_channels(args) -> List[str]:
+    if args.channels:
+        return args.channels
+    from database.DatabaseManager import DatabaseManager
+    sources = DatabaseManager().get_active_sources()
+    return [s['source_url'].rstrip('/').split('/')[-1] for s in sources if 't.me' in s['source_url']][:args.limit]
+
+
+async def run_benchmark(args):
+    channels = load_channels(args)
+    if not channels:
+        raise SystemExit("Нет каналов для бенчмарка: передайте --channels или добавьте Telegram источники в БД")
+
+    results = []
+    if args.mode in ('per-source', 'both'):
+        results.append(await run_per_source(channels, args.rounds, args.concurrency))
+    if args.mode in ('shared', 'both'):
+        results.append(await run_shared(channels, args.rounds, args.concurrency))
+
+    print()
+    for result in results:
+        print_result(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'results': results, 'args': vars(args)}, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк парсинга Telegram каналов: клиент на источник vs общий клиент")
+    parser.add_argument("--channels", nargs="*", help="юзернеймы каналов (по умолчанию - Telegram источники из БД)")
+    parser.add_argument("--limit", type=int, default=30, help="сколько источников брать из БД")
+    parser.add_argument("--rounds", type=int, default=3, help="сколько циклов парсинга подряд")
+    parser.add_argument("--concurrency", type=int, default=4, help="лимит параллельных запросов общего клиента")
+    parser.add_argument("--mode", choices=("per-source", "shared", "both"), default="both")
+    parser.add_argument("--json", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк парсинга VK источников (источников в минуту и число HTTP запросов).
+
+Сравнивает два режима на одном и том же лимите запросов в секунду:
+    sequential - как было раньше: для каждого источника отдельно разрешается владелец
+                 и вызывается wall.get, источники обрабатываются по очереди;
+    batched    - владельцы разрешаются пачками (groups.getById/users.get),
+                 стены запрашиваются по 25 штук за один execute.
+
+По умолчанию поднимает локальный fake VK сервер (benchmarks.fake_vk_server) с лимитом 3 rps.
+Пример:
+    BOT_TOKEN=x OPENAI_API_KEY=x python -m benchmarks.bench_vk_parsing --sources 100 1000 --mode both
+Против настоящего VK (осторожно с лимитами):
+    ... --api-url https://api.vk.com/method --names durov apiclub
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import LatencyDistribution
+from benchmarks.fake_vk_server import FakeVKConfig, FakeVKServer
+
+logger = logging.getLogger(__name__)
+
+
+def make_names(count: int, user_share: float, missing_share: float) -> List[str]:
+    """Имена источников для fake сервера: группы, страницы пользователей и несуществующие"""
+    names = []
+    users = int(count * user_share)
+    missing = int(count * missing_share)
+    for i in range(count):
+        if i < users:
+            names.append(f"user{i + 1}")
+        elif i < users + missing:
+            names.append(f"nosuch{i + 1}")
+        else:
+            names.append(f"group{i + 1}")
+    return names
+
+
+def new_client(args):
+    from parsers.vk.async_vk_client import AsyncVKClient
+    from utils.resolver_cache import ResolverCache
+
+    # Кэш только в памяти и пустой для каждого прогона: сравниваем холодный старт
+    return AsyncVKClient(
+        args.token,
+        api_url=args.api_url,
+        requests_per_second=args.rps,
+        cache=ResolverCache(persistent=False)
+    )
+
+
+async def run_sequential(names: List[str], args) -> Dict:
+    """Старое поведение: владелец и wall.get для каждого источника по очереди"""
+    from parsers.vk.async_vk_client import VKAPIError
+
+    client = new_client(args)
+    errors, fetched = [], 0
+    started = time.perf_counter()
+    try:
+        for name in names:
+            try:
+                owner = (await client.resolve_owners([name])).get(name)
+                if not owner:
+                    errors.append(f"{name}: владелец не найден")
+                    continue
+                await client.call('wall.get', owner_id=owner['id'], count=args.count)
+                fetched += 1
+            except VKAPIError as e:
+                errors.append(f"{name}: {e}")
+    finally:
+        await client.close()
+    return summarize("sequential", names, fetched, time.perf_counter() - started, errors)
+
+
+async def run_batched(names: List[str], args) -> Dict:
+    """Новое поведение: пакетное разрешение владельцев и execute по 25 wall.get"""
+    client = new_client(args)
+    errors = []
+    started = time.perf_counter()
+    try:
+        owners = await client.resolve_owners(names)
+        owner_ids = {name: owner['id'] for name, owner in owners.items() if owner}
+        errors.extend(f"{name}: владелец не найден" for name in names if name not in owner_ids)
+        walls = await client.wall_get_many(owner_ids.values(), count=args.count)
+        fetched = sum(1 for owner_id in owner_ids.values() if walls.get(owner_id) is not None)
+    finally:
+        await client.close()
+    return summarize("batched", names, fetched, time.perf_counter() - started, errors)
+
+
+def summarize(mode: str, names: List[str], fetched: int, elapsed: float, errors: List[str]) -> Dict:
+    return {
+        'mode': mode,
+        'sources': len(names),
+        'fetched': fetched,
+        'elapsed_s': elapsed,
+        'sources_per_minute': len(names) / elapsed * 60 if elapsed else 0.0,
+        'errors': len(errors),
+        'error_samples': errors[:3],
+    }
+
+
+def print_result(result: Dict):
+    print(
+        f"{result['mode']:<11} источников: {result['sources']:>5}  стен получено: {result['fetched']:>5}  "
+        f"время: {result['elapsed_s']:>7.1f}с  источников/мин: {result['sources_per_minute']:>8.1f}  "
+        f"запросов: {result.get('requests', '-'):>5}  rate limited: {result.get('rate_limited', '-')}  "
+        f"ошибок: {result['errors']}"
+    )
+    for sample in result['error_samples']:
+        print(f"    ! {sample}")
+
+
+async def run_mode(runner, names: List[str], args, server) -> Dict:
+    before = dict(server.stats) if server else None
+    result = await runner(names, args)
+    if server:
+        result['requests'] = server.stats['requests'] - before['requests']
+        result['rate_limited'] = server.stats['rate_limited'] - before['rate_limited']
+    return result
+
+
+async def run_benchmark(args):
+    server = None
+    if not args.api_url:
+        server = FakeVKServer(FakeVKConfig(latency=LatencyDistribution.parse(args.latency), rps=args.server_rps, seed=args.seed))
+        args.api_url = await server.start()
+
+    results = []
+    try:
+        for size in args.sources:
+            names = args.names or make_names(size, args.user_share, args.missing_share)
+            if args.mode in ('sequential', 'both'):
+                results.append(await run_mode(run_sequential, names, args, server))
+                print_result(results[-1])
+            if args.mode in ('batched', 'both'):
+                results.append(await run_mode(run_batched, names, args, server))
+                print_result(results[-1])
+            if args.names:
+                break
+    finally:
+        if server:
+            await server.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'results': results, 'args': vars(args)}, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк парсинга VK: по одному запросу на источник vs execute пачками")
+    parser.add_argument("--sources", type=int, nargs="+", default=[100, 1000], help="размеры наборов источников")
+    parser.add_argument("--names", nargs="*", help="реальные имена источников (вместо сгенерированных)")
+    parser.add_argument("--mode", choices=("sequential", "batched", "both"), default="both")
+    parser.add_argument("--api-url", default=None, help="адрес VK API (по умолчанию - локальный fake сервер)")
+    parser.add_argument("--token", default=os.getenv("VK_TOKEN", "fake"))
+    parser.add_argument("--rps", type=float, default=3.0, help="лимит запросов клиента в секунду")
+    parser.add_argument("--server-rps", type=float, default=3.0, help="лимит fake сервера (0 - без лимита)")
+    parser.add_argument("--latency", default="lognormal:120:0.4", help="задержка fake сервера, мс")
+    parser.add_argument("--count", type=int, default=20, help="постов на стену")
+    parser.add_argument("--user-share", type=float, default=0.05, help="доля страниц пользователей")
+    parser.add_argument("--missing-share", type=float, default=0.02, help="доля несуществующих источников")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.ERROR,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
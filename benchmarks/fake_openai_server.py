@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальный OpenAI-совместимый сервер для бенчмарков и ручной проверки без реального API.
+
+Поддерживает /v1/chat/completions и /v1/images/generations, настраиваемое
+распределение задержек, долю ошибок 500 и долю ответов 429 (с заголовком Retry-After).
+
+Запуск:
+    python -m benchmarks.fake_openai_server --port 8089 --latency lognormal:800:0.5 --error-rate 0.02 --rate-limit-rate 0.05
+Затем в .env:
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# PNG 1x1, который отдается вместо сгенерированной картинки
+FAKE_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+@dataclass
+class LatencyDistribution:
+    """
+    Распределение задержки ответа, в миллисекундах.
+
+    Формат строки:
+        fixed:300            - всегда 300 мс
+        uniform:200:1500     - равномерно от 200 до 1500 мс
+        normal:800:200       - нормальное, среднее 800, отклонение 200
+        lognormal:800:0.5    - логнормальное с медианой 800 и sigma 0.5 (длинный хвост, как у GPT)
+    """
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        parts = spec.split(":")
+        kind = parts[0]
+        values = [float(v) for v in parts[1:]] + [0.0, 0.0]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Неизвестное распределение задержки: {kind}")
+        return cls(kind, values[0], values[1])
+
+    def sample(self, rng: random.Random) -> float:
+        """Возвращает задержку в секундах"""
+        if self.kind == "fixed":
+            ms = self.a
+        elif self.kind == "uniform":
+            ms = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            ms = rng.gauss(self.a, self.b)
+        else:
+            ms = self.a * rng.lognormvariate(0, self.b)
+        return max(ms, 0.0) / 1000
+
+
+@dataclass
+class FakeOpenAIConfig:
+    latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    image_latency: LatencyDistribution = field(default_factory=lambda: LatencyDistribution("fixed", 5000))
+    error_rate: float = 0.0  # доля ответов 500
+    rate_limit_rate: float = 0.0  # доля ответов 429
+    retry_after: float = 1.0  # значение заголовка Retry-After для 429, секунд
+    reply_chars: int = 900  # длина ответа для переписывания
+    seed: int = None
+
+
+class FakeOpenAIServer:
+    """OpenAI-совместимый HTTP сервер с управляемыми задержками и ошибками"""
+
+    def __init__(self, config: FakeOpenAIConfig = None):
+        self.config = config or FakeOpenAIConfig()
+        self.rng = random.Random(self.config.seed)
+        self.stats: Dict[str, int] = {'requests': 0, 'ok': 0, 'errors': 0, 'rate_limited': 0}
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post('/v1/chat/completions', self.chat_completions)
+        self.app.router.add_post('/v1/images/generations', self.images_generations)
+        self.app.router.add_get('/fake-images/{name}', self.fake_image)
+
+    async def _maybe_fail(self):
+        """Случайно возвращает 429 или 500 согласно настройкам"""
+        roll = self.rng.random()
+        if roll < self.config.rate_limit_rate:
+            self.stats['rate_limited'] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"Retry-After": str(self.config.retry_after)}
+            )
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.stats['errors'] += 1
+            return web.json_response(
+                {"error": {"message": "Internal server error (fake)", "type": "server_error"}},
+                status=500
+            )
+        return None
+
+    def _reply_for(self, messages) -> str:
+        prompt = "\n".join(str(m.get('content', '')) for m in messages)
+        # Проверка заблокированных тем ожидает короткий ответ ДА/НЕТ
+        if 'Ответь только "ДА"' in prompt:
+            return "НЕТ"
+        # Детектор рекламы ожидает JSON
+        if '"is_ad"' in prompt:
+            return '{"is_ad": false, "confidence": 0.9, "reason": "fake"}'
+        body = ("Тестовый переписанный текст новости. " * 40)[:max(self.config.reply_chars - 30, 0)]
+        return f"*Тестовый заголовок*\n{body}"
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        payload = await request.json()
+        await asyncio.sleep(self.config.latency.sample(self.rng))
+
+        failure = await self._maybe_fail()
+        if failure is not None:
+            return failure
+
+        messages = payload.get('messages', [])
+        content = self._reply_for(messages)
+        prompt_chars = sum(len(str(m.get('content', ''))) for m in messages)
+        self.stats['ok'] += 1
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get('model', 'gpt-4o'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_chars // 3,
+                "completion_tokens": len(content) // 3,
+                "total_tokens": prompt_chars // 3 + len(content) // 3,
+            },
+        })
+
+    async def images_generations(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        await request.json()
+        await asyncio.sleep(self.config.image_latency.sample(self.rng))
+
+        failure = await self._maybe_fail()
+        if failure is not None:
+            return failure
+
+        self.stats['ok'] += 1
+        host = request.host
+        return web.json_response({
+            "created": int(time.time()),
+            "data": [{"url": f"http://{host}/fake-images/{uuid.uuid4().hex}.png"}],
+        })
+
+    async def fake_image(self, request: web.Request) -> web.Response:
+        """Отдает минимальный PNG по ссылке из ответа images/generations"""
+        return web.Response(body=FAKE_PNG, content_type='image/png')
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер в текущем event loop и возвращает base_url"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        real_port = site._server.sockets[0].getsockname()[1]
+        base_url = f"http://{host}:{real_port}/v1"
+        logger.info(f"🧪 Fake OpenAI сервер запущен: {base_url}")
+        return base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:800:0.5", help="распределение задержки чата, мс")
+    parser.add_argument("--image-latency", default="uniform:3000:8000", help="распределение задержки генерации картинок, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+def config_from_args(args) -> FakeOpenAIConfig:
+    return FakeOpenAIConfig(
+        latency=LatencyDistribution.parse(args.latency),
+        image_latency=LatencyDistribution.parse(args.image_latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+async def main():
+    args = build_arg_parser().parse_args()
+    server = FakeOpenAIServer(config_from_args(args))
+    await server.start(args.host, args.port)
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info(f"📊 Fake OpenAI: {server.stats}")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
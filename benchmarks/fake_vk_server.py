@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальный сервер, имитирующий VK API, для бенчмарков парсинга без реального токена.
+
+Поддерживает groups.getById, users.get, wall.get и execute (только вызовы API.wall.get),
+настраиваемую задержку и лимит запросов в секунду: при превышении отвечает ошибкой 6,
+как настоящий VK.
+
+Группы называются group<N> (id = N), пользователи - user<N>; остальные имена не существуют.
+
+Запуск:
+    python -m benchmarks.fake_vk_server --port 8090 --latency lognormal:120:0.4 --rps 3
+Затем в .env:
+    VK_API_URL=http://127.0.0.1:8090/method
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from benchmarks.fake_openai_server import LatencyDistribution
+
+logger = logging.getLogger(__name__)
+
+EXECUTE_WALL_GET = re.compile(r"API\.wall\.get\((\{.*?\})\)")
+EXECUTE_LIMIT = 25
+
+
+@dataclass
+class FakeVKConfig:
+    latency: LatencyDistribution = field(default_factory=lambda: LatencyDistribution("fixed", 100))
+    rps: float = 3.0  # лимит запросов в секунду, 0 - без лимита
+    posts_per_wall: int = 20
+    yesterday_share: float = 0.3  # доля постов на стене, опубликованных вчера
+    seed: int = None
+
+
+class FakeVKServer:
+    """HTTP сервер с подмножеством VK API и лимитом запросов как у настоящего"""
+
+    def __init__(self, config: FakeVKConfig = None):
+        self.config = config or FakeVKConfig()
+        self.rng = random.Random(self.config.seed)
+        self.stats: Dict[str, int] = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'wall_get_calls': 0}
+        self._recent = deque()
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post('/method/{name}', self.method)
+
+    def _rate_limited(self) -> bool:
+        if not self.config.rps:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1.0:
+            self._recent.popleft()
+        if len(self._recent) >= self.config.rps:
+            return True
+        self._recent.append(now)
+        return False
+
+    @staticmethod
+    def _error(code: int, message: str) -> web.Response:
+        return web.json_response({"error": {"error_code": code, "error_msg": message}})
+
+    @staticmethod
+    def _parse_id(name: str, prefix: str) -> Optional[int]:
+        name = str(name).strip().lower()
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            return int(name[len(prefix):])
+        return None
+
+    def _wall(self, owner_id: int, count: int, offset: int = 0) -> Optional[Dict]:
+        if owner_id == 0:
+            return None
+        yesterday = datetime.now() - timedelta(days=1)
+        items = []
+        for i in range(offset, offset + min(count, 100)):
+            if i >= self.config.posts_per_wall:
+                break
+            when = yesterday if self.rng.random() < self.config.yesterday_share else datetime.now()
+            items.append({
+                'id': self.config.posts_per_wall - i,
+                'owner_id': owner_id,
+                'date': int(when.replace(hour=12).timestamp()),
+                'text': f"Тестовый пост {owner_id}_{i}",
+                'likes': {'count': self.rng.randint(0, 500)},
+                'comments': {'count': self.rng.randint(0, 50)},
+            })
+        return {'count': self.config.posts_per_wall, 'items': items}
+
+    def _groups_get_by_id(self, params) -> object:
+        names = (params.get('group_ids') or params.get('group_id') or '').split(',')
+        groups = []
+        for name in names:
+            group_id = self._parse_id(name, 'group')
+            if group_id is not None:
+                groups.append({'id': group_id, 'name': f"Группа {group_id}", 'screen_name': f"group{group_id}"})
+        if not groups:
+            return self._error(100, "One of the parameters specified was missing or invalid: group_ids is undefined")
+        return groups
+
+    def _users_get(self, params) -> List[Dict]:
+        users = []
+        for name in (params.get('user_ids') or '').split(','):
+            user_id = self._parse_id(name, 'user')
+            if user_id is not None:
+                users.append({'id': user_id, 'first_name': 'Тест', 'last_name': str(user_id), 'screen_name': f"user{user_id}"})
+        return users
+
+    def _execute(self, params) -> web.Response:
+        calls = [json.loads(raw) for raw in EXECUTE_WALL_GET.findall(params.get('code', ''))]
+        if len(calls) > EXECUTE_LIMIT:
+            return self._error(13, "Runtime error occurred during code invocation: too many API calls")
+        response, errors = [], []
+        for call in calls:
+            self.stats['wall_get_calls'] += 1
+            wall = self._wall(int(call.get('owner_id', 0)), int(call.get('count', 20)), int(call.get('offset', 0)))
+            if wall is None:
+                response.append(False)
+                errors.append({'method': 'wall.get', 'error_code': 100, 'error_msg': 'owner_id is invalid'})
+            else:
+                response.append(wall)
+        payload = {'response': response}
+        if errors:
+            payload['execute_errors'] = errors
+        return web.json_response(payload)
+
+    async def method(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        name = request.match_info['name']
+        params = dict(await request.post())
+        rate_limited = self._rate_limited()
+        await asyncio.sleep(self.config.latency.sample(self.rng))
+
+        if rate_limited:
+            self.stats['rate_limited'] += 1
+            return self._error(6, "Too many requests per second")
+
+        if name == 'execute':
+            result = self._execute(params)
+        elif name == 'wall.get':
+            self.stats['wall_get_calls'] += 1
+            wall = self._wall(int(params.get('owner_id', 0)), int(params.get('count', 20)), int(params.get('offset', 0)))
+            result = wall if wall is not None else self._error(100, "owner_id is invalid")
+        elif name == 'groups.getById':
+            result = self._groups_get_by_id(params)
+        elif name == 'users.get':
+            result = self._users_get(params)
+        else:
+            result = self._error(3, f"Unknown method passed: {name}")
+
+        if isinstance(result, web.Response):
+            return result
+        self.stats['ok'] += 1
+        return web.json_response({'response': result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер в текущем event loop и возвращает адрес для VK_API_URL"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        real_port = site._server.sockets[0].getsockname()[1]
+        api_url = f"http://{host}:{real_port}/method"
+        logger.info(f"🧪 Fake VK сервер запущен: {api_url}")
+        return api_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Локальный сервер, имитирующий VK API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", default="lognormal:120:0.4", help="распределение задержки ответа, мс")
+    parser.add_argument("--rps", type=float, default=3.0, help="лимит запросов в секунду (0 - без лимита)")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+async def main():
+    args = build_arg_parser().parse_args()
+    server = FakeVKServer(FakeVKConfig(latency=LatencyDistribution.parse(args.latency), rps=args.rps, seed=args.seed))
+    await server.start(args.host, args.port)
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info(f"📊 Fake VK: {server.stats}")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -19,6 +19,7 @@ from bot.keyboards.source_keyboards import (
     get_autopost_settings_keyboard, get_themes_keyboard, get_recheck_admin_keyboard
 )
 from utils.validators import validate_url
+from utils.resolver_cache import resolve_bot_chat_id
 from config.settings import THEMES, ALLOWED_DOMAINS
 
 logger = logging.getLogger(__name__)
@@ -53,6 +54,7 @@ class SourceStates(StatesGroup):
     manage_select_sources = State()
     waiting_for_role_edit = State()
     waiting_for_blocked_topics_edit = State()
+    waiting_for_posts_per_day_edit = State()
     waiting_for_autopost_edit = State()
 
     # Редактирование поста из очереди
@@ -223,7 +225,13 @@ async def check_admin_rights(bot, channel: str) -> bool:
         channel_id = channel
 
     try:
-        member = await bot.get_chat_member(chat_id=channel_id, user_id=bot.id)
+        # chat_id берем из кэша разрешения имен; отрицательный результат перепроверяем,
+        # т.к. пользователь мог только что добавить бота в канал
+        chat_id = await resolve_bot_chat_id(bot, channel_id, retry_negative=True)
+        if chat_id is None:
+            logger.warning(f"Канал {channel_id} не найден")
+            return False
+        member = await bot.get_chat_member(chat_id=chat_id, user_id=bot.id)
         if isinstance(member, (types.ChatMemberOwner, types.ChatMemberAdministrator)):
             if member.can_post_messages:
                 return True
@@ -604,7 +612,8 @@ async def _show_autopost_settings_menu(event: Union[CallbackQuery, Message], use
             f"**Режим:** {mode}\n"
             f"**Источники:** {source_mode_text}\n"
             f"**Отдельная роль:** {role_text}\n"
-            f"**Запретные темы:** {topics_text}\n\n"
+            f"**Запретные темы:** {topics_text}\n"
+            f"**Публикаций в день:** {settings.get('posts_per_day')}\n\n"
             "Выберите действие:")
 
     keyboard = get_autopost_settings_keyboard(group_link, settings.get('is_active'), settings.get('mode'))
@@ -732,6 +741,23 @@ async def manage_topics_start(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
+@router.callback_query(F.data.startswith("manage_ppd_"))
+async def manage_posts_per_day_start(callback: CallbackQuery, state: FSMContext):
+    group_link = callback.data.replace("manage_ppd_", "")
+    db = DatabaseManager()
+    settings = db.get_autopost_settings_for_group(callback.from_user.id, group_link) or {}
+
+    await state.set_state(SourceStates.waiting_for_posts_per_day_edit)
+    await state.update_data(group_link=group_link)
+    await callback.message.edit_text(
+        f"Сейчас для `{group_link}` публикаций в день: {settings.get('posts_per_day')}\n\n"
+        "Отправьте новое число от 1 до 48. Посты распределяются равномерно по рабочим часам, "
+        "план на сегодня перестроится в течение нескольких минут.",
+        reply_markup=get_cancel_keyboard("back_to_group_settings"),
+        parse_mode="Markdown"
+    )
+    await callback.answer()
+
 @router.message(SourceStates.waiting_for_role_edit)
 async def manage_role_input(message: Message, state: FSMContext):
     data = await state.get_data()
@@ -762,6 +788,29 @@ async def manage_topics_input(message: Message, state: FSMContext):
     await message.answer("✅ Запретные темы обновлены.")
     await _show_autopost_settings_menu(message, user_id, group_link, state)
 
+@router.message(SourceStates.waiting_for_posts_per_day_edit)
+async def manage_posts_per_day_input(message: Message, state: FSMContext):
+    data = await state.get_data()
+    group_link = data.get("group_link")
+    user_id = message.from_user.id
+    db = DatabaseManager()
+
+    try:
+        posts_per_day = int(message.text.strip())
+        updated = db.set_posts_per_day(user_id, group_link, posts_per_day)
+    except (ValueError, AttributeError):
+        await message.answer("❌ Введите число от 1 до 48.")
+        return
+
+    if not updated:
+        await message.answer("❌ Настройки для этого паблика не найдены. Возможно, они были удалены.")
+        await manage_autopost_start(message, state)
+        return
+
+    # План перестраивает PostingPlanner при следующей проверке: posts_per_day отличается от сохраненного плана
+    await message.answer(f"✅ Публикаций в день: {posts_per_day}. План на сегодня будет перестроен.")
+    await _show_autopost_settings_menu(message, user_id, group_link, state)
+
 @router.callback_query(F.data == "manage_back_to_mode", SourceStates.manage_source_mode)
 async def manage_back_from_source_selection_mode(callback: CallbackQuery, state: FSMContext):
     """(MANAGE) Навигация: от выбора режима источников назад к настройкам группы."""
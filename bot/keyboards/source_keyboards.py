@@ -156,6 +156,7 @@ def get_autopost_settings_keyboard(group_link: str, is_active: bool, mode: str):
         [InlineKeyboardButton(text="🗂 Выбрать источники", callback_data=f"manage_sources_{group_link}")],
         [InlineKeyboardButton(text="👤 Изменить роль GPT", callback_data=f"manage_role_{group_link}")],
         [InlineKeyboardButton(text="🚫 Запретные темы", callback_data=f"manage_topics_{group_link}")],
+        [InlineKeyboardButton(text="📅 Публикаций в день", callback_data=f"manage_ppd_{group_link}")],
         [InlineKeyboardButton(text="🗑 Удалить настройку", callback_data=f"delete_autopost_{group_link}")],
         [InlineKeyboardButton(text="⬅️ Назад к списку", callback_data="back_to_autopost_management")]
     ]
@@ -14,6 +14,23 @@ if not BOT_TOKEN:
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY не найден в переменных окружения. Добавьте OPENAI_API_KEY=ваш_ключ_api в файл .env")
+# Адрес OpenAI-совместимого API (можно указать локальный тестовый сервер из benchmarks/fake_openai_server.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# Бюджет токенов для запросов к GPT
+REWRITER_MAX_INPUT_TOKENS = int(os.getenv("REWRITER_MAX_INPUT_TOKENS", "1200"))  # текст новости
+REWRITER_MAX_ROLE_TOKENS = int(os.getenv("REWRITER_MAX_ROLE_TOKENS", "400"))  # роль пользователя
+REWRITER_MAX_OUTPUT_TOKENS = int(os.getenv("REWRITER_MAX_OUTPUT_TOKENS", "800"))  # ~1000 символов ответа с запасом
+BLOCK_CHECK_MAX_INPUT_TOKENS = int(os.getenv("BLOCK_CHECK_MAX_INPUT_TOKENS", "800"))
+AD_CHECK_MAX_INPUT_TOKENS = int(os.getenv("AD_CHECK_MAX_INPUT_TOKENS", "800"))
+TOKEN_BUDGET_REPORT_EVERY = int(os.getenv("TOKEN_BUDGET_REPORT_EVERY", "50"))  # отчет о сэкономленных токенах каждые N запросов
+
+# Метрики: как часто писать сводку длительностей этапов в лог, секунд (0 - не писать)
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", "600"))
+# HTTP-эндпоинт /metrics в формате Prometheus
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
 
 # Настройки базы данных
 DATABASE_PATH = "sources.db"
@@ -35,13 +52,77 @@ THEMES: List[str] = [
 
 # Настройки парсеров
 VK_API_VERSION = "5.131"
+# Адрес VK API (можно указать локальный тестовый сервер из benchmarks/fake_vk_server.py)
+VK_API_URL = os.getenv("VK_API_URL", "https://api.vk.com/method")
+VK_REQUESTS_PER_SECOND = float(os.getenv("VK_REQUESTS_PER_SECOND", "3"))  # лимит VK для пользовательского токена
+VK_EXECUTE_BATCH = 25  # максимум вызовов API внутри одного execute
+VK_WALL_COUNT = int(os.getenv("VK_WALL_COUNT", "100"))  # постов на страницу wall.get (максимум VK - 100)
+VK_MAX_PAGES = int(os.getenv("VK_MAX_PAGES", "5"))  # сколько страниц стены листать за опрос в поисках курсора
 TG_API_ID = os.getenv("TG_API_ID")
 TG_API_HASH = os.getenv("TG_API_HASH")
 TG_SESSION_PATH = os.getenv('TG_SESSION_PATH', 'bot_session')  # Путь к файлу сессии
+TG_BOT_POOL_SIZE = int(os.getenv("TG_BOT_POOL_SIZE", "2"))  # клиентов бота с постоянными сессиями для отправки
 
 # Настройки Telegram API для парсера (отдельное приложение)
 TG_PARSER_API_ID = os.getenv("TG_PARSER_API_ID")
 TG_PARSER_API_HASH = os.getenv("TG_PARSER_API_HASH")
+TG_PARSER_SESSION_PATH = os.getenv(
+    "TG_PARSER_SESSION_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'parser_user_session')
+)
+TG_PARSER_CONCURRENCY = int(os.getenv("TG_PARSER_CONCURRENCY", "4"))  # одновременных get_entity/iter_messages
+# Кэш разрешения имен (username канала -> entity, короткое имя VK -> owner_id)
+RESOLVER_CACHE_TTL = int(os.getenv("RESOLVER_CACHE_TTL", str(7 * 24 * 3600)))  # секунд, для найденных
+RESOLVER_NEGATIVE_TTL = int(os.getenv("RESOLVER_NEGATIVE_TTL", "3600"))  # секунд, для ненайденных
+# file_id отправленных ботом медиа не устаревают, срок нужен только чтобы таблица не росла бесконечно
+TG_FILE_ID_TTL = int(os.getenv("TG_FILE_ID_TTL", str(90 * 24 * 3600)))  # секунд
+# Редкий проход обновления метрик (просмотры, реакции, комментарии) недавних постов
+TG_METRICS_REFRESH_INTERVAL = int(os.getenv("TG_METRICS_REFRESH_INTERVAL", "3600"))  # секунд
+TG_METRICS_REFRESH_DAYS = int(os.getenv("TG_METRICS_REFRESH_DAYS", "2"))  # за сколько дней обновлять посты
+# Окно обновления метрик в часах (по умолчанию - TG_METRICS_REFRESH_DAYS дней), для Telegram и VK
+METRICS_REFRESH_HOURS = int(os.getenv("METRICS_REFRESH_HOURS", str(TG_METRICS_REFRESH_DAYS * 24)))
+TG_METRICS_BATCH = 100  # id сообщений в одном GetMessagesViewsRequest/GetMessagesReactionsRequest
+VK_GET_BY_ID_BATCH = 100  # максимум постов в одном wall.getById
+# Потоковое сохранение постов: источники кладут пачки в очередь, писатель сохраняет их по мере поступления
+PARSE_QUEUE_MAXSIZE = int(os.getenv("PARSE_QUEUE_MAXSIZE", "50"))  # пачек в очереди, дальше источники ждут
+PARSE_FLUSH_SIZE = int(os.getenv("PARSE_FLUSH_SIZE", "200"))  # максимум постов в одной записи в БД
+# Адаптивная частота опроса источников: активные чаще, "спящие" реже, в пределах [MIN, MAX]
+SOURCE_POLL_MIN_INTERVAL = int(os.getenv("SOURCE_POLL_MIN_INTERVAL", "120"))  # секунд
+SOURCE_POLL_MAX_INTERVAL = int(os.getenv("SOURCE_POLL_MAX_INTERVAL", "3600"))  # секунд, каждый источник не реже
+SOURCE_POLL_TARGET_POSTS = float(os.getenv("SOURCE_POLL_TARGET_POSTS", "1"))  # сколько новых постов ждем за опрос
+SOURCE_POLL_BATCH_LIMIT = int(os.getenv("SOURCE_POLL_BATCH_LIMIT", "200"))  # максимум источников за один тик
+SOURCE_SCHEDULER_TICK = int(os.getenv("SOURCE_SCHEDULER_TICK", "30"))  # секунд между проверками расписания
+# Отдельный процесс парсера (run_parser.py): пульс в БД, перезапуск супервизором, сигнал боту о новых постах
+PARSER_WORKER_ID = os.getenv("PARSER_WORKER_ID", "parser")
+PARSER_HEARTBEAT_INTERVAL = int(os.getenv("PARSER_HEARTBEAT_INTERVAL", "30"))  # секунд
+PARSER_HEARTBEAT_TIMEOUT = int(os.getenv("PARSER_HEARTBEAT_TIMEOUT", "300"))  # без пульса дольше - перезапуск
+PARSER_RESTART_BACKOFF_MAX = int(os.getenv("PARSER_RESTART_BACKOFF_MAX", "300"))  # секунд между перезапусками
+PARSER_METRICS_PORT = int(os.getenv("PARSER_METRICS_PORT", "9109"))
+NEW_POSTS_CHANNEL = os.getenv("NEW_POSTS_CHANNEL", "new_posts")  # канал LISTEN/NOTIFY PostgreSQL
+# Планировщик запросов Telethon: лимиты по методам (запросов в секунду на аккаунт) и по чатам
+TG_METHOD_RATES = {
+    "send": float(os.getenv("TG_SEND_RATE", "1")),  # отправка сообщений и файлов
+    "resolve": float(os.getenv("TG_RESOLVE_RATE", "0.2")),  # get_entity / ResolveUsername - самый "дорогой" метод
+    "history": float(os.getenv("TG_HISTORY_RATE", "3")),  # iter_messages / get_messages
+    "default": float(os.getenv("TG_DEFAULT_RATE", "5")),
+}
+TG_ENTITY_MIN_INTERVAL = {
+    "send": float(os.getenv("TG_SEND_CHAT_INTERVAL", "3")),  # секунд между отправками в один чат
+}
+TG_PARSE_MAX_FLOOD_WAIT = int(os.getenv("TG_PARSE_MAX_FLOOD_WAIT", "60"))  # дольше - источник откладывается целиком
+TG_PUBLISH_MAX_FLOOD_WAIT = int(os.getenv("TG_PUBLISH_MAX_FLOOD_WAIT", "600"))  # публикацию ждем дольше
+# Автопостинг: рабочие часы (по Москве) и дневной план публикаций (utils/posting_planner.py)
+AUTOPOST_WORK_START_HOUR = int(os.getenv("AUTOPOST_WORK_START_HOUR", "6"))
+AUTOPOST_WORK_END_HOUR = int(os.getenv("AUTOPOST_WORK_END_HOUR", "23"))
+AUTOPOST_POSTS_PER_DAY = int(os.getenv("AUTOPOST_POSTS_PER_DAY", "10"))  # по умолчанию для групп без своей настройки
+AUTOPOST_SLOT_JITTER_MINUTES = int(os.getenv("AUTOPOST_SLOT_JITTER_MINUTES", "15"))  # случайный сдвиг слота
+AUTOPOST_PLAN_CHECK_INTERVAL = int(os.getenv("AUTOPOST_PLAN_CHECK_INTERVAL", "300"))  # секунд между проверками плана
+AUTOPOST_PLAN_KEEP_DAYS = int(os.getenv("AUTOPOST_PLAN_KEEP_DAYS", "7"))  # сколько дней хранить прошлые планы
+# Лимиты отправки сообщений бота через Bot API (utils/bot_publisher.py)
+BOT_GLOBAL_MESSAGES_PER_SECOND = float(os.getenv("BOT_GLOBAL_MESSAGES_PER_SECOND", "30"))  # на бота во все чаты
+BOT_GROUP_MESSAGES_PER_MINUTE = float(os.getenv("BOT_GROUP_MESSAGES_PER_MINUTE", "20"))  # в одну группу или канал
+BOT_PRIVATE_MESSAGES_PER_SECOND = float(os.getenv("BOT_PRIVATE_MESSAGES_PER_SECOND", "1"))  # в один личный чат
+BOT_MAX_RETRY_AFTER = int(os.getenv("BOT_MAX_RETRY_AFTER", "600"))  # секунд; дольше - сообщение не повторяем
 
 VK_TOKEN = os.getenv("VK_TOKEN")
 # Настройки валидации
@@ -51,12 +132,46 @@ ALLOWED_DOMAINS = ["vk.com", "t.me"]
 ALLOWED_FILE_TYPES = [".txt", ".xlsx", ".xls"]
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
+# Общая HTTP-сессия (utils/http_session.py) и кэш скачанных медиа
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))  # соединений всего
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))  # соединений к одному хосту
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))  # секунд
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "60"))  # секунд на запрос целиком
+HTTP_CONNECT_TIMEOUT = int(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))  # секунд на подключение
+MEDIA_FETCH_MAX_MB = float(os.getenv("MEDIA_FETCH_MAX_MB", "10"))  # Telegram не принимает фото больше 10 MB
+MEDIA_BYTES_CACHE_MB = float(os.getenv("MEDIA_BYTES_CACHE_MB", "64"))
+MEDIA_BYTES_CACHE_TTL = int(os.getenv("MEDIA_BYTES_CACHE_TTL", "900"))  # секунд
+
 # Яндекс.Диск настройки
 YANDEX_DISK_TOKEN = os.getenv('YANDEX_DISK_TOKEN')
+YANDEX_DISK_API_URL = os.getenv("YANDEX_DISK_API_URL", "https://cloud-api.yandex.net/v1/disk")
+YANDEX_UPLOAD_CONCURRENCY = int(os.getenv("YANDEX_UPLOAD_CONCURRENCY", "4"))  # одновременных загрузок файлов
+YANDEX_UPLOAD_CHUNK_SIZE = int(os.getenv("YANDEX_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # байт, чтение файла при загрузке
+YANDEX_UPLOAD_TIMEOUT = int(os.getenv("YANDEX_UPLOAD_TIMEOUT", "600"))  # секунд на загрузку одного файла
+# Срок жизни прямой ссылки на скачивание, если Яндекс не указал его в самой ссылке (параметр expires)
+YANDEX_DIRECT_LINK_TTL = int(os.getenv("YANDEX_DIRECT_LINK_TTL", "3600"))  # секунд
+# Дедупликация медиа: изображения с перцептивными хэшами, отличающимися не больше чем на столько бит, считаются одинаковыми
+MEDIA_PHASH_MAX_DISTANCE = int(os.getenv("MEDIA_PHASH_MAX_DISTANCE", "4"))
+# Скачивание видео через yt-dlp: каждое задание - отдельный процесс
+VIDEO_DOWNLOAD_WORKERS = int(os.getenv("VIDEO_DOWNLOAD_WORKERS", "2"))  # одновременных процессов скачивания
+VIDEO_DOWNLOAD_QUEUE = int(os.getenv("VIDEO_DOWNLOAD_QUEUE", "50"))  # заданий в очереди, остальные отклоняются
+VIDEO_DOWNLOAD_TIMEOUT = int(os.getenv("VIDEO_DOWNLOAD_TIMEOUT", "600"))  # секунд на одно задание
+VIDEO_MAX_SIZE_MB = float(os.getenv("VIDEO_MAX_SIZE_MB", "200"))  # видео больше не скачиваются
+# Очистка старых медиа на Яндекс.Диске: папки с датой старше MEDIA_RETENTION_DAYS удаляются
+MEDIA_RETENTION_DAYS = int(os.getenv("MEDIA_RETENTION_DAYS", "7"))
+MEDIA_RETENTION_FOLDERS = [folder.strip() for folder in os.getenv("MEDIA_RETENTION_FOLDERS", "/tg_media,/vk_videos,/media").split(",") if folder.strip()]
+MEDIA_RETENTION_INTERVAL = int(os.getenv("MEDIA_RETENTION_INTERVAL", str(6 * 3600)))  # секунд между запусками
+MEDIA_RETENTION_CONCURRENCY = int(os.getenv("MEDIA_RETENTION_CONCURRENCY", "8"))  # одновременных удалений
 
 # Настройки для хранения фотографий
 TEMP_PHOTO_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp', 'photos')
 os.makedirs(TEMP_PHOTO_DIR, exist_ok=True)
 
 # Настройки для DALL-E
-DALLE_DEFAULT_MODEL = "dall-e-3"  # или "dall-e-2" если нужно использовать более старую версию 
\ No newline at end of file
+DALLE_DEFAULT_MODEL = "dall-e-3"  # или "dall-e-2" если нужно использовать более старую версию
+IMAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp', 'generated_images')
+IMAGE_CACHE_MAX_FILES = int(os.getenv("IMAGE_CACHE_MAX_FILES", "500"))
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "1024"))
+IMAGE_GENERATION_CONCURRENCY = int(os.getenv("IMAGE_GENERATION_CONCURRENCY", "2"))  # одновременных запросов к DALL-E
+# Генерировать картинку для постов без фото из источника
+GENERATE_IMAGES_FOR_TEXT_POSTS = os.getenv("GENERATE_IMAGES_FOR_TEXT_POSTS", "false").lower() in ("1", "true", "yes") 
\ No newline at end of file
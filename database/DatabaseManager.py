@@ -1,6 +1,8 @@
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
 import pytz  # Добавляем импорт для работы с часовыми поясами
@@ -9,6 +11,8 @@ import os
 from dotenv import load_dotenv
 import asyncio
 import concurrent.futures
+from utils.metrics import timed, openai_call, DB_QUERIES, DB_CONNECTIONS, TEXT_COMPARISONS
+from config.settings import AUTOPOST_WORK_START_HOUR, AUTOPOST_WORK_END_HOUR, AUTOPOST_POSTS_PER_DAY
 
 # Загружаем переменные окружения
 load_dotenv(override=True)
@@ -24,6 +28,18 @@ except (ImportError, OSError):
 
 logger = logging.getLogger(__name__)
 
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает выполненные запросы для метрик"""
+
+    def execute(self, query, vars=None):
+        DB_QUERIES.inc()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        DB_QUERIES.inc()
+        return super().executemany(query, vars_list)
+
+
 def env(key):
     import os
     return os.environ.get(key)
@@ -31,13 +47,13 @@ def env(key):
 class DatabaseManager:
     def __init__(self):
         self.conn_params = {
-            "host": "80.74.24.141",
-            "port": 5432,
-            "database": "mydb",
+            "host": os.getenv('DB_HOST', "80.74.24.141"),
+            "port": int(os.getenv('DB_PORT', 5432)),
+            "database": os.getenv('DB_NAME', "mydb"),
             "user": os.getenv('USER_DB'),
             "password": os.getenv('USER_PWD')
         }
-        self.schema = "ii_rewriter"
+        self.schema = os.getenv('DB_SCHEMA', "ii_rewriter")
 
     def init_db(self):
         """Инициализация базы данных - создание схемы и необходимых таблиц"""
@@ -212,6 +228,21 @@ class DatabaseManager:
                     """)
                     logger.info("Добавлено поле posts_count в таблицу autopost_settings")
 
+                # Добавляем поле posts_per_day если его нет (для существующих таблиц)
+                cur.execute(f"""
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_schema = '{self.schema}' 
+                    AND table_name = 'autopost_settings' 
+                    AND column_name = 'posts_per_day'
+                """)
+                if not cur.fetchone():
+                    cur.execute(f"""
+                        ALTER TABLE {self.schema}.autopost_settings 
+                        ADD COLUMN posts_per_day INTEGER CHECK (posts_per_day BETWEEN 1 AND 48)
+                    """)
+                    logger.info("Добавлено поле posts_per_day в таблицу autopost_settings")
+
                 # Добавляем поле blocked_topics если его нет (для существующих таблиц)
                 cur.execute(f"""
                     SELECT column_name 
@@ -295,11 +326,116 @@ class DatabaseManager:
                     ON {self.schema}.published_posts(group_link, post_date)
                 """)
 
+                # Индекс для проверки существования поста при сохранении и обновлении метрик
+                cur.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_posts_post_link
+                    ON {self.schema}.posts(post_link)
+                """)
+
+                # Курсоры источников: последний полученный id сообщения, чтобы забирать только новые посты
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.source_cursors (
+                        source_url TEXT PRIMARY KEY,
+                        last_message_id BIGINT NOT NULL DEFAULT 0,
+                        last_fetched_at TIMESTAMP,
+                        last_metrics_refresh_at TIMESTAMP
+                    )
+                """)
+
+                # Кэш разрешения имен: username канала -> id/access_hash, короткое имя VK -> owner_id и т.п.
+                # resolved = false - отрицательный результат (имя не найдено), тоже кэшируется
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.resolver_cache (
+                        kind TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        value TEXT,
+                        resolved BOOLEAN NOT NULL DEFAULT true,
+                        expires_at TIMESTAMP NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (kind, key)
+                    )
+                """)
+
+                # Состояние адаптивного планировщика опроса источников
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.source_schedule (
+                        source_url TEXT PRIMARY KEY,
+                        rate DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        hourly TEXT,
+                        last_polled_at TIMESTAMPTZ,
+                        next_poll_at TIMESTAMPTZ,
+                        backoff_until TIMESTAMPTZ,
+                        errors INTEGER NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+
+                # Пульс отдельного процесса парсера (run_parser.py)
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.parser_state (
+                        worker_id TEXT PRIMARY KEY,
+                        pid INTEGER,
+                        status TEXT,
+                        started_at TIMESTAMPTZ,
+                        heartbeat_at TIMESTAMPTZ,
+                        last_cycle_at TIMESTAMPTZ,
+                        cycles INTEGER NOT NULL DEFAULT 0,
+                        saved_posts BIGINT NOT NULL DEFAULT 0
+                    )
+                """)
+
+                # Реестр загруженных медиа: одинаковый файл из разных каналов хранится на Яндекс.Диске один раз
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.media_registry (
+                        sha256 TEXT PRIMARY KEY,
+                        phash BIGINT,
+                        media_type TEXT,
+                        size_bytes BIGINT,
+                        remote_path TEXT NOT NULL,
+                        public_url TEXT,
+                        ref_count INTEGER NOT NULL DEFAULT 1,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_media_registry_phash
+                    ON {self.schema}.media_registry(phash) WHERE phash IS NOT NULL
+                """)
+                # Ключи источника медиа (id файла Telegram, ссылка на VK видео) - проверяются до скачивания
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.media_sources (
+                        source_key TEXT PRIMARY KEY,
+                        sha256 TEXT NOT NULL REFERENCES {self.schema}.media_registry(sha256) ON DELETE CASCADE,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+
+                # Дневной план публикаций: слоты времени каждой группы на день (utils/posting_planner.py)
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.posting_plan (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        group_link TEXT NOT NULL,
+                        plan_date DATE NOT NULL,
+                        slot_time TIMESTAMP NOT NULL,
+                        posts_per_day INTEGER NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'done', 'skipped')),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE(user_id, group_link, plan_date, slot_time)
+                    )
+                """)
+                cur.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_posting_plan_group_slot
+                    ON {self.schema}.posting_plan(group_link, status, slot_time)
+                """)
+
                 conn.commit()
                 logger.info("База данных успешно инициализирована")
 
     def get_connection(self):
-        return psycopg2.connect(**self.conn_params)
+        DB_CONNECTIONS.inc()
+        return psycopg2.connect(**self.conn_params, cursor_factory=CountingCursor)
 
     def get_active_autopost_groups(self):
         """Получает список активных групп для автопостинга"""
@@ -309,8 +445,8 @@ class DatabaseManager:
                 moscow_tz = pytz.timezone('Europe/Moscow')
                 now_moscow = datetime.now(moscow_tz)
                 
-                # Проверяем рабочее время (6:00 - 23:00)
-                if not (6 <= now_moscow.hour < 23):
+                # Проверяем рабочее время (по умолчанию 6:00 - 23:00)
+                if not (AUTOPOST_WORK_START_HOUR <= now_moscow.hour < AUTOPOST_WORK_END_HOUR):
                     logger.info(f"⏰ Сейчас не рабочее время: {now_moscow.strftime('%H:%M')}")
                     return []
                 
@@ -369,13 +505,14 @@ class DatabaseManager:
                 links = [row[0] for row in cur.fetchall()]
                 return links
 
+    @timed("db.save_posts")
     def save_posts_to_db(self, posts):
-        # Проверка существования поста
-        check_query = f"""
-            SELECT 1 FROM {self.schema}.posts 
-            WHERE text = %s AND post_link = %s
-            LIMIT 1
         """
+        Сохраняет посты: новые добавляет (using_post = NULL), у существующих обновляет метрики.
+        Существующие посты определяются одним запросом на всю пачку.
+        """
+        if not posts:
+            return
 
         # Запрос на вставку нового поста
         insert_query = f"""
@@ -384,7 +521,7 @@ class DatabaseManager:
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NULL)
         """
 
-        # Запрос на обновление метрик существующего поста
+        # Запрос на обновление метрик существующего поста (using_post не трогаем)
         update_query = f"""
             UPDATE {self.schema}.posts 
             SET 
@@ -399,62 +536,353 @@ class DatabaseManager:
 
         with self.get_connection() as conn:
             with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT post_link, text FROM {self.schema}.posts
+                    WHERE post_link = ANY(%s)
+                """, ([post['post_link'] for post in posts],))
+                existing = set(cur.fetchall())
+
+                to_insert = []
+                to_update = []
                 for post in posts:
-                    # Проверяем, существует ли пост
-                    cur.execute(check_query, (post['text'], post['post_link']))
-                    exists = cur.fetchone()
+                    metrics = (
+                        post.get('likes', 0),
+                        post.get('views', 0),
+                        post.get('comments_count', 0),
+                        post.get('comments_likes', 0),
+                    )
+                    if (post['post_link'], post['text']) in existing:
+                        to_update.append(metrics + (post['date'], post.get('photo_url'), post['text'], post['post_link']))
+                    else:
+                        to_insert.append((post['group_link'], post['post_link'], post['text'], post['date'])
+                                         + metrics + (post.get('photo_url'),))
+                        existing.add((post['post_link'], post['text']))
+
+                if to_insert:
+                    cur.executemany(insert_query, to_insert)
+                if to_update:
+                    cur.executemany(update_query, to_update)
+                conn.commit()
+                logger.info(f"💾 Посты сохранены: новых {len(to_insert)}, обновлено {len(to_update)}")
+
+    def get_source_cursors(self) -> Dict[str, Dict]:
+        """Возвращает курсоры всех источников: {source_url: {last_message_id, last_fetched_at, last_metrics_refresh_at}}"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT source_url, last_message_id, last_fetched_at, last_metrics_refresh_at
+                    FROM {self.schema}.source_cursors
+                """)
+                return {
+                    row[0]: {
+                        'last_message_id': row[1],
+                        'last_fetched_at': row[2],
+                        'last_metrics_refresh_at': row[3],
+                    }
+                    for row in cur.fetchall()
+                }
+
+    def update_source_cursors(self, cursors: Dict[str, int]) -> None:
+        """Сдвигает курсоры источников {source_url: last_message_id} (курсор только растет)"""
+        if not cursors:
+            return
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(f"""
+                    INSERT INTO {self.schema}.source_cursors (source_url, last_message_id, last_fetched_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source_url) DO UPDATE SET
+                        last_message_id = GREATEST({self.schema}.source_cursors.last_message_id, EXCLUDED.last_message_id),
+                        last_fetched_at = EXCLUDED.last_fetched_at
+                """, list(cursors.items()))
+                conn.commit()
+
+    def mark_metrics_refreshed(self, source_urls: List[str]) -> None:
+        """Отмечает время последнего обновления метрик постов источников"""
+        if not source_urls:
+            return
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(f"""
+                    INSERT INTO {self.schema}.source_cursors (source_url, last_metrics_refresh_at)
+                    VALUES (%s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source_url) DO UPDATE SET last_metrics_refresh_at = EXCLUDED.last_metrics_refresh_at
+                """, [(url,) for url in source_urls])
+                conn.commit()
+
+    def get_resolver_entry(self, kind: str, key: str) -> Optional[Dict]:
+        """Возвращает неистекшую запись кэша разрешения имен или None"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT value, resolved, expires_at FROM {self.schema}.resolver_cache
+                    WHERE kind = %s AND key = %s AND expires_at > CURRENT_TIMESTAMP
+                """, (kind, key))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                return {'value': row[0], 'resolved': row[1], 'expires_at': row[2]}
+
+    def set_resolver_entry(self, kind: str, key: str, value: Optional[str], resolved: bool, ttl_seconds: int) -> None:
+        """Сохраняет результат разрешения имени (в том числе отрицательный) на ttl_seconds"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {self.schema}.resolver_cache (kind, key, value, resolved, expires_at, updated_at)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second', CURRENT_TIMESTAMP)
+                    ON CONFLICT (kind, key) DO UPDATE SET
+                        value = EXCLUDED.value,
+                        resolved = EXCLUDED.resolved,
+                        expires_at = EXCLUDED.expires_at,
+                        updated_at = EXCLUDED.updated_at
+                """, (kind, key, value, resolved, ttl_seconds))
+                conn.commit()
+
+    def delete_resolver_entry(self, kind: str, key: str) -> None:
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {self.schema}.resolver_cache WHERE kind = %s AND key = %s", (kind, key))
+                conn.commit()
+
+    def get_source_schedule(self) -> Dict[str, Dict]:
+        """Состояние планировщика опроса: {source_url: {rate, hourly, last_polled_at, next_poll_at, backoff_until, errors}}"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT source_url, rate, hourly,
+                           EXTRACT(EPOCH FROM last_polled_at), EXTRACT(EPOCH FROM next_poll_at),
+                           EXTRACT(EPOCH FROM backoff_until), errors
+                    FROM {self.schema}.source_schedule
+                """)
+                return {
+                    row[0]: {
+                        'rate': row[1],
+                        'hourly': row[2],
+                        'last_polled_at': float(row[3]) if row[3] is not None else None,
+                        'next_poll_at': float(row[4]) if row[4] is not None else 0.0,
+                        'backoff_until': float(row[5]) if row[5] is not None else 0.0,
+                        'errors': row[6],
+                    }
+                    for row in cur.fetchall()
+                }
+
+    def save_source_schedule(self, states: List[Dict]) -> None:
+        """Сохраняет состояние планировщика опроса (время - в секундах Unix)"""
+        if not states:
+            return
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(f"""
+                    INSERT INTO {self.schema}.source_schedule
+                        (source_url, rate, hourly, last_polled_at, next_poll_at, backoff_until, errors, updated_at)
+                    VALUES (%s, %s, %s, to_timestamp(%s), to_timestamp(%s), to_timestamp(%s), %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source_url) DO UPDATE SET
+                        rate = EXCLUDED.rate,
+                        hourly = EXCLUDED.hourly,
+                        last_polled_at = EXCLUDED.last_polled_at,
+                        next_poll_at = EXCLUDED.next_poll_at,
+                        backoff_until = EXCLUDED.backoff_until,
+                        errors = EXCLUDED.errors,
+                        updated_at = EXCLUDED.updated_at
+                """, [
+                    (
+                        state['source_url'], state['rate'], state['hourly'], state['last_polled_at'],
+                        state['next_poll_at'], state['backoff_until'], state['errors']
+                    )
+                    for state in states
+                ])
+                conn.commit()
+
+    def update_parser_heartbeat(self, worker_id: str, pid: int, status: str, started_at: float,
+                                last_cycle_at: Optional[float], cycles: int, saved_posts: int) -> None:
+        """Записывает пульс процесса парсера (время - в секундах Unix)"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {self.schema}.parser_state
+                        (worker_id, pid, status, started_at, heartbeat_at, last_cycle_at, cycles, saved_posts)
+                    VALUES (%s, %s, %s, to_timestamp(%s), CURRENT_TIMESTAMP, to_timestamp(%s), %s, %s)
+                    ON CONFLICT (worker_id) DO UPDATE SET
+                        pid = EXCLUDED.pid,
+                        status = EXCLUDED.status,
+                        started_at = EXCLUDED.started_at,
+                        heartbeat_at = EXCLUDED.heartbeat_at,
+                        last_cycle_at = EXCLUDED.last_cycle_at,
+                        cycles = EXCLUDED.cycles,
+                        saved_posts = EXCLUDED.saved_posts
+                """, (worker_id, pid, status, started_at, last_cycle_at, cycles, saved_posts))
+                conn.commit()
+
+    def get_parser_state(self, worker_id: str) -> Optional[Dict]:
+        """Состояние процесса парсера; heartbeat_age - секунд с последнего пульса"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT pid, status, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - heartbeat_at),
+                           EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - last_cycle_at), cycles, saved_posts
+                    FROM {self.schema}.parser_state
+                    WHERE worker_id = %s
+                """, (worker_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                return {
+                    'pid': row[0],
+                    'status': row[1],
+                    'heartbeat_age': float(row[2]) if row[2] is not None else None,
+                    'last_cycle_age': float(row[3]) if row[3] is not None else None,
+                    'cycles': row[4],
+                    'saved_posts': row[5],
+                }
+
+    def notify_new_posts(self, count: int, channel: str = None) -> None:
+        """Сообщает слушателям (бот) через NOTIFY, что в posts появились новые посты"""
+        from config.settings import NEW_POSTS_CHANNEL
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s)", (channel or NEW_POSTS_CHANNEL, str(count)))
+                conn.commit()
 
-                    # Проверяем текущее значение using_post для этого поста
+    _MEDIA_COLUMNS = "sha256, phash, media_type, size_bytes, remote_path, public_url, ref_count"
+
+    @staticmethod
+    def _media_row(row) -> Dict:
+        return dict(zip(("sha256", "phash", "media_type", "size_bytes", "remote_path", "public_url", "ref_count"), row))
+
+    def find_media_by_source(self, source_key: str) -> Optional[Dict]:
+        """Медиа, уже загруженное из этого источника (id файла Telegram, ссылка на видео)"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT {', '.join('m.' + c for c in self._MEDIA_COLUMNS.split(', '))}
+                    FROM {self.schema}.media_sources s
+                    JOIN {self.schema}.media_registry m ON m.sha256 = s.sha256
+                    WHERE s.source_key = %s
+                """, (source_key,))
+                row = cur.fetchone()
+                return self._media_row(row) if row else None
+
+    def find_media_by_hash(self, sha256: str, phash: Optional[int] = None, max_distance: int = 0) -> Optional[Dict]:
+        """
+        Ищет медиа по SHA-256 содержимого, а для изображений - и по перцептивному хэшу:
+        пережатая или немного измененная копия отличается не больше чем на max_distance бит.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT {self._MEDIA_COLUMNS} FROM {self.schema}.media_registry WHERE sha256 = %s", (sha256,))
+                row = cur.fetchone()
+                if row is None and phash is not None and max_distance > 0:
+                    cur.execute(f"""
+                        SELECT {self._MEDIA_COLUMNS} FROM (
+                            SELECT *, length(replace(((phash # %s::bigint)::bit(64))::text, '0', '')) AS distance
+                            FROM {self.schema}.media_registry
+                            WHERE phash IS NOT NULL
+                        ) candidates
+                        WHERE distance <= %s
+                        ORDER BY distance
+                        LIMIT 1
+                    """, (phash, max_distance))
+                    row = cur.fetchone()
+                return self._media_row(row) if row else None
+
+    def register_media(self, sha256: str, phash: Optional[int], media_type: str, size_bytes: int,
+                       remote_path: str, public_url: Optional[str], source_key: Optional[str] = None) -> None:
+        """Записывает загруженное медиа (или добавляет ссылку на уже известное) и ключ источника"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {self.schema}.media_registry
+                        (sha256, phash, media_type, size_bytes, remote_path, public_url)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (sha256) DO UPDATE SET
+                        ref_count = {self.schema}.media_registry.ref_count + 1,
+                        last_used_at = CURRENT_TIMESTAMP
+                """, (sha256, phash, media_type, size_bytes, remote_path, public_url))
+                if source_key:
                     cur.execute(f"""
-                        SELECT using_post FROM {self.schema}.posts 
-                        WHERE text = %s AND post_link = %s
-                    """, (post['text'], post['post_link']))
-                    current_using_post = cur.fetchone()
-                    logger.info(f"Текущее значение using_post для поста {post['post_link']}: {current_using_post[0] if current_using_post else 'пост новый'}")
+                        INSERT INTO {self.schema}.media_sources (source_key, sha256) VALUES (%s, %s)
+                        ON CONFLICT (source_key) DO UPDATE SET sha256 = EXCLUDED.sha256
+                    """, (source_key, sha256))
+                conn.commit()
 
-                    if exists:
-                        # Обновляем метрики существующего поста, но НЕ трогаем using_post
-                        cur.execute(update_query, (
-                            post['likes'],
-                            post['views'],
-                            post['comments_count'],
-                            post['comments_likes'],
-                            post['date'],
-                            post.get('photo_url'),
-                            post['text'],
-                            post['post_link']
-                        ))
-                        logger.info(f"Обновлен пост {post['post_link']}, значение using_post не изменено")
-                    else:
-                        # Добавляем новый пост с using_post = NULL
-                        cur.execute(insert_query, (
-                            post['group_link'],
-                            post['post_link'],
-                            post['text'],
-                            post['date'],
-                            post['likes'],
-                            post['views'],
-                            post['comments_count'],
-                            post['comments_likes'],
-                            post.get('photo_url')
-                        ))
-                        logger.info(f"Добавлен новый пост {post['post_link']} с using_post = NULL")
-
-                    # Проверяем значение после вставки/обновления
+    def add_media_reference(self, sha256: str, source_key: Optional[str] = None) -> None:
+        """Учитывает повторное использование уже загруженного медиа (ref_count, last_used_at)"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {self.schema}.media_registry
+                    SET ref_count = ref_count + 1, last_used_at = CURRENT_TIMESTAMP
+                    WHERE sha256 = %s
+                """, (sha256,))
+                if source_key:
                     cur.execute(f"""
-                        SELECT using_post FROM {self.schema}.posts 
-                        WHERE text = %s AND post_link = %s
-                    """, (post['text'], post['post_link']))
-                    after_using_post = cur.fetchone()
-                    logger.info(f"Значение using_post после операции для поста {post['post_link']}: {after_using_post[0] if after_using_post else 'ошибка'}")
+                        INSERT INTO {self.schema}.media_sources (source_key, sha256) VALUES (%s, %s)
+                        ON CONFLICT (source_key) DO NOTHING
+                    """, (source_key, sha256))
+                conn.commit()
+
+    def get_queued_media_references(self) -> List[str]:
+        """
+        Ссылки на медиа постов очереди, которые еще не опубликованы.
+        Прямые ссылки Яндекса содержат имя файла (параметр filename) - по нему очистка находит файл на диске.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT DISTINCT post_image FROM {self.schema}.autopost_queue
+                    WHERE status IN ('pending', 'sent_for_approval', 'approved', 'publishing')
+                    AND post_image IS NOT NULL AND post_image <> ''
+                """)
+                return [row[0] for row in cur.fetchall()]
+
+    def delete_media_by_paths(self, paths: List[str] = (), folders: List[str] = ()) -> int:
+        """Удаляет записи реестра для удаленных с диска файлов и папок; возвращает число записей"""
+        if not paths and not folders:
+            return 0
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    DELETE FROM {self.schema}.media_registry
+                    WHERE remote_path = ANY(%s) OR remote_path LIKE ANY(%s)
+                """, (list(paths), [folder.rstrip('/') + '/%' for folder in folders]))
+                deleted = cur.rowcount
+                conn.commit()
+                return deleted
 
+    def get_recent_post_links(self, hours: int) -> Dict[str, List[str]]:
+        """Ссылки на посты, добавленные за последние hours часов, по источникам: {group_link: [post_link]}"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT group_link, array_agg(post_link) FROM {self.schema}.posts
+                    WHERE created_at >= CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+                    GROUP BY group_link
+                """, (hours,))
+                return {row[0]: row[1] for row in cur.fetchall()}
+
+    @timed("db.update_posts_metrics")
+    def update_posts_metrics(self, metrics: List[Dict]) -> None:
+        """Обновляет просмотры, лайки и комментарии постов по post_link одним UPDATE ... FROM (VALUES ...)"""
+        if not metrics:
+            return
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, f"""
+                    UPDATE {self.schema}.posts AS p
+                    SET views = v.views, likes = v.likes, comments_count = v.comments_count
+                    FROM (VALUES %s) AS v(post_link, views, likes, comments_count)
+                    WHERE p.post_link = v.post_link
+                """, [(m['post_link'], m.get('views', 0), m.get('likes', 0), m.get('comments_count', 0)) for m in metrics],
+                    template="(%s, %s::integer, %s::integer, %s::integer)", page_size=1000)
                 conn.commit()
 
+    @timed("db.compare_texts")
     def compare_texts(self, text1, text2, threshold=0.9):
         """Сравнивает два текста и возвращает True, если их схожесть >= threshold."""
         if nlp is not None:
             # Используем spacy для семантического сравнения
             try:
+                TEXT_COMPARISONS.inc(method="spacy")
                 doc1 = nlp(text1)
                 doc2 = nlp(text2)
                 similarity = doc1.similarity(doc2)
@@ -463,6 +891,7 @@ class DatabaseManager:
                 logger.warning(f"Ошибка в spacy сравнении: {e}, используем простое сравнение")
         
         # Простое сравнение на основе общих слов (fallback)
+        TEXT_COMPARISONS.inc(method="jaccard")
         words1 = set(text1.lower().split())
         words2 = set(text2.lower().split())
         
@@ -782,15 +1211,17 @@ class DatabaseManager:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(f"""
-                        SELECT group_link, mode, is_active, source_selection_mode, selected_sources, autopost_role, posts_count, blocked_topics
+                        SELECT group_link, mode, is_active, source_selection_mode, selected_sources, autopost_role, posts_count, blocked_topics,
+                               COALESCE(posts_per_day, %s)
                         FROM {self.schema}.autopost_settings 
                         WHERE user_id = %s AND group_link = %s
-                    """, (user_id, group_link))
+                    """, (AUTOPOST_POSTS_PER_DAY, user_id, group_link))
                     
                     settings = cur.fetchone()
                     
                     if settings:
-                        columns = ['group_link', 'mode', 'is_active', 'source_selection_mode', 'selected_sources', 'autopost_role', 'posts_count', 'blocked_topics']
+                        columns = ['group_link', 'mode', 'is_active', 'source_selection_mode', 'selected_sources', 'autopost_role', 'posts_count', 'blocked_topics',
+                                   'posts_per_day']
                         return dict(zip(columns, settings))
                     else:
                         logger.warning(f"Настройки автопостинга не найдены для user_id={user_id}, group_link={group_link}")
@@ -1037,6 +1468,7 @@ class DatabaseManager:
                     logger.error(f"❌ Не удалось нормализовать ссылки источников")
                     return []
 
+    @timed("db.get_multiple_theme_posts")
     def get_multiple_theme_posts(self, user_id: int, group_link: str, limit: int = 5) -> list:
         """Получает несколько лучших постов с похожими темами для создания уникального контента"""
         logger.info(f"🔍 Начинаем поиск лучших постов для user_id={user_id}, group_link={group_link}")
@@ -1205,6 +1637,7 @@ class DatabaseManager:
                     logger.error(f"❌ Не удалось нормализовать ссылки источников")
                     return []
 
+    @timed("db.get_published_posts_today")
     def get_published_posts_today(self, group_link: str) -> list:
         """
         Получает тексты ОРИГИНАЛЬНЫХ постов, опубликованных сегодня в указанной группе.
@@ -1359,6 +1792,7 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Ошибка при обновлении статуса очереди: {e}")
 
+    @timed("db.add_autopost_to_queue")
     def add_autopost_to_queue(self, user_id: int, group_link: str, text: str, image_url: str, scheduled_time: datetime, is_video: bool = False, mode: str = 'controlled', original_post_url: str = None):
         """Добавляет автопост в очередь"""
         try:
@@ -1379,6 +1813,7 @@ class DatabaseManager:
             logger.error(f"Ошибка при добавлении автопоста в очередь: {e}")
             return None
 
+    @timed("db.get_pending_autopost_queue")
     def get_pending_autopost_queue(self, status_filter: Optional[str] = None):
         """
         Получает все ожидающие автопосты.
@@ -1410,6 +1845,20 @@ class DatabaseManager:
             logger.error(f"Ошибка при получении очереди автопостинга: {e}")
             return []
 
+    def get_queue_status_counts(self) -> Dict[str, int]:
+        """Возвращает количество постов в очереди автопостинга по статусам"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT status, COUNT(*) FROM {self.schema}.autopost_queue
+                        GROUP BY status
+                    """)
+                    return {status: count for status, count in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"Ошибка при подсчете очереди автопостинга: {e}")
+            return {}
+
     def update_autopost_status(self, autopost_id: int, status: str):
         """Обновляет статус автопоста (алиас для update_queue_status)"""
         return self.update_queue_status(autopost_id, status)
@@ -1521,9 +1970,9 @@ class DatabaseManager:
         # Текущее время в Москве
         now_moscow = datetime.now(moscow_tz)
         
-        # Рабочие часы (6:00 - 23:00)
-        work_start = 6
-        work_end = 23
+        # Рабочие часы (по умолчанию 6:00 - 23:00)
+        work_start = AUTOPOST_WORK_START_HOUR
+        work_end = AUTOPOST_WORK_END_HOUR
         
         # Параметры для 10 постов в день
         posts_per_day = 10
@@ -1617,8 +2066,159 @@ class DatabaseManager:
         
         return next_time_utc
 
-    def update_next_post_time(self, group_link: str) -> None:
-        """Обновляет время следующего поста для группы"""
+    def get_autopost_groups_for_planning(self, plan_date) -> List[Dict]:
+        """
+        Активные группы для дневного плана публикаций: posts_per_day и needs_plan -
+        на plan_date плана еще нет или он построен для другого posts_per_day.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT s.user_id, s.group_link, COALESCE(s.posts_per_day, %s) AS posts_per_day,
+                           NOT EXISTS (
+                               SELECT 1 FROM {self.schema}.posting_plan p
+                               WHERE p.user_id = s.user_id AND p.group_link = s.group_link
+                               AND p.plan_date = %s AND p.posts_per_day = COALESCE(s.posts_per_day, %s)
+                           ) AS needs_plan
+                    FROM {self.schema}.autopost_settings s
+                    WHERE s.is_active = true
+                    ORDER BY s.user_id, s.group_link
+                """, (AUTOPOST_POSTS_PER_DAY, plan_date, AUTOPOST_POSTS_PER_DAY))
+                columns = ['user_id', 'group_link', 'posts_per_day', 'needs_plan']
+                return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def save_posting_plan(self, plan_date, plans: List[Tuple[int, str, int, List[datetime]]], now_utc: datetime,
+                          day_start_utc: datetime) -> int:
+        """
+        Записывает план на plan_date: [(user_id, group_link, posts_per_day, [слоты в UTC])].
+        Прошедшие слоты сохраняются как skipped (план дня виден целиком), выполненные слоты старого плана остаются.
+        next_post_time группы переносится на первый будущий слот, если он не назначен раньше в течение этого дня
+        (например, "опубликовать сейчас"); время до начала рабочего дня (вчерашнее или "до плана")
+        и время, взятое из заменяемого плана, заменяются.
+        Возвращает число будущих слотов.
+        """
+        rows = []
+        for user_id, group_link, posts_per_day, slots in plans:
+            for slot in slots:
+                rows.append((user_id, group_link, plan_date, slot, posts_per_day, 'pending' if slot > now_utc else 'skipped'))
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                replaced_slots = {}
+                for user_id, group_link, _, _ in plans:
+                    cur.execute(f"""
+                        DELETE FROM {self.schema}.posting_plan
+                        WHERE user_id = %s AND group_link = %s AND plan_date = %s AND status <> 'done'
+                        RETURNING slot_time, status
+                    """, (user_id, group_link, plan_date))
+                    replaced_slots[(user_id, group_link)] = [slot for slot, status in cur.fetchall() if status == 'pending']
+                if rows:
+                    execute_values(cur, f"""
+                        INSERT INTO {self.schema}.posting_plan
+                            (user_id, group_link, plan_date, slot_time, posts_per_day, status)
+                        VALUES %s
+                        ON CONFLICT (user_id, group_link, plan_date, slot_time) DO NOTHING
+                    """, rows)
+                for user_id, group_link, _, slots in plans:
+                    upcoming = [slot for slot in slots if slot > now_utc]
+                    if not upcoming:
+                        continue
+                    cur.execute(f"""
+                        UPDATE {self.schema}.autopost_settings
+                        SET next_post_time = CASE
+                            WHEN next_post_time IS NULL OR next_post_time > %s OR next_post_time <= %s
+                                 OR next_post_time = ANY(%s) THEN %s
+                            ELSE next_post_time
+                        END
+                        WHERE user_id = %s AND group_link = %s
+                    """, (upcoming[0], day_start_utc, replaced_slots[(user_id, group_link)], upcoming[0],
+                          user_id, group_link))
+                conn.commit()
+                return sum(1 for row in rows if row[5] == 'pending')
+
+    def take_next_plan_slot(self, user_id: int, group_link: str, now_utc: datetime) -> Tuple[bool, Optional[datetime]]:
+        """
+        Отмечает наступившие слоты плана группы пользователя выполненными
+        и возвращает (есть ли план на сегодня, следующий слот). (True, None) - слоты на сегодня закончились.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {self.schema}.posting_plan SET status = 'done'
+                    WHERE user_id = %s AND group_link = %s AND status = 'pending' AND slot_time <= %s
+                """, (user_id, group_link, now_utc))
+                cur.execute(f"""
+                    SELECT COUNT(*), MIN(slot_time) FILTER (WHERE status = 'pending' AND slot_time > %s)
+                    FROM {self.schema}.posting_plan
+                    WHERE user_id = %s AND group_link = %s AND plan_date = %s
+                """, (now_utc, user_id, group_link, datetime.now(pytz.timezone('Europe/Moscow')).date()))
+                planned, next_slot = cur.fetchone()
+                conn.commit()
+                return planned > 0, next_slot
+
+    def prune_posting_plan(self, before_date) -> int:
+        """Удаляет планы за дни до before_date"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {self.schema}.posting_plan WHERE plan_date < %s", (before_date,))
+                deleted = cur.rowcount
+                conn.commit()
+                return deleted
+
+    def count_pending_plan_slots(self, plan_date, now_utc) -> int:
+        """Число еще не наступивших слотов плана на день plan_date"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT COUNT(*) FROM {self.schema}.posting_plan
+                    WHERE plan_date = %s AND status = 'pending' AND slot_time > %s
+                """, (plan_date, now_utc))
+                return cur.fetchone()[0]
+
+    def set_posts_per_day(self, user_id: int, group_link: str, posts_per_day: int) -> bool:
+        """Устанавливает число публикаций в день; план группы перестраивается при следующей проверке планировщика"""
+        if not (1 <= posts_per_day <= 48):
+            raise ValueError("Количество публикаций в день должно быть от 1 до 48")
+
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {self.schema}.autopost_settings 
+                    SET posts_per_day = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = %s AND group_link = %s
+                """, (posts_per_day, user_id, group_link))
+                if cur.rowcount == 0:
+                    logger.warning(f"Настройки автопостинга не найдены для user_id={user_id}, group_link={group_link}")
+                    return False
+                conn.commit()
+                logger.info(f"✅ Установлено {posts_per_day} публикаций в день для группы {group_link}")
+                return True
+
+    def update_next_post_time(self, user_id: int, group_link: str) -> None:
+        """
+        Обновляет время следующего поста для группы пользователя:
+        следующий слот дневного плана, без плана - случайный интервал
+        """
+        now_utc = datetime.utcnow()
+        has_plan, next_slot = self.take_next_plan_slot(user_id, group_link, now_utc)
+        if has_plan:
+            if next_slot is None:
+                # Слоты на сегодня закончились: до начала рабочего дня, план на завтра перенесет время на первый слот
+                moscow_tz = pytz.timezone('Europe/Moscow')
+                tomorrow = datetime.now(moscow_tz).date() + timedelta(days=1)
+                next_slot = moscow_tz.localize(
+                    datetime.combine(tomorrow, datetime.min.time()) + timedelta(hours=AUTOPOST_WORK_START_HOUR)
+                ).astimezone(pytz.UTC).replace(tzinfo=None)
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        UPDATE {self.schema}.autopost_settings
+                        SET next_post_time = %s
+                        WHERE user_id = %s AND group_link = %s
+                    """, (next_slot, user_id, group_link))
+                    conn.commit()
+            logger.info(f"📅 Следующий пост {group_link} по плану: {next_slot} (UTC)")
+            return
+
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 # Получаем текущее время в Москве
@@ -1651,9 +2251,9 @@ class DatabaseManager:
                 update_query = f"""
                     UPDATE {self.schema}.autopost_settings
                     SET next_post_time = %s
-                    WHERE group_link = %s
+                    WHERE user_id = %s AND group_link = %s
                 """
-                cur.execute(update_query, (next_post_utc, group_link))
+                cur.execute(update_query, (next_post_utc, user_id, group_link))
                 conn.commit()
                 
                 logger.info(f"⏰ Время следующего поста обновлено для {group_link}: {next_post_utc}")
@@ -2007,12 +2607,17 @@ class DatabaseManager:
             
             client = AsyncOpenAI(
                 api_key=os.getenv('OPENAI_API_KEY'),
-                base_url="https://api.openai.com/v1",
+                base_url=os.getenv('OPENAI_BASE_URL', "https://api.openai.com/v1"),
             )
             
+            from ai.gpt.token_budget import prepare_text, token_accounting
+            from config.settings import BLOCK_CHECK_MAX_INPUT_TOKENS
+            
             topics_list = [topic.strip() for topic in blocked_topics.split(',') if topic.strip()]
             topics_text = ', '.join(topics_list)
             
+            # Для определения основной сути достаточно начала поста без подписей канала
+            text = prepare_text(text, BLOCK_CHECK_MAX_INPUT_TOKENS, "blocked_check")
             logger.info(f"Проверяемый текст на блокировку: '{text}'")
 
             prompt = f"""
@@ -2033,13 +2638,15 @@ class DatabaseManager:
             Ответь только "ДА", если ОСНОВНАЯ СУТЬ текста соответствует заблокированным темам. В противном случае ответь "НЕТ".
             """
             
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=10,
-                temperature=0
-            )
+            async with openai_call("gpt.blocked_check"):
+                response = await client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=10,
+                    temperature=0
+                )
             
+            token_accounting.record_usage("blocked_check", getattr(response, 'usage', None))
             result = response.choices[0].message.content.strip().upper()
             is_blocked = "ДА" in result
             
@@ -1,96 +1,161 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+"""
+Зеркалирование медиа постов (Telegram, VK видео) на Яндекс.Диск.
+
+Загрузка асинхронная (REST API через utils.yandex_disk.AsyncYandexDisk): файлы отправляются
+потоком с диска через ограниченный пул загрузок, поэтому медиа десятков постов
+обрабатываются параллельно и не блокируют event loop.
+Если передан реестр медиа (utils.media_registry), уже загруженные файлы не скачиваются
+и не загружаются повторно, а новые называются на диске по хэшу содержимого.
+"""
+
 import asyncio
 import logging
 import os
+import shutil
 import tempfile
-import yadisk
-import yt_dlp
-import requests
+import time
 from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
 from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
 
+from utils.media_registry import MediaRegistry, StoredMedia
+from utils.metrics import registry
+from utils.yandex_disk import AsyncYandexDisk
+from parsers.video_download_pool import VideoDownloadError, video_download_pool
+
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+MEDIA_PROCESSED = registry.counter("media_processed_total", "Обработанные медиа по источнику и результату")
+MEDIA_PROCESS_SECONDS = registry.histogram(
+    "media_process_seconds",
+    "Полное время обработки одного медиа (скачивание + загрузка на Яндекс.Диск), секунд",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+
 class YandexMediaUploader:
     """Базовый класс для загрузки медиа на Яндекс.Диск"""
     
-    def __init__(self, ya_token, folder_name="/media"):
-        """Инициализация загрузчика"""
-        self.ya_disk = yadisk.YaDisk(token=ya_token)
+    def __init__(self, ya_token, folder_name="/media", disk: AsyncYandexDisk = None,
+                 media_registry: MediaRegistry = None):
+        """Инициализация загрузчика; disk можно разделить между загрузчиками, чтобы у них был общий пул загрузок"""
+        self.disk = disk or AsyncYandexDisk(token=ya_token)
+        self.media_registry = media_registry
         self.upload_folder = folder_name
         
-    def init_yandex_folder(self):
+    async def init_yandex_folder(self):
         """Создание папки на Яндекс.Диске если её нет"""
         try:
-            if not self.ya_disk.exists(self.upload_folder):
-                self.ya_disk.mkdir(self.upload_folder)
+            if await self.disk.ensure_dir(self.upload_folder):
                 logger.info(f"✅ Создана папка {self.upload_folder} на Яндекс.Диске")
             else:
                 logger.debug(f"📁 Папка {self.upload_folder} уже существует")
         except Exception as e:
             logger.error(f"❌ Ошибка создания папки: {e}")
             raise
-    
-    def upload_to_yandex_and_get_direct_link(self, local_file_path, remote_filename):
-        """Загрузка файла на Яндекс.Диск и получение прямой ссылки"""
+
+    async def upload_file(self, local_file_path, remote_filename, sha256: str = None) -> Optional[StoredMedia]:
+        """
+        Загрузка файла в папку с датой. Папка создается один раз за день (кэш клиента),
+        публикация не нужна: прямая ссылка на свой файл выдается по пути.
+        """
         try:
-            # Создаем папку с датой
+            # Создаем папку с датой если её нет
             date_folder = datetime.now().strftime("%Y_%m_%d")
             date_path = f"{self.upload_folder}/{date_folder}"
-            
-            # Создаем папку с датой если её нет
-            if not self.ya_disk.exists(date_path):
-                self.ya_disk.mkdir(date_path)
+            if await self.disk.ensure_dir(date_path):
                 logger.info(f"📁 Создана папка {date_path}")
             
             remote_path = f"{date_path}/{remote_filename}"
             logger.info(f"☁️ Загружаем на Яндекс.Диск: {date_folder}/{remote_filename}")
             
             # Загружаем файл
-            self.ya_disk.upload(local_file_path, remote_path, overwrite=True)
+            await self.disk.upload(local_file_path, remote_path, overwrite=True)
+            logger.info(f"✅ Файл загружен")
+            return StoredMedia(sha256, remote_path, None, size_bytes=os.path.getsize(local_file_path))
             
-            # Делаем файл публичным
-            self.ya_disk.publish(remote_path)
-            
-            # Получаем публичную ссылку
-            public_info = self.ya_disk.get_meta(remote_path)
-            public_url = public_info.public_url
-            
-            logger.info(f"✅ Файл загружен и опубликован")
-            logger.debug(f"🔗 Публичная ссылка: {public_url}")
-            
-            # Получаем прямую ссылку на файл
-            direct_link = self.get_direct_download_link(public_url)
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки на Яндекс.Диск: {e}")
+            return None
+
+    async def publish_file(self, remote_path):
+        """Публикует файл и возвращает публичную ссылку (запасной путь, если прямую ссылку получить не удалось)"""
+        try:
+            await self.disk.publish(remote_path)
+            public_info = await self.disk.get_meta(remote_path, fields="public_url")
+            return public_info.get('public_url')
+        except Exception as e:
+            logger.error(f"❌ Ошибка публикации файла {remote_path}: {e}")
+            return None
+
+    async def direct_link_for(self, stored: Optional[StoredMedia]):
+        """Прямая ссылка на загруженный файл (закэшированная, пока не истекла), иначе публичная"""
+        if stored is None:
+            return None
+        try:
+            direct_link = await self.disk.get_download_link(stored.remote_path)
             if direct_link:
-                logger.info(f"📂 ПРЯМАЯ ссылка получена: {direct_link[:60]}...")
+                logger.debug(f"📂 ПРЯМАЯ ссылка: {direct_link[:60]}...")
                 return direct_link
-            else:
-                logger.warning("⚠️ Не удалось получить прямую ссылку, возвращаем публичную")
-                return public_url
-            
         except Exception as e:
-            logger.error(f"❌ Ошибка загрузки на Яндекс.Диск: {e}")
+            logger.warning(f"⚠️ Не удалось получить прямую ссылку на {stored.remote_path}: {e}")
+
+        public_url = stored.public_url or await self.publish_file(stored.remote_path)
+        if not public_url:
+            return None
+        direct_link = await self.get_direct_download_link(public_url)
+        if direct_link:
+            return direct_link
+        logger.warning("⚠️ Не удалось получить прямую ссылку, возвращаем публичную")
+        return public_url
+    
+    async def upload_to_yandex_and_get_direct_link(self, local_file_path, remote_filename):
+        """Загрузка файла на Яндекс.Диск и получение прямой ссылки"""
+        with self.disk.count_calls("upload"):
+            return await self.direct_link_for(await self.upload_file(local_file_path, remote_filename))
+
+    async def find_uploaded(self, source_key):
+        """Прямая ссылка на файл источника, если он уже загружен (проверяется до скачивания)"""
+        if not self.media_registry or not source_key:
             return None
+        try:
+            stored = await self.media_registry.find_by_source(source_key)
+        except Exception as e:
+            logger.warning(f"Не удалось проверить реестр медиа для {source_key}: {e}")
+            return None
+        if stored is None:
+            return None
+        with self.disk.count_calls("reuse"):
+            return await self.direct_link_for(stored)
+
+    async def mirror_file(self, local_file_path, remote_filename, media_type, source_key=None):
+        """
+        Загружает файл, если такого содержимого еще нет на диске, и возвращает прямую ссылку.
+        С реестром медиа файл называется по хэшу содержимого, без него - remote_filename.
+        """
+        if not self.media_registry:
+            return await self.upload_to_yandex_and_get_direct_link(local_file_path, remote_filename)
+
+        extension = os.path.splitext(remote_filename)[1]
+
+        async def upload(sha256):
+            return await self.upload_file(local_file_path, f"{sha256[:32]}{extension}", sha256)
+
+        with self.disk.count_calls("mirror"):
+            try:
+                stored = await self.media_registry.store(local_file_path, media_type, source_key, upload)
+            except Exception as e:
+                logger.warning(f"Реестр медиа недоступен ({e}), загружаем без дедупликации")
+                stored = await self.upload_file(local_file_path, remote_filename)
+            return await self.direct_link_for(stored)
     
-    def get_direct_download_link(self, public_url):
+    async def get_direct_download_link(self, public_url):
         """Получение прямой ссылки на скачивание файла"""
         try:
-            # Яндекс.Диск API для получения прямой ссылки
-            api_url = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
-            params = {"public_key": public_url}
-            
-            response = requests.get(api_url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                direct_url = data.get('href')
-                return direct_url
-            else:
-                logger.error(f"Ошибка получения прямой ссылки: {response.status_code}")
-                return None
-                
+            return await self.disk.get_public_download_link(public_url)
         except Exception as e:
             logger.error(f"Ошибка при получении прямой ссылки: {e}")
             return None
@@ -99,53 +164,55 @@ class YandexMediaUploader:
 class VKVideoUploader(YandexMediaUploader):
     """Загрузчик видео из VK на Яндекс.Диск"""
     
-    def __init__(self, ya_token):
-        super().__init__(ya_token, "/vk_videos")
-        
-    def download_and_upload_vk_video(self, post_link):
+    def __init__(self, ya_token, disk: AsyncYandexDisk = None, media_registry: MediaRegistry = None):
+        super().__init__(ya_token, "/vk_videos", disk, media_registry)
+
+    async def download_and_upload_vk_video(self, post_link):
         """Скачивание VK видео и загрузка на Яндекс.Диск"""
         temp_dir = None
+        started = time.monotonic()
         try:
             logger.info(f"🎬 Начинаем загрузку VK видео: {post_link}")
+
+            source_key = f"vk_video:{post_link}"
+            direct_url = await self.find_uploaded(source_key)
+            if direct_url:
+                logger.info(f"♻️ VK видео {post_link} уже загружено, скачивание пропущено")
+                MEDIA_PROCESSED.inc(source="vk", status="reused")
+                return direct_url
             
             # Создаем временную папку
             temp_dir = tempfile.mkdtemp()
             
-            # Настройки для yt-dlp
-            ydl_opts = {
-                'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-                'format': 'best[height<=720]',  # Максимум 720p для экономии места
-                'quiet': True,
-                'no_warnings': True,
-            }
+            # yt-dlp работает в отдельном процессе из пула: размер проверяется до скачивания,
+            # зависшее скачивание завершается по таймауту
+            try:
+                video_path = await video_download_pool.download(post_link, temp_dir)
+            except VideoDownloadError as e:
+                logger.error(f"❌ VK видео {post_link} не скачано: {e}")
+                MEDIA_PROCESSED.inc(source="vk", status="too_large" if e.reason == "too_large" else "error")
+                return None
+
+            file_size = os.path.getsize(video_path) / (1024 * 1024)  # В MB
+            logger.info(f"✅ VK видео скачано: {file_size:.2f} MB за {time.monotonic() - started:.2f}с")
             
-            # Скачиваем видео
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(post_link, download=True)
-                video_path = ydl.prepare_filename(info_dict)
-                
-                if os.path.exists(video_path):
-                    file_size = os.path.getsize(video_path) / (1024 * 1024)  # В MB
-                    logger.info(f"✅ VK видео скачано: {file_size:.2f} MB")
-                    
-                    # Генерируем имя для загрузки
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    remote_filename = f"vk_video_{timestamp}.mp4"
-                    
-                    # Загружаем на Яндекс.Диск
-                    direct_url = self.upload_to_yandex_and_get_direct_link(video_path, remote_filename)
-                    return direct_url
-                else:
-                    logger.error("❌ VK видео файл не найден после скачивания")
-                    return None
+            # Генерируем имя для загрузки
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            remote_filename = f"vk_video_{timestamp}.mp4"
+            
+            # Загружаем на Яндекс.Диск
+            direct_url = await self.mirror_file(video_path, remote_filename, 'video', source_key)
+            MEDIA_PROCESSED.inc(source="vk", status="ok" if direct_url else "error")
+            MEDIA_PROCESS_SECONDS.observe(time.monotonic() - started, source="vk")
+            return direct_url
                     
         except Exception as e:
             logger.error(f"❌ Ошибка загрузки VK видео: {e}")
+            MEDIA_PROCESSED.inc(source="vk", status="error")
             return None
         finally:
             # Очищаем временные файлы
             if temp_dir and os.path.exists(temp_dir):
-                import shutil
                 shutil.rmtree(temp_dir)
                 logger.debug("🗑️ Временные файлы VK видео удалены")
 
@@ -153,12 +220,13 @@ class VKVideoUploader(YandexMediaUploader):
 class TelegramMediaUploader(YandexMediaUploader):
     """Загрузчик медиа из Telegram на Яндекс.Диск"""
     
-    def __init__(self, ya_token):
-        super().__init__(ya_token, "/tg_media")
+    def __init__(self, ya_token, disk: AsyncYandexDisk = None, media_registry: MediaRegistry = None):
+        super().__init__(ya_token, "/tg_media", disk, media_registry)
 
     async def process_telegram_media(self, client, message):
         """Обработка медиа из Telegram сообщения"""
         temp_dir = None
+        started = time.monotonic()
         try:
             # Определяем тип медиа
             media_type = None
@@ -198,6 +266,15 @@ class TelegramMediaUploader(YandexMediaUploader):
                 return None, None
             
             logger.info(f"📥 Обрабатываем {media_type} из сообщения {message.id}")
+
+            # id файла Telegram одинаков у пересланных копий - проверяем реестр до скачивания
+            media = message.photo or message.document
+            source_key = f"tg:{media.id}" if media is not None else None
+            direct_url = await self.find_uploaded(source_key)
+            if direct_url:
+                logger.info(f"♻️ {media_type} из сообщения {message.id} уже загружено, скачивание пропущено")
+                MEDIA_PROCESSED.inc(source="telegram", status="reused")
+                return direct_url, media_type
             
             # Создаем временную папку
             temp_dir = tempfile.mkdtemp()
@@ -213,64 +290,84 @@ class TelegramMediaUploader(YandexMediaUploader):
             
             if os.path.exists(local_path):
                 file_size = os.path.getsize(local_path) / (1024 * 1024)  # В MB
-                logger.info(f"✅ Файл скачан: {local_filename} ({file_size:.2f} MB)")
+                logger.info(f"✅ Файл скачан: {local_filename} ({file_size:.2f} MB) за {time.monotonic() - started:.2f}с")
                 
                 # Загружаем на Яндекс.Диск с датой в названии
                 date_folder = datetime.now().strftime("%Y%m%d")
-                remote_filename = f"{date_folder}_tg_{media_type}_{timestamp}{file_extension}"
-                direct_url = self.upload_to_yandex_and_get_direct_link(local_path, remote_filename)
+                remote_filename = f"{date_folder}_tg_{media_type}_{message.id}_{timestamp}{file_extension}"
+                direct_url = await self.mirror_file(local_path, remote_filename, media_type, source_key)
+                MEDIA_PROCESSED.inc(source="telegram", status="ok" if direct_url else "error")
+                MEDIA_PROCESS_SECONDS.observe(time.monotonic() - started, source="telegram")
                 
                 return direct_url, media_type
             else:
                 logger.error("❌ Файл не был скачан")
+                MEDIA_PROCESSED.inc(source="telegram", status="error")
                 return None, None
                 
         except Exception as e:
             logger.error(f"❌ Ошибка обработки медиа: {e}")
+            MEDIA_PROCESSED.inc(source="telegram", status="error")
             return None, None
         finally:
             # Очищаем временные файлы
             if temp_dir and os.path.exists(temp_dir):
-                import shutil
                 shutil.rmtree(temp_dir)
                 logger.debug("🗑️ Временные файлы Telegram удалены")
 
+    async def process_telegram_messages(self, client, messages) -> List[Tuple[Optional[str], Optional[str]]]:
+        """Обрабатывает медиа нескольких сообщений параллельно (загрузки ограничены пулом клиента Яндекс.Диска)"""
+        return await asyncio.gather(*(self.process_telegram_media(client, message) for message in messages))
+
 
 class MediaUploaderManager:
     """Менеджер для всех загрузчиков медиа"""
     
-    def __init__(self, ya_token):
+    def __init__(self, ya_token, db=None):
+        """db - DatabaseManager для реестра медиа; без него загруженные файлы не дедуплицируются"""
         self.ya_token = ya_token
+        self.disk = None
         self.vk_uploader = None
         self.tg_uploader = None
         
         if ya_token:
-            try:
-                self.vk_uploader = VKVideoUploader(ya_token)
-                self.vk_uploader.init_yandex_folder()
-                
-                self.tg_uploader = TelegramMediaUploader(ya_token)  
-                self.tg_uploader.init_yandex_folder()
-                
-                logger.info("✅ Загрузчики медиа инициализированы")
-            except Exception as e:
-                logger.error(f"❌ Ошибка инициализации загрузчиков: {e}")
+            # Общий клиент: один пул загрузок на все источники медиа
+            self.disk = AsyncYandexDisk(token=ya_token)
+            media_registry = MediaRegistry(db) if db is not None else None
+            self.vk_uploader = VKVideoUploader(ya_token, self.disk, media_registry)
+            self.tg_uploader = TelegramMediaUploader(ya_token, self.disk, media_registry)
         else:
             logger.warning("⚠️ Токен Яндекс.Диска не найден, медиа не будет загружаться")
+
+    async def initialize(self):
+        """Создает корневые папки загрузчиков на Яндекс.Диске"""
+        if not self.disk:
+            return
+        try:
+            await asyncio.gather(self.vk_uploader.init_yandex_folder(), self.tg_uploader.init_yandex_folder())
+            logger.info("✅ Загрузчики медиа инициализированы")
+        except Exception as e:
+            logger.error(f"❌ Ошибка инициализации загрузчиков: {e}")
+            self.vk_uploader = None
+            self.tg_uploader = None
     
-    def process_vk_video_link(self, video_link):
+    async def process_vk_video_link(self, video_link):
         """Обработка VK видео ссылки"""
         if not self.vk_uploader:
             return video_link  # Возвращаем исходную ссылку
             
         try:
             if 'vk.com/video' in video_link:
-                direct_url = self.vk_uploader.download_and_upload_vk_video(video_link)
+                direct_url = await self.vk_uploader.download_and_upload_vk_video(video_link)
                 return direct_url if direct_url else video_link
         except Exception as e:
             logger.error(f"Ошибка обработки VK видео: {e}")
         
         return video_link  # Возвращаем исходную ссылку при ошибке
+
+    async def process_vk_video_links(self, video_links: Iterable[str]) -> List[str]:
+        """Параллельная обработка нескольких VK видео ссылок"""
+        return await asyncio.gather(*(self.process_vk_video_link(link) for link in video_links))
     
     async def process_tg_media(self, client, message):
         """Обработка Telegram медиа"""
@@ -281,4 +378,15 @@ class MediaUploaderManager:
             return await self.tg_uploader.process_telegram_media(client, message)
         except Exception as e:
             logger.error(f"Ошибка обработки Telegram медиа: {e}")
-            return None, None 
\ No newline at end of file
+            return None, None
+
+    async def process_tg_media_many(self, client, messages) -> List[Tuple[Optional[str], Optional[str]]]:
+        """Параллельная обработка медиа нескольких Telegram сообщений"""
+        if not self.tg_uploader:
+            return [(None, None) for _ in messages]
+        return await self.tg_uploader.process_telegram_messages(client, messages)
+
+    async def close(self):
+        await video_download_pool.close()
+        if self.disk:
+            await self.disk.close()
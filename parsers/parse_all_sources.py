@@ -1,12 +1,18 @@
 import asyncio
 import logging
-from datetime import datetime
-from typing import List, Dict, Any
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Tuple
+from telethon.errors import FloodWaitError
 from database.DatabaseManager import DatabaseManager
 from parsers.telegram.get_tg_posts import TelegramPostParser
 from parsers.vk.get_vk_posts import VKPostParser
 from parsers.vk.get_vk_comments import VKCommentParser
-from config.settings import VK_TOKEN
+from parsers.vk.async_vk_client import AsyncVKClient
+from parsers.post_pipeline import PostSavePipeline
+from parsers.source_scheduler import SourceScheduler, PollOutcome
+from config.settings import VK_TOKEN, VK_WALL_COUNT, VK_MAX_PAGES, TG_METRICS_REFRESH_INTERVAL, METRICS_REFRESH_HOURS
+from utils.metrics import span, PARSER_FETCHES, PARSER_POSTS, PARSER_METRICS_REFRESHED
 
 logger = logging.getLogger(__name__)
 
@@ -15,142 +21,323 @@ class SourceParser:
         self.db = DatabaseManager()
         self.vk_parser = VKPostParser(VK_TOKEN)
         self.vk_comment_parser = VKCommentParser(VK_TOKEN)
-        self.parse_interval = 300  # 30 минут (1800 секунд)
+        # Асинхронный клиент VK: wall.get пачками через execute, не блокирует event loop
+        self.vk_client = AsyncVKClient(VK_TOKEN)
+        # Один парсер на общем Telegram клиенте для всех источников и циклов
+        self.tg_parser = TelegramPostParser()
+        # Частота опроса подбирается для каждого источника отдельно
+        self.scheduler = SourceScheduler()
+        # Статистика для пульса процесса парсера
+        self.cycles = 0
+        self.last_cycle_at = None
+        self.saved_posts = 0
+        self.metrics_refresh_interval = TG_METRICS_REFRESH_INTERVAL
         
     async def initialize_db(self):
         """Инициализация базы данных"""
-        await self.db.init_pool()
+        await asyncio.to_thread(self.db.init_db)
 
-    async def parse_telegram_source(self, source: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Парсит один Telegram источник"""
+    async def close(self):
+        """Отключает общий Telegram клиент и HTTP сессию VK"""
+        await self.tg_parser.stop()
+        await self.vk_client.close()
+
+    @staticmethod
+    def telegram_channel_name(source_url: str) -> str:
+        return source_url.rstrip('/').split('/')[-1]
+
+    async def parse_telegram_source(self, source: Dict[str, Any], min_id: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Парсит один Telegram источник начиная с курсора min_id.
+        Возвращает посты и новый курсор (максимальный полученный id сообщения).
+        """
         try:
-            channel_name = source['link'].split('/')[-1]
-            logger.info(f"Начинаем парсинг Telegram канала: {channel_name}")
-            
-            # Создаем новый экземпляр парсера для каждого источника
-            async with TelegramPostParser() as tg:
-                logger.info(f"Получаем посты из канала {channel_name}...")
-                posts = await tg.get_posts(channel_name)
+            channel_name = self.telegram_channel_name(source['source_url'])
+            logger.info(f"Получаем посты из Telegram канала {channel_name}...")
+            async with span("parser.telegram_fetch"):
+                posts, max_id = await self.tg_parser.get_new_posts(channel_name, min_id)
+            PARSER_FETCHES.inc(source_type="telegram", status="ok")
+            PARSER_POSTS.inc(len(posts or []), source_type="telegram")
+            if posts:
+                logger.info(f"Получено {len(posts)} постов из {channel_name}")
+                # Преобразуем формат даты
+                for post in posts:
+                    if isinstance(post['date'], str):
+                        date_obj = datetime.strptime(post['date'], "%Y-%m-%d %H:%M:%S")
+                        post['date'] = date_obj.strftime("%d.%m.%Y")
+            else:
+                logger.info(f"Новых постов в канале {channel_name} нет")
+            return posts, max_id
+        except FloodWaitError:
+            # Отсрочку опроса канала назначает планировщик
+            PARSER_FETCHES.inc(source_type="telegram", status="flood_wait")
+            raise
+        except Exception as e:
+            # Ошибка уходит в PollOutcome(error=...) - планировщик откладывает источник с экспоненциальной паузой
+            PARSER_FETCHES.inc(source_type="telegram", status="error")
+            logger.error(f"Ошибка при парсинге Telegram источника {source['source_url']}: {e}", exc_info=True)
+            raise
+
+    async def parse_telegram_sources(self, telegram_sources: List[Dict[str, Any]], pipeline: PostSavePipeline,
+                                     cursors: Dict[str, Dict]) -> Dict[str, PollOutcome]:
+        """
+        Параллельно обрабатывает Telegram источники, каждый - только новее своего курсора.
+        Посты каждого источника сразу уходят писателю; возвращает результаты опроса по источникам.
+        """
+        if not telegram_sources:
+            return {}
+
+        logger.info("Начинаем парсинг Telegram источников...")
+
+        async def fetch(i: int, source: Dict[str, Any]) -> int:
+            link = self.tg_parser.channel_link(self.telegram_channel_name(source['source_url']))
+            min_id = cursors.get(link, {}).get('last_message_id', 0)
+            posts, max_id = await self.parse_telegram_source(source, min_id)
+            logger.info(f"Telegram источник {i+1}: получено {len(posts)} постов")
+            await pipeline.put(link, posts, max_id if max_id > min_id else None)
+            return len(posts)
+
+        results = await asyncio.gather(
+            *(fetch(i, source) for i, source in enumerate(telegram_sources)),
+            return_exceptions=True
+        )
+        outcomes = {}
+        for i, (source, result) in enumerate(zip(telegram_sources, results)):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка в Telegram источнике {i+1}: {result}")
+                outcomes[source['source_url']] = PollOutcome(error=result)
+            else:
+                outcomes[source['source_url']] = PollOutcome(new_posts=result)
+        return outcomes
+
+    async def parse_vk_sources(self, vk_sources: List[Dict[str, Any]], pipeline: PostSavePipeline,
+                               cursors: Dict[str, Dict]) -> Dict[str, PollOutcome]:
+        """
+        Парсит VK источники асинхронно: владельцы разрешаются пачками через кэш,
+        стены запрашиваются по VK_EXECUTE_BATCH штук за один вызов execute и листаются до курсора
+        (id последнего полученного поста), посты источника сразу уходят писателю.
+        Возвращает результаты опроса по источникам.
+        """
+        if not vk_sources:
+            return {}
+
+        logger.info("Начинаем парсинг VK источников...")
+        names = [VKPostParser.clean_name(source['source_url']) for source in vk_sources]
+        source_urls = {name: source['source_url'] for name, source in zip(names, vk_sources)}
+        try:
+            async with span("parser.vk_resolve"):
+                owners = await self.vk_client.resolve_owners(names)
+        except Exception as e:
+            PARSER_FETCHES.inc(len(vk_sources), source_type="vk", status="error")
+            logger.error(f"Ошибка при разрешении VK источников: {e}", exc_info=True)
+            return {source['source_url']: PollOutcome(error=e) for source in vk_sources}
+
+        outcomes = {}
+        owner_ids = {name: owner['id'] for name, owner in owners.items() if owner}
+        names_by_owner = {owner_id: name for name, owner_id in owner_ids.items()}
+        for name in names:
+            if name not in owner_ids:
+                PARSER_FETCHES.inc(source_type="vk", status="error")
+                logger.error(f"Не удалось получить информацию о VK источнике {name}, пропускаем парсинг")
+                outcomes[source_urls[name]] = PollOutcome(error=LookupError(f"VK владелец {name} не найден"))
+
+        last_ids = {owner_id: cursors.get(f"https://vk.com/{name}", {}).get('last_message_id', 0)
+                    for owner_id, name in names_by_owner.items()}
+        # Источник без курсора (первый опрос) забирает посты со вчерашнего дня, как и Telegram
+        since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        async with span("parser.vk_fetch"):
+            async for owner_id, items, truncated in self.vk_client.iter_new_posts(
+                    last_ids, since_ts=since.timestamp(), count=VK_WALL_COUNT):
+                name = names_by_owner[owner_id]
+                if items is None:
+                    PARSER_FETCHES.inc(source_type="vk", status="error")
+                    logger.error(f"Не удалось получить посты VK источника {name}")
+                    outcomes[source_urls[name]] = PollOutcome(error=RuntimeError(f"wall.get {name} не выполнен"))
+                    continue
+                if truncated:
+                    logger.warning(f"VK источник {name}: курсор не найден за {VK_MAX_PAGES} страниц, "
+                                   f"более старые новые посты пропущены")
+                last_id = last_ids[owner_id]
+                max_id = max((post['id'] for post in items), default=last_id)
+                posts = VKPostParser.format_posts(name, owner_id, items)
+                PARSER_FETCHES.inc(source_type="vk", status="ok")
+                PARSER_POSTS.inc(len(posts), source_type="vk")
                 if posts:
-                    logger.info(f"Получено {len(posts)} постов из {channel_name}")
-                    # Преобразуем формат даты
-                    for post in posts:
-                        if isinstance(post['date'], str):
-                            date_obj = datetime.strptime(post['date'], "%Y-%m-%d %H:%M:%S")
-                            post['date'] = date_obj.strftime("%d.%m.%Y")
-                    return posts
+                    logger.info(f"VK источник {name}: получено {len(posts)} постов")
                 else:
-                    logger.info(f"Постов не найдено в канале {channel_name}")
-                    return []
-        except Exception as e:
-            logger.error(f"Ошибка при парсинге Telegram источника {source['link']}: {e}", exc_info=True)
-        return []
+                    logger.info(f"Новых постов в VK источнике {name} нет")
+                await pipeline.put(f"https://vk.com/{name}", posts, max_id if max_id > last_id else None)
+                outcomes[source_urls[name]] = PollOutcome(new_posts=len(items))
+        return outcomes
 
-    async def parse_sources(self):
-        """Парсит все источники"""
+    async def parse_sources(self, sources: List[Dict[str, Any]] = None) -> Dict[str, PollOutcome]:
+        """
+        Парсит источники (по умолчанию - все активные).
+        Возвращает результаты опроса {source_url: PollOutcome} для планировщика.
+        """
         try:
-            # Проверяем состояние пула соединений
-            logger.info(f"Состояние пула БД: {self.db._pool}")
-            
-            if not self.db._pool:
-                logger.error("Пул соединений с БД не инициализирован!")
-                await self.db.init_pool()
-                logger.info("Пул соединений инициализирован")
-            
-            # Получаем список активных источников
-            logger.info("Получение списка активных источников...")
-            sources = await self.db.get_active_sources()
-            logger.info(f"Найдено источников: {len(sources)}")
+            if sources is None:
+                # Получаем список активных источников
+                logger.info("Получение списка активных источников...")
+                sources = await asyncio.to_thread(self.db.get_active_sources)
+                logger.info(f"Найдено источников: {len(sources)}")
             
             if not sources:
                 logger.warning("Нет активных источников для парсинга")
-                return
+                return {}
             
             # Логируем найденные источники
             for i, source in enumerate(sources):
-                logger.info(f"Источник {i+1}: {source.get('link', 'Нет ссылки')} - темы: {source.get('themes', 'Нет тем')}")
+                logger.info(f"Источник {i+1}: {source.get('source_url', 'Нет ссылки')} - темы: {source.get('themes', 'Нет тем')}")
             
-            all_posts = []
             telegram_sources = []
             vk_sources = []
             
             # Разделяем источники по типу
             for source in sources:
-                if 't.me' in source['link']:
+                if 't.me' in source['source_url']:
                     telegram_sources.append(source)
-                elif 'vk.com' in source['link']:
+                elif 'vk.com' in source['source_url']:
                     vk_sources.append(source)
                 else:
-                    logger.warning(f"Неподдерживаемый источник: {source['link']}")
+                    logger.warning(f"Неподдерживаемый источник: {source['source_url']}")
 
             logger.info(f"Telegram источников: {len(telegram_sources)}")
             logger.info(f"VK источников: {len(vk_sources)}")
 
-            # Параллельно обрабатываем Telegram источники
-            if telegram_sources:
-                logger.info("Начинаем парсинг Telegram источников...")
-                telegram_tasks = [self.parse_telegram_source(source) for source in telegram_sources]
-                telegram_results = await asyncio.gather(*telegram_tasks, return_exceptions=True)
-                for i, result in enumerate(telegram_results):
-                    if isinstance(result, list):  # Проверяем, что это не исключение
-                        logger.info(f"Telegram источник {i+1}: получено {len(result)} постов")
-                        all_posts.extend(result)
-                    elif isinstance(result, Exception):
-                        logger.error(f"Ошибка в Telegram источнике {i+1}: {result}")
-
-            # Обрабатываем VK источники
-            if vk_sources:
-                logger.info("Начинаем парсинг VK источников...")
-                for i, source in enumerate(vk_sources):
-                    try:
-                        group_name = source['link'].split('/')[-1]
-                        logger.info(f"Парсим VK группу: {group_name}")
-                        posts = self.vk_parser.get_posts(group_name)
-                        if posts:
-                            # Преобразуем формат даты для VK
-                            for post in posts:
-                                if isinstance(post['date'], int):
-                                    date_obj = datetime.fromtimestamp(post['date'])
-                                    post['date'] = date_obj.strftime("%d.%m.%Y")
-                            logger.info(f"VK источник {i+1}: получено {len(posts)} постов")
-                            all_posts.extend(posts)
-                        else:
-                            logger.info(f"VK источник {i+1}: постов не найдено")
-                    except Exception as e:
-                        logger.error(f"Ошибка при парсинге VK источника {source['link']}: {e}")
-                        continue
-
-            logger.info(f"Всего собрано постов: {len(all_posts)}")
-            
-            if all_posts:
-                logger.info("Сохраняем посты в базу данных...")
-                await self.db.save_posts_to_db(all_posts)
-                logger.info(f"Сохранено {len(all_posts)} постов")
+            # Telegram и VK источники парсятся одновременно, посты сохраняются по мере получения
+            cursors = await asyncio.to_thread(self.db.get_source_cursors)
+            async with PostSavePipeline(self.db) as pipeline:
+                telegram_outcomes, vk_outcomes = await asyncio.gather(
+                    self.parse_telegram_sources(telegram_sources, pipeline, cursors),
+                    self.parse_vk_sources(vk_sources, pipeline, cursors)
+                )
+
+            stats = pipeline.stats
+            self.saved_posts += stats.saved
+            fetched = sum(progress.fetched for progress in stats.sources.values())
+            logger.info(f"Всего собрано постов: {fetched}")
+            if stats.saved or stats.failed:
+                first_save = f", первая запись через {stats.first_save_after:.1f}с" if stats.first_save_after is not None else ""
+                logger.info(f"Сохранено {stats.saved} постов за {stats.flushes} записей{first_save}, не сохранено: {stats.failed}")
             else:
                 logger.info("Новых постов для сохранения не найдено")
+            return {**telegram_outcomes, **vk_outcomes}
             
         except Exception as e:
             logger.error(f"Ошибка при парсинге источников: {e}", exc_info=True)
+            return {}
 
     async def start_periodic_parsing(self):
-        """Запускает периодический парсинг источников"""
+        """
+        Опрашивает источники по адаптивному расписанию: на каждом тике парсятся только те,
+        кому пора (активные - чаще, "спящие" - реже, отложенные после FloodWait - позже).
+        """
+        try:
+            self.scheduler.load(await asyncio.to_thread(self.db.get_source_schedule))
+        except Exception as e:
+            logger.error(f"Не удалось загрузить расписание источников, начинаем с чистого: {e}")
+
         while True:
             try:
-                logger.info("Начало парсинга источников")
-                await self.parse_sources()
-                logger.info(f"Парсинг завершен. Следующий парсинг через {self.parse_interval} секунд")
-                await asyncio.sleep(self.parse_interval)
+                sources = await asyncio.to_thread(self.db.get_active_sources)
+                due = self.scheduler.due(sources)
+                if due:
+                    logger.info(f"Начало парсинга источников: {len(due)} из {len(sources)} по расписанию")
+                    outcomes = await self.parse_sources(due)
+                    for source in due:
+                        # Источник без результата (общая ошибка цикла) тоже откладываем
+                        outcome = outcomes.get(source['source_url']) or PollOutcome(error=RuntimeError("нет результата"))
+                        self.scheduler.record(source['source_url'], outcome)
+                    await asyncio.to_thread(self.db.save_source_schedule, self.scheduler.pop_dirty())
+                    self.cycles += 1
+                    self.last_cycle_at = time.time()
+                await asyncio.sleep(self.scheduler.sleep_time(sources))
             except Exception as e:
                 logger.error(f"Ошибка в цикле парсинга: {e}")
                 await asyncio.sleep(60)  # При ошибке ждем минуту перед следующей попыткой
 
+    async def refresh_telegram_metrics(self, post_links: Dict[str, List[str]]) -> Tuple[List[Dict], List[str]]:
+        """Метрики недавних постов Telegram каналов; возвращает (метрики, обновленные источники)"""
+        async def refresh(link: str, links: List[str]):
+            channel_name = self.telegram_channel_name(link)
+            try:
+                async with span("parser.telegram_metrics"):
+                    return link, await self.tg_parser.get_posts_metrics(channel_name, links)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении метрик канала {channel_name}: {e}")
+                return link, None
+
+        # Частоту запросов ограничивает планировщик запросов Telegram (приоритет ниже парсинга)
+        results = await asyncio.gather(*(
+            refresh(link, links) for link, links in post_links.items() if 't.me' in link
+        ))
+        metrics = [item for _, items in results if items for item in items]
+        return metrics, [link for link, items in results if items is not None]
+
+    async def refresh_vk_metrics(self, post_links: Dict[str, List[str]]) -> Tuple[List[Dict], List[str]]:
+        """Метрики недавних постов VK пачками wall.getById; возвращает (метрики, обновленные источники)"""
+        links_by_id = {}
+        source_by_id = {}
+        for link, links in post_links.items():
+            if 'vk.com' not in link:
+                continue
+            for post_link in links:
+                # https://vk.com/wall-123_456 -> -123_456
+                post_id = post_link.rstrip('/').split('/')[-1]
+                if post_id.startswith('wall'):
+                    links_by_id[post_id[len('wall'):]] = post_link
+                    source_by_id[post_id[len('wall'):]] = link
+        if not links_by_id:
+            return [], []
+        async with span("parser.vk_metrics"):
+            vk_metrics, failed_ids = await self.vk_client.get_posts_metrics(links_by_id)
+        metrics = [{'post_link': links_by_id[post_id], **values} for post_id, values in vk_metrics.items()
+                   if post_id in links_by_id]
+        # Источник с неудавшейся пачкой не отмечаем: его метрики обновятся на следующем проходе, а не через окно
+        failed_sources = {source_by_id[post_id] for post_id in failed_ids if post_id in source_by_id}
+        if failed_sources:
+            logger.warning(f"Метрики {len(failed_sources)} VK источников не обновлены из-за ошибок wall.getById")
+        return metrics, [link for link in post_links if 'vk.com' in link and link not in failed_sources]
+
+    async def refresh_metrics(self):
+        """
+        Обновляет просмотры, реакции и комментарии постов за последние METRICS_REFRESH_HOURS часов,
+        чтобы ранжирование кандидатов учитывало набранную, а не первоначальную активность.
+        Выполняется редко и отдельно от основного парсинга, который забирает только новые сообщения.
+        """
+        post_links = await asyncio.to_thread(self.db.get_recent_post_links, METRICS_REFRESH_HOURS)
+        if not post_links:
+            return
+        (tg_metrics, tg_refreshed), (vk_metrics, vk_refreshed) = await asyncio.gather(
+            self.refresh_telegram_metrics(post_links),
+            self.refresh_vk_metrics(post_links)
+        )
+        await asyncio.to_thread(self.db.update_posts_metrics, tg_metrics + vk_metrics)
+        await asyncio.to_thread(self.db.mark_metrics_refreshed, tg_refreshed + vk_refreshed)
+        PARSER_METRICS_REFRESHED.inc(len(tg_metrics), source_type="telegram")
+        PARSER_METRICS_REFRESHED.inc(len(vk_metrics), source_type="vk")
+        logger.info(f"📈 Обновлены метрики {len(tg_metrics)} постов из {len(tg_refreshed)} Telegram каналов "
+                    f"и {len(vk_metrics)} постов из {len(vk_refreshed)} VK источников")
+
+    async def start_periodic_metrics_refresh(self):
+        """Запускает редкое обновление метрик недавних постов"""
+        while True:
+            await asyncio.sleep(self.metrics_refresh_interval)
+            try:
+                await self.refresh_metrics()
+            except Exception as e:
+                logger.error(f"Ошибка в цикле обновления метрик: {e}")
+
 async def main():
     parser = SourceParser()
     try:
         await parser.initialize_db()
-        await parser.start_periodic_parsing()
+        await asyncio.gather(parser.start_periodic_parsing(), parser.start_periodic_metrics_refresh())
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки")
+    finally:
+        await parser.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
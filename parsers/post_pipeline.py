@@ -0,0 +1,143 @@
+"""
+Потоковое сохранение постов парсера.
+
+Раньше parse_sources собирал посты всех источников в один список и сохранял их в конце цикла:
+ошибка в конце теряла весь цикл, а память росла с числом источников.
+Теперь источники кладут пачки постов в ограниченную очередь (при заполнении - ждут),
+а писатель сохраняет их в БД по мере поступления и сдвигает курсоры сохраненных источников.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from config.settings import PARSE_QUEUE_MAXSIZE, PARSE_FLUSH_SIZE
+from utils.metrics import span, PARSER_SAVED, PARSER_PIPELINE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PostBatch:
+    source: str  # ссылка на источник
+    posts: List[Dict[str, Any]]
+    cursor: Optional[int] = None  # новый курсор источника (id последнего сообщения), если он сдвинулся
+
+
+@dataclass
+class SourceProgress:
+    fetched: int = 0
+    saved: int = 0
+    failed: int = 0
+
+
+@dataclass
+class PipelineStats:
+    saved: int = 0
+    failed: int = 0
+    flushes: int = 0
+    first_save_after: Optional[float] = None  # секунд от старта до первой записи
+    sources: Dict[str, SourceProgress] = field(default_factory=dict)
+
+
+class PostSavePipeline:
+    """
+    Очередь пачек постов и писатель, сохраняющий их в БД.
+    Использование:
+        async with PostSavePipeline(db) as pipeline:
+            await pipeline.put(source_link, posts, cursor)
+    При выходе из блока писатель дописывает очередь и останавливается.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db, maxsize: int = PARSE_QUEUE_MAXSIZE, flush_size: int = PARSE_FLUSH_SIZE):
+        self.db = db
+        self.flush_size = flush_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.stats = PipelineStats()
+        self._writer: Optional[asyncio.Task] = None
+        self._started_at = None
+
+    async def __aenter__(self):
+        self._started_at = time.monotonic()
+        self._writer = asyncio.create_task(self._run_writer())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.queue.put(self._STOP)
+        await self._writer
+        PARSER_PIPELINE_DEPTH.set(0)
+        return False
+
+    def _progress(self, source: str) -> SourceProgress:
+        return self.stats.sources.setdefault(source, SourceProgress())
+
+    async def put(self, source: str, posts: List[Dict[str, Any]], cursor: Optional[int] = None):
+        """Кладет пачку постов источника в очередь; ждет, если писатель не успевает"""
+        if not posts and cursor is None:
+            return
+        if self._writer is not None and self._writer.done():
+            raise RuntimeError("Писатель постов остановлен")
+        self._progress(source).fetched += len(posts)
+        await self.queue.put(PostBatch(source, posts, cursor))
+        PARSER_PIPELINE_DEPTH.set(self.queue.qsize())
+
+    async def _run_writer(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is self._STOP:
+                break
+            batches = [item]
+            size = len(item.posts)
+            # Забираем то, что уже накопилось в очереди, но не больше flush_size постов за запись
+            while size < self.flush_size and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batches.append(item)
+                size += len(item.posts)
+            PARSER_PIPELINE_DEPTH.set(self.queue.qsize())
+            await self._flush(batches)
+
+    async def _flush(self, batches: List[PostBatch]):
+        posts = [post for batch in batches for post in batch.posts]
+        try:
+            if posts:
+                async with span("parser.save_batch"):
+                    await asyncio.to_thread(self.db.save_posts_to_db, posts)
+            # Курсоры сдвигаем только после успешного сохранения, чтобы не потерять посты
+            cursors = {}
+            for batch in batches:
+                if batch.cursor is not None:
+                    cursors[batch.source] = max(batch.cursor, cursors.get(batch.source, 0))
+            if cursors:
+                await asyncio.to_thread(self.db.update_source_cursors, cursors)
+        except Exception as e:
+            self.stats.failed += len(posts)
+            PARSER_SAVED.inc(len(posts), status="failed")
+            for batch in batches:
+                self._progress(batch.source).failed += len(batch.posts)
+            logger.error(f"❌ Не удалось сохранить {len(posts)} постов из {len(batches)} пачек: {e}", exc_info=True)
+            return
+
+        self.stats.saved += len(posts)
+        self.stats.flushes += 1
+        if posts and self.stats.first_save_after is None:
+            self.stats.first_save_after = time.monotonic() - self._started_at
+        PARSER_SAVED.inc(len(posts), status="saved")
+        if posts:
+            # Будим цикл автопостинга бота (он в другом процессе)
+            try:
+                await asyncio.to_thread(self.db.notify_new_posts, len(posts))
+            except Exception as e:
+                logger.warning(f"Не удалось отправить уведомление о новых постах: {e}")
+        for batch in batches:
+            progress = self._progress(batch.source)
+            progress.saved += len(batch.posts)
+            if batch.posts:
+                logger.info(f"💾 {batch.source}: сохранено {progress.saved}/{progress.fetched} постов")
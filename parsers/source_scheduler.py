@@ -0,0 +1,196 @@
+"""
+Адаптивный планировщик опроса источников.
+
+Раньше все источники опрашивались с одним интервалом (parse_interval = 300):
+тихие каналы тратили запросы впустую, а у активных посты лежали до следующего цикла.
+Планировщик оценивает для каждого источника частоту постов (EWMA, постов в час)
+и ее профиль по часам суток, и выбирает интервал так, чтобы за опрос приходило
+около SOURCE_POLL_TARGET_POSTS новых постов, в пределах
+[SOURCE_POLL_MIN_INTERVAL, SOURCE_POLL_MAX_INTERVAL].
+
+После FloodWait источник откладывается на указанное Telegram время, после других ошибок -
+на экспоненциально растущий срок. Справедливость: за тик опрашиваются самые "просроченные"
+источники (не больше SOURCE_POLL_BATCH_LIMIT), а верхняя граница интервала гарантирует,
+что каждый источник опрашивается хотя бы раз в SOURCE_POLL_MAX_INTERVAL.
+"""
+
+import json
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from config.settings import (
+    SOURCE_POLL_MIN_INTERVAL, SOURCE_POLL_MAX_INTERVAL, SOURCE_POLL_TARGET_POSTS,
+    SOURCE_POLL_BATCH_LIMIT, SOURCE_SCHEDULER_TICK
+)
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SOURCE_POLLS = registry.counter("parser_source_polls_total", "Опросы источников планировщиком по результату")
+SOURCES_DUE = registry.gauge("parser_sources_due", "Источники, которым пора на опрос")
+
+# Полупериод забывания оценки частоты постов, часов
+RATE_HALF_LIFE_HOURS = 24.0
+HOURS_PER_DAY = 24
+
+
+@dataclass
+class PollOutcome:
+    new_posts: int = 0
+    error: Optional[BaseException] = None
+
+
+@dataclass
+class SourceState:
+    source_url: str
+    rate: float = 0.0  # постов в час, EWMA
+    hourly: List[Optional[float]] = field(default_factory=lambda: [None] * HOURS_PER_DAY)  # EWMA по часам суток
+    last_polled_at: Optional[float] = None
+    next_poll_at: float = 0.0
+    backoff_until: float = 0.0
+    errors: int = 0
+
+    @classmethod
+    def from_row(cls, source_url: str, row: Dict[str, Any]) -> "SourceState":
+        hourly = json.loads(row['hourly']) if row.get('hourly') else None
+        return cls(
+            source_url=source_url,
+            rate=row.get('rate') or 0.0,
+            hourly=hourly if hourly and len(hourly) == HOURS_PER_DAY else [None] * HOURS_PER_DAY,
+            last_polled_at=row.get('last_polled_at'),
+            next_poll_at=row.get('next_poll_at') or 0.0,
+            backoff_until=row.get('backoff_until') or 0.0,
+            errors=row.get('errors') or 0,
+        )
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            'source_url': self.source_url,
+            'rate': self.rate,
+            'hourly': json.dumps(self.hourly),
+            'last_polled_at': self.last_polled_at,
+            'next_poll_at': self.next_poll_at,
+            'backoff_until': self.backoff_until,
+            'errors': self.errors,
+        }
+
+
+class SourceScheduler:
+    """Решает, какие источники опрашивать сейчас, и учится на результатах опросов"""
+
+    def __init__(self, min_interval: float = SOURCE_POLL_MIN_INTERVAL, max_interval: float = SOURCE_POLL_MAX_INTERVAL,
+                 target_posts: float = SOURCE_POLL_TARGET_POSTS, batch_limit: int = SOURCE_POLL_BATCH_LIMIT,
+                 tick: float = SOURCE_SCHEDULER_TICK):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_posts = target_posts
+        self.batch_limit = batch_limit
+        self.tick = tick
+        self.states: Dict[str, SourceState] = {}
+        self._dirty: Dict[str, SourceState] = {}
+
+    def load(self, rows: Dict[str, Dict[str, Any]]) -> None:
+        """Загружает сохраненное состояние (DatabaseManager.get_source_schedule)"""
+        for source_url, row in rows.items():
+            self.states[source_url] = SourceState.from_row(source_url, row)
+        logger.info(f"🗓 Загружено расписание {len(rows)} источников")
+
+    def pop_dirty(self) -> List[Dict[str, Any]]:
+        """Измененные с прошлого сохранения состояния (для DatabaseManager.save_source_schedule)"""
+        rows = [state.to_row() for state in self._dirty.values()]
+        self._dirty.clear()
+        return rows
+
+    def _state(self, source_url: str) -> SourceState:
+        state = self.states.get(source_url)
+        if state is None:
+            # Новый источник опрашиваем сразу
+            state = self.states[source_url] = SourceState(source_url)
+        return state
+
+    def expected_rate(self, state: SourceState, now: float) -> float:
+        """Ожидаемая частота постов (в час) в текущий час суток"""
+        hour_rate = state.hourly[datetime.fromtimestamp(now).hour]
+        if hour_rate is None:
+            return state.rate
+        return (state.rate + hour_rate) / 2
+
+    def interval_for(self, state: SourceState, now: float) -> float:
+        rate = self.expected_rate(state, now)
+        if rate <= 0:
+            return self.max_interval
+        interval = self.target_posts / rate * 3600
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def due(self, sources: Iterable[Dict[str, Any]], now: float = None) -> List[Dict[str, Any]]:
+        """
+        Источники, которые пора опрашивать, начиная с самых просроченных.
+        Не больше batch_limit за раз - остальные останутся первыми в очереди на следующий тик.
+        """
+        now = now or time.time()
+        candidates = []
+        for source in sources:
+            state = self._state(source['source_url'])
+            if state.next_poll_at <= now and state.backoff_until <= now:
+                candidates.append((state.next_poll_at, source))
+        candidates.sort(key=lambda item: item[0])
+        SOURCES_DUE.set(len(candidates))
+        return [source for _, source in candidates[:self.batch_limit]]
+
+    def record(self, source_url: str, outcome: PollOutcome, now: float = None) -> None:
+        """Учитывает результат опроса и назначает следующий"""
+        now = now or time.time()
+        state = self._state(source_url)
+        self._dirty[source_url] = state
+
+        if outcome.error is not None:
+            state.errors += 1
+            flood_wait = getattr(outcome.error, 'seconds', None)
+            if flood_wait:
+                state.backoff_until = now + flood_wait
+                delay = flood_wait
+                SOURCE_POLLS.inc(result="flood_wait")
+                logger.warning(f"⏳ {source_url}: FloodWait {flood_wait}с, следующий опрос отложен")
+            else:
+                delay = min(self.min_interval * 2 ** state.errors, self.max_interval)
+                SOURCE_POLLS.inc(result="error")
+                logger.warning(f"⏳ {source_url}: ошибка опроса #{state.errors}, следующий через {delay:.0f}с")
+            state.next_poll_at = now + delay
+            return
+
+        state.errors = 0
+        SOURCE_POLLS.inc(result="ok")
+        if state.last_polled_at is not None:
+            elapsed_hours = max((now - state.last_polled_at) / 3600, 1 / 3600)
+            observed = outcome.new_posts / elapsed_hours
+            # Чем дольше не опрашивали, тем больше вес нового наблюдения; за RATE_HALF_LIFE_HOURS вес старой оценки
+            # падает вдвое независимо от частоты опросов
+            alpha = 1 - math.exp(-math.log(2) * elapsed_hours / RATE_HALF_LIFE_HOURS)
+            if all(value is None for value in state.hourly):
+                # Первое наблюдение частоты - берем как есть, иначе оценка долго растет от нуля
+                state.rate = observed
+            else:
+                state.rate = alpha * observed + (1 - alpha) * state.rate
+            hour = datetime.fromtimestamp(now).hour
+            previous = state.hourly[hour]
+            state.hourly[hour] = observed if previous is None else alpha * observed + (1 - alpha) * previous
+            state.next_poll_at = now + self.interval_for(state, now)
+        else:
+            # Первый опрос только задает точку отсчета, частоту узнаем по второму
+            state.next_poll_at = now + self.min_interval
+        state.last_polled_at = now
+
+    def sleep_time(self, sources: Iterable[Dict[str, Any]], now: float = None) -> float:
+        """Сколько ждать до следующего тика: до ближайшего опроса, но не дольше tick"""
+        now = now or time.time()
+        upcoming = [
+            max(self._state(source['source_url']).next_poll_at, self._state(source['source_url']).backoff_until)
+            for source in sources
+        ]
+        if not upcoming:
+            return self.tick
+        return min(max(min(upcoming) - now, 1.0), self.tick)
@@ -1,63 +1,154 @@
+import asyncio
 import psycopg2
-from telethon import TelegramClient
-from telethon.tl.functions.messages import GetHistoryRequest
-from config.settings import TG_PARSER_API_ID, TG_PARSER_API_HASH
+from telethon.tl.functions.messages import GetHistoryRequest, GetMessagesViewsRequest, GetMessagesReactionsRequest
+from telethon.errors import ChannelInvalidError, PeerIdInvalidError, FloodWaitError
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser, UpdateMessageReactions
+from telethon.utils import get_input_peer
 from database.DatabaseManager import DatabaseManager
+from parsers.telegram.shared_client import SharedParserClient, shared_parser_client
+from utils.resolver_cache import resolver_cache, TG_ENTITY
+from utils.telegram_scheduler import parser_scheduler, PRIORITY_PARSE, PRIORITY_METRICS
+from config.settings import TG_PARSE_MAX_FLOOD_WAIT, TG_METRICS_BATCH
 from datetime import datetime
 import logging
-import os
-import time
 
 logger = logging.getLogger(__name__)
 
 class TelegramPostParser:
-    def __init__(self):
-        # Создаем отдельную сессию для парсера (второй телефон)
-        project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        parser_session_path = os.path.join(project_root, 'parser_user_session')
-        
-        logger.info(f"Используем отдельную сессию парсера (второй телефон): {parser_session_path}")
-        
-        # Создаем пользовательский клиент (НЕ бот) для парсинга каналов
-        self.client = TelegramClient(parser_session_path, TG_PARSER_API_ID, TG_PARSER_API_HASH)
+    def __init__(self, shared_client: SharedParserClient = None):
+        # Пользовательский клиент (НЕ бот) отдельной сессии парсера (второй телефон).
+        # Клиент общий для всех источников и живет между циклами парсинга.
+        self.shared = shared_client or shared_parser_client
         self.db = DatabaseManager()
-        self._started = False
+
+    @property
+    def client(self):
+        return self.shared.client
 
     async def ensure_started(self):
-        """Убеждаемся, что клиент запущен"""
-        if not self._started:
-            logger.info("Запускаем Telegram клиент")
-            await self.client.start()
-            self._started = True
-            logger.info("Telegram клиент успешно запущен")
-
-    async def get_channel_posts(self, client, channel):
-        """Получает последние посты из канала"""
+        """Убеждаемся, что общий клиент запущен"""
+        await self.shared.get_client()
+
+    async def get_channel_posts(self, client, channel, min_id=0):
+        """
+        Получает посты из канала.
+        Если известен курсор источника (min_id), забираются только сообщения новее него,
+        иначе (первый запуск) - посты со вчерашнего дня.
+        """
         try:
-            # Получаем посты за вчера (для тестирования)
-            from datetime import timedelta
-            yesterday = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
             messages = []
-            
-            async for message in client.iter_messages(channel, offset_date=yesterday, reverse=True):
-                messages.append(message)
+            if min_id:
+                async for message in client.iter_messages(channel, min_id=min_id, reverse=True):
+                    messages.append(message)
+            else:
+                from datetime import timedelta
+                yesterday = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+                async for message in client.iter_messages(channel, offset_date=yesterday, reverse=True):
+                    messages.append(message)
             
             return messages
+        except (ConnectionError, OSError, ChannelInvalidError, PeerIdInvalidError, FloodWaitError):
+            # Сетевые ошибки, недействительный peer и FloodWait обрабатываются выше
+            # (переподключение, сброс кэша, отсрочка опроса источника)
+            raise
         except Exception as e:
+            # Закрытый канал и прочие ошибки тоже пробрасываем - планировщик источников отложит опросы
             logger.error(f"Ошибка при получении постов из канала: {e}")
-            return []
+            raise
+
+    async def resolve_channel(self, client, channel_username):
+        """
+        Возвращает InputPeer канала. id и access_hash берутся из кэша разрешения имен,
+        get_entity (ResolveUsername) вызывается только при промахе.
+        """
+        async def load():
+            try:
+                entity = await parser_scheduler.run(
+                    "resolve", lambda: client.get_entity(channel_username), entity=channel_username,
+                    priority=PRIORITY_PARSE, max_flood_wait=TG_PARSE_MAX_FLOOD_WAIT
+                )
+                peer = get_input_peer(entity)
+            except (ValueError, TypeError) as e:
+                # Telethon бросает ValueError, если username не существует
+                logger.warning(f"Канал {channel_username} не найден: {e}")
+                return None
+            if isinstance(peer, InputPeerChannel):
+                return {'type': 'channel', 'id': peer.channel_id, 'access_hash': peer.access_hash}
+            if isinstance(peer, InputPeerUser):
+                return {'type': 'user', 'id': peer.user_id, 'access_hash': peer.access_hash}
+            if isinstance(peer, InputPeerChat):
+                return {'type': 'chat', 'id': peer.chat_id}
+            return None
+
+        cached = await resolver_cache.resolve(TG_ENTITY, channel_username, load)
+        if cached is None:
+            raise ValueError(f"Канал {channel_username} не найден (закэшированный результат)")
+        if cached['type'] == 'channel':
+            return InputPeerChannel(cached['id'], cached['access_hash'])
+        if cached['type'] == 'user':
+            return InputPeerUser(cached['id'], cached['access_hash'])
+        return InputPeerChat(cached['id'])
+
+    async def _with_channel(self, channel_username, func):
+        """Выполняет запрос к каналу; если закэшированный peer перестал работать - разрешает имя заново"""
+        async with self.shared.acquire() as client:
+            channel = await self.resolve_channel(client, channel_username)
+            try:
+                return await func(client, channel)
+            except (ChannelInvalidError, PeerIdInvalidError) as e:
+                logger.warning(f"Закэшированный peer канала {channel_username} недействителен: {e}")
+                await asyncio.to_thread(resolver_cache.invalidate, TG_ENTITY, channel_username)
+                channel = await self.resolve_channel(client, channel_username)
+                return await func(client, channel)
+
+    async def _fetch_messages(self, channel_username, min_id=0):
+        return await self._with_channel(
+            channel_username,
+            lambda client, channel: parser_scheduler.run(
+                "history", lambda: self.get_channel_posts(client, channel, min_id), entity=channel_username,
+                priority=PRIORITY_PARSE, max_flood_wait=TG_PARSE_MAX_FLOOD_WAIT
+            )
+        )
+
+    async def _with_reconnect(self, func, *args):
+        """Выполняет запрос, при обрыве соединения переподключается и повторяет один раз"""
+        try:
+            return await func(*args)
+        except (ConnectionError, OSError) as e:
+            logger.warning(f"Сетевая ошибка Telegram клиента парсера: {e}. Переподключаемся")
+            await self.shared.reconnect()
+            return await func(*args)
+
+    @staticmethod
+    def channel_link(channel_username):
+        if not channel_username.startswith('http'):
+            return f"https://t.me/{channel_username}"
+        return channel_username
+
+    @staticmethod
+    def message_metrics(message):
+        """Просмотры, реакции и комментарии сообщения"""
+        likes = 0
+        if getattr(message, 'reactions', None) and message.reactions.results:
+            likes = sum(reaction.count for reaction in message.reactions.results)
+        comments_count = message.replies.replies if getattr(message, 'replies', None) else 0
+        return {
+            'views': message.views or 0,
+            'likes': likes,
+            'comments_count': comments_count,
+        }
 
     async def save_posts_with_retry(self, posts_data, max_retries=5, delay=1):
         """Сохраняет посты с механизмом повторных попыток при блокировке базы"""
         for attempt in range(max_retries):
             try:
-                await self.db.save_posts_to_db(posts_data)
+                await asyncio.to_thread(self.db.save_posts_to_db, posts_data)
                 return True
             except psycopg2.OperationalError as e:
                 if attempt < max_retries - 1:
                     wait_time = delay * (attempt + 1)  # Увеличиваем время ожидания с каждой попыткой
                     logger.warning(f"Проблема с подключением к базе данных, ожидаем {wait_time} сек перед повторной попыткой")
-                    time.sleep(wait_time)
+                    await asyncio.sleep(wait_time)
                 else:
                     logger.error("Не удалось сохранить данные после всех попыток")
                     raise
@@ -65,56 +156,108 @@ class TelegramPostParser:
                 logger.error(f"Неожиданная ошибка при сохранении данных: {e}")
                 raise
 
-    async def get_posts(self, channel_username):
+    async def get_posts(self, channel_username, min_id=0):
         """Получает посты из канала и возвращает их в нужном формате"""
+        posts, _ = await self.get_new_posts(channel_username, min_id)
+        return posts
+
+    async def get_new_posts(self, channel_username, min_id=0):
+        """
+        Получает посты новее min_id.
+
+        Returns:
+            tuple: (посты в формате для save_posts_to_db, максимальный id среди полученных сообщений
+                    или min_id, если новых сообщений нет) - второе значение используется как новый курсор
+        """
         try:
-            logger.info(f"Начинаем парсинг канала {channel_username}")
-            
-            # Получаем канал
-            channel = await self.client.get_entity(channel_username)
-            
-            # Получаем посты
-            posts = await self.get_channel_posts(self.client, channel)
-            logger.info(f"Найдено {len(posts)} постов для обработки в канале {channel_username}")
+            logger.info(f"Начинаем парсинг канала {channel_username} (min_id={min_id})")
             
-            # Форматируем ссылку на канал
-            if not channel_username.startswith('http'):
-                channel_link = f"https://t.me/{channel_username}"
-            else:
-                channel_link = channel_username
+            posts = await self._with_reconnect(self._fetch_messages, channel_username, min_id)
+            logger.info(f"Найдено {len(posts)} новых сообщений в канале {channel_username}")
             
+            channel_link = self.channel_link(channel_username)
+            max_id = min_id
             formatted_posts = []
             
             for post in posts:
+                # Курсор сдвигаем и по сообщениям без текста, чтобы не запрашивать их повторно
+                max_id = max(max_id, post.id)
                 if post.message:
                     formatted_post = {
                         'text': post.message,
                         'post_link': f"{channel_link}/{post.id}",
                         'group_link': channel_link,
                         'date': post.date.strftime("%Y-%m-%d %H:%M:%S"),
-                        'likes': 0,  # У Telegram нет публичного API для лайков
-                        'comments_count': 0  # У Telegram нет публичного API для комментариев
+                        'comments_likes': 0,
+                        **self.message_metrics(post)
                     }
                     
                     # Фото пропускаем (отключено для избежания блокировок)
-                    # if post.media:
-                    #     try:
-                    #         # Скачиваем фото
-                    #         path = await self.client.download_media(post.media, file=bytes)
-                    #         if path:
-                    #             formatted_post['photo_url'] = path
-                    #     except Exception as e:
-                    #         logger.error(f"Ошибка при скачивании медиа: {e}")
                     formatted_post['photo_url'] = None
                     
                     formatted_posts.append(formatted_post)
             
-            return formatted_posts
+            return formatted_posts, max_id
             
+        except FloodWaitError:
+            # Планировщик источников откладывает следующий опрос канала на время FloodWait
+            raise
         except Exception as e:
+            # Пробрасываем: планировщик должен увидеть ошибку (закрытый или удаленный канал) и отложить опросы
             logger.error(f"Ошибка при получении постов из канала {channel_username}: {e}")
+            raise
+
+    async def get_posts_metrics(self, channel_username, post_links):
+        """
+        Запрашивает актуальные метрики уже сохраненных постов пачками по TG_METRICS_BATCH id, не загружая сами сообщения:
+        просмотры и комментарии - GetMessagesViewsRequest, реакции - GetMessagesReactionsRequest
+        """
+        ids = []
+        for link in post_links:
+            try:
+                ids.append(int(link.rstrip('/').split('/')[-1]))
+            except ValueError:
+                continue
+        if not ids:
             return []
 
+        channel_link = self.channel_link(channel_username)
+
+        async def fetch_chunk(client, channel, chunk):
+            views = await parser_scheduler.run(
+                "history", lambda: client(GetMessagesViewsRequest(peer=channel, id=chunk, increment=False)),
+                entity=channel_username, priority=PRIORITY_METRICS, max_flood_wait=TG_PARSE_MAX_FLOOD_WAIT
+            )
+            reactions = await parser_scheduler.run(
+                "history", lambda: client(GetMessagesReactionsRequest(peer=channel, id=chunk)),
+                entity=channel_username, priority=PRIORITY_METRICS, max_flood_wait=TG_PARSE_MAX_FLOOD_WAIT
+            )
+            likes = {}
+            for update in getattr(reactions, 'updates', []):
+                if isinstance(update, UpdateMessageReactions) and update.reactions.results:
+                    likes[update.msg_id] = sum(reaction.count for reaction in update.reactions.results)
+            return [
+                {
+                    'post_link': f"{channel_link}/{msg_id}",
+                    'views': message_views.views,
+                    'likes': likes.get(msg_id, 0),
+                    'comments_count': message_views.replies.replies if message_views.replies else 0,
+                }
+                # У удаленных сообщений просмотров нет - их не трогаем
+                for msg_id, message_views in zip(chunk, views.views) if message_views.views is not None
+            ]
+
+        async def fetch():
+            metrics = []
+            for i in range(0, len(ids), TG_METRICS_BATCH):
+                chunk = ids[i:i + TG_METRICS_BATCH]
+                metrics.extend(await self._with_channel(
+                    channel_username, lambda client, channel: fetch_chunk(client, channel, chunk)
+                ))
+            return metrics
+
+        return await self._with_reconnect(fetch)
+
     async def save_posts(self, channel_username):
         """Получает и сохраняет посты из канала"""
         try:
@@ -134,21 +277,16 @@ class TelegramPostParser:
             pass
 
     async def stop(self):
-        """Останавливаем Telegram клиент"""
-        if self._started:
-            logger.info("Останавливаем Telegram клиент")
-            try:
-                await self.client.disconnect()
-                self._started = False
-                logger.info("Telegram клиент успешно остановлен")
-            except Exception as e:
-                logger.error(f"Ошибка при остановке Telegram клиента: {e}")
+        """Останавливаем общий Telegram клиент (вызывается один раз при завершении парсера)"""
+        try:
+            await self.shared.close()
+        except Exception as e:
+            logger.error(f"Ошибка при остановке Telegram клиента: {e}")
 
     async def __aenter__(self):
-        """Контекстный менеджер для автоматического закрытия клиента"""
         await self.ensure_started()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """Автоматическое закрытие клиента при выходе из контекстного менеджера"""
-        await self.stop() 
\ No newline at end of file
+        """Общий клиент не отключаем: он переиспользуется следующими источниками"""
+        pass 
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+Общий долгоживущий Telethon-клиент для парсинга Telegram каналов.
+
+Раньше каждый источник открывал собственный клиент на одном и том же файле сессии:
+start()/disconnect() на каждый канал и конкуренция за SQLite-сессию при asyncio.gather.
+Теперь клиент подключается один раз и переиспользуется всеми источниками и циклами парсинга.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from telethon import TelegramClient
+
+from config.settings import TG_PARSER_API_ID, TG_PARSER_API_HASH, TG_PARSER_SESSION_PATH, TG_PARSER_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+
+class SharedParserClient:
+    """Один подключенный клиент парсера с переподключением и ограничением параллельных запросов"""
+
+    def __init__(self, session_path: str = TG_PARSER_SESSION_PATH, concurrency: int = TG_PARSER_CONCURRENCY):
+        self.session_path = session_path
+        self.concurrency = concurrency
+        self.client: Optional[TelegramClient] = None
+        self._start_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._started = False
+
+    def _create_client(self) -> TelegramClient:
+        return TelegramClient(
+            self.session_path,
+            TG_PARSER_API_ID,
+            TG_PARSER_API_HASH,
+            auto_reconnect=True,
+            connection_retries=5,
+            retry_delay=2,
+            # Telethon не спит на FloodWait сам: ожидание и парковку метода делает parser_scheduler
+            flood_sleep_threshold=0
+        )
+
+    async def get_client(self) -> TelegramClient:
+        """Возвращает подключенный клиент, при необходимости запускает или переподключает его"""
+        if self._started and self.client.is_connected():
+            return self.client
+
+        async with self._start_lock:
+            if self.client is None:
+                self.client = self._create_client()
+
+            if not self._started:
+                logger.info(f"🔌 Запускаем общий Telegram клиент парсера: {self.session_path}")
+                await self.client.start()
+                self._started = True
+                logger.info("✅ Общий Telegram клиент парсера запущен")
+            elif not self.client.is_connected():
+                logger.warning("🔄 Telegram клиент парсера отключен, переподключаемся")
+                await self.client.connect()
+                logger.info("✅ Telegram клиент парсера переподключен")
+
+        return self.client
+
+    async def reconnect(self):
+        """Принудительное переподключение после сетевой ошибки"""
+        async with self._start_lock:
+            if self.client is None:
+                return
+            try:
+                await self.client.disconnect()
+            except Exception as e:
+                logger.warning(f"Ошибка при отключении Telegram клиента парсера: {e}")
+            await self.client.connect()
+            logger.info("✅ Telegram клиент парсера переподключен")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        Ограничивает число одновременных обращений к Telegram (get_entity, iter_messages).
+        Использование:
+            async with shared_parser_client.acquire() as client:
+                await client.get_entity(...)
+        """
+        async with self._semaphore:
+            yield await self.get_client()
+
+    async def close(self):
+        async with self._start_lock:
+            if self.client is not None and self.client.is_connected():
+                await self.client.disconnect()
+                logger.info("🛑 Общий Telegram клиент парсера остановлен")
+            self._started = False
+
+
+shared_parser_client = SharedParserClient()
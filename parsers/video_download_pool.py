@@ -0,0 +1,265 @@
+"""
+Скачивание видео через yt-dlp в отдельных процессах.
+
+yt-dlp синхронный и нагружает CPU (разбор страниц, склейка потоков), поэтому даже в потоке
+он мешал event loop. Здесь задания ставятся в ограниченную очередь, а несколько воркеров
+запускают для каждого задания отдельный процесс:
+    - размер видео проверяется по метаданным до скачивания (VIDEO_MAX_SIZE_MB);
+    - процесс завершается по таймауту (VIDEO_DOWNLOAD_TIMEOUT) или при отмене ожидающей корутины;
+    - прогресс скачивания приходит из процесса через pipe и попадает в метрики и в колбэк вызывающего.
+
+Использование:
+    path = await video_download_pool.download(url, temp_dir)
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from config.settings import VIDEO_DOWNLOAD_WORKERS, VIDEO_DOWNLOAD_QUEUE, VIDEO_DOWNLOAD_TIMEOUT, VIDEO_MAX_SIZE_MB
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+VIDEO_DOWNLOADS = registry.counter("video_downloads_total", "Задания скачивания видео по результату")
+VIDEO_DOWNLOAD_BYTES = registry.counter("video_download_bytes_total", "Скачанные байты видео (по прогрессу yt-dlp)")
+VIDEO_DOWNLOAD_SECONDS = registry.histogram(
+    "video_download_seconds",
+    "Длительность задания скачивания видео, секунд",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200)
+)
+VIDEO_DOWNLOAD_QUEUE_DEPTH = registry.gauge("video_download_queue_depth", "Задания скачивания видео в очереди")
+VIDEO_DOWNLOAD_ACTIVE = registry.gauge("video_download_active", "Выполняющиеся задания скачивания видео")
+
+# Как часто процесс сообщает о прогрессе, секунд
+PROGRESS_INTERVAL = 1.0
+VIDEO_FORMAT = 'best[height<=720]'  # Максимум 720p для экономии места
+
+
+class VideoDownloadError(Exception):
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(f"{reason}: {message}" if message else reason)
+        self.reason = reason  # too_large / timeout / cancelled / failed / queue_full
+
+
+def _expected_size(info: dict) -> Optional[int]:
+    """Размер выбранного формата по метаданным (для видео из отдельных дорожек - сумма)"""
+    formats = info.get('requested_formats') or [info]
+    sizes = [fmt.get('filesize') or fmt.get('filesize_approx') for fmt in formats]
+    if any(size is None for size in sizes):
+        return None
+    return int(sum(sizes))
+
+
+def _download_job(url: str, temp_dir: str, max_bytes: int, conn) -> None:
+    """Выполняется в дочернем процессе: метаданные, проверка размера, скачивание с прогрессом"""
+    import yt_dlp
+
+    last_sent = [0.0]
+
+    def progress_hook(status):
+        if status.get('status') != 'downloading':
+            return
+        downloaded = status.get('downloaded_bytes') or 0
+        if downloaded > max_bytes:
+            # Метаданные могли не содержать размер - прерываем скачивание здесь
+            raise yt_dlp.utils.DownloadError(f"файл больше {max_bytes} байт")
+        now = time.monotonic()
+        if now - last_sent[0] >= PROGRESS_INTERVAL:
+            last_sent[0] = now
+            conn.send(('progress', downloaded, status.get('total_bytes') or status.get('total_bytes_estimate')))
+
+    ydl_opts = {
+        'outtmpl': os.path.join(temp_dir, '%(id)s.%(ext)s'),
+        'format': VIDEO_FORMAT,
+        'quiet': True,
+        'no_warnings': True,
+        'max_filesize': max_bytes,
+        'progress_hooks': [progress_hook],
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            size = _expected_size(info)
+            if size is not None and size > max_bytes:
+                conn.send(('error', 'too_large', f"{size / 1024 / 1024:.1f} MB по метаданным"))
+                return
+            info = ydl.process_ie_result(info, download=True)
+            path = ydl.prepare_filename(info)
+        if not os.path.exists(path):
+            conn.send(('error', 'failed', "файл не найден после скачивания"))
+            return
+        conn.send(('done', path, os.path.getsize(path)))
+    except Exception as e:
+        reason = 'too_large' if 'больше' in str(e) or 'max-filesize' in str(e).lower() else 'failed'
+        conn.send(('error', reason, str(e)))
+    finally:
+        conn.close()
+
+
+@dataclass
+class _Job:
+    url: str
+    temp_dir: str
+    future: asyncio.Future
+    on_progress: Optional[Callable[[int, Optional[int]], None]] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class VideoDownloadPool:
+    """Очередь заданий yt-dlp и воркеры, запускающие каждое задание в отдельном процессе"""
+
+    def __init__(self, workers: int = VIDEO_DOWNLOAD_WORKERS, max_queue: int = VIDEO_DOWNLOAD_QUEUE,
+                 timeout: float = VIDEO_DOWNLOAD_TIMEOUT, max_size_mb: float = VIDEO_MAX_SIZE_MB):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        # spawn: дочерний процесс не наследует потоки и соединения с БД родителя
+        self._context = multiprocessing.get_context("spawn")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._active = 0
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def download(self, url: str, temp_dir: str,
+                       on_progress: Callable[[int, Optional[int]], None] = None) -> str:
+        """
+        Скачивает видео в temp_dir и возвращает путь к файлу.
+        Отмена корутины снимает задание из очереди или завершает его процесс.
+        """
+        self._ensure_workers()
+        job = _Job(url, temp_dir, asyncio.get_running_loop().create_future(), on_progress)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            VIDEO_DOWNLOADS.inc(status="queue_full")
+            raise VideoDownloadError("queue_full", f"в очереди уже {self.max_queue} заданий")
+        VIDEO_DOWNLOAD_QUEUE_DEPTH.set(self._queue.qsize())
+        return await job.future
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            VIDEO_DOWNLOAD_QUEUE_DEPTH.set(self._queue.qsize())
+            if job.future.done():
+                # Вызывающий отменил задание, пока оно ждало в очереди
+                VIDEO_DOWNLOADS.inc(status="cancelled")
+                continue
+            self._active += 1
+            VIDEO_DOWNLOAD_ACTIVE.set(self._active)
+            started = time.monotonic()
+            status = "error"
+            try:
+                path = await self._run_job(job)
+                status = "ok"
+                if not job.future.done():
+                    job.future.set_result(path)
+            except VideoDownloadError as e:
+                status = e.reason
+                if not job.future.done():
+                    job.future.set_exception(e)
+            except asyncio.CancelledError:
+                status = "cancelled"
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(VideoDownloadError("failed", str(e)))
+            finally:
+                self._active -= 1
+                VIDEO_DOWNLOAD_ACTIVE.set(self._active)
+                VIDEO_DOWNLOADS.inc(status=status)
+                VIDEO_DOWNLOAD_SECONDS.observe(time.monotonic() - started, status=status)
+
+    async def _run_job(self, job: _Job) -> str:
+        loop = asyncio.get_running_loop()
+        recv_conn, send_conn = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_download_job, args=(job.url, job.temp_dir, self.max_bytes, send_conn), daemon=True
+        )
+        process.start()
+        send_conn.close()
+
+        messages: asyncio.Queue = asyncio.Queue()
+
+        def on_readable():
+            try:
+                messages.put_nowait(recv_conn.recv())
+            except (EOFError, OSError):
+                loop.remove_reader(recv_conn.fileno())
+                messages.put_nowait(('error', 'failed', "процесс завершился без результата"))
+
+        loop.add_reader(recv_conn.fileno(), on_readable)
+
+        async def read_result():
+            reported = 0
+            while True:
+                message = await messages.get()
+                if message[0] == 'progress':
+                    _, downloaded, total = message
+                    VIDEO_DOWNLOAD_BYTES.inc(max(downloaded - reported, 0))
+                    reported = max(reported, downloaded)
+                    if job.on_progress:
+                        job.on_progress(downloaded, total)
+                    continue
+                return message
+
+        result_task = asyncio.create_task(read_result())
+        try:
+            done, _ = await asyncio.wait({result_task, job.future}, timeout=self.timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if result_task not in done:
+                if job.future.done():
+                    raise VideoDownloadError("cancelled", job.url)
+                raise VideoDownloadError("timeout", f"{job.url} не скачано за {self.timeout:.0f}с")
+            message = result_task.result()
+            if message[0] == 'done':
+                _, path, size = message
+                logger.info(f"✅ Видео {job.url} скачано: {size / 1024 / 1024:.2f} MB")
+                return path
+            _, reason, text = message
+            raise VideoDownloadError(reason, text)
+        finally:
+            finished = result_task.done() and not result_task.cancelled()
+            result_task.cancel()
+            try:
+                loop.remove_reader(recv_conn.fileno())
+            except (ValueError, OSError):
+                pass
+            recv_conn.close()
+            if finished:
+                # Процесс отправил результат и сейчас завершится сам
+                await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                logger.warning(f"🛑 Останавливаем процесс скачивания {job.url} (pid {process.pid})")
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.kill()
+                await asyncio.to_thread(process.join)
+
+    async def close(self):
+        """Останавливает воркеры (их процессы завершаются) и отменяет задания из очереди"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait().future.cancel()
+        self._queue = None
+        VIDEO_DOWNLOAD_QUEUE_DEPTH.set(0)
+
+
+video_download_pool = VideoDownloadPool()
@@ -0,0 +1,287 @@
+"""
+Асинхронный клиент VK API на aiohttp.
+
+Синхронный vk_api блокировал event loop на каждом HTTP запросе, а каждый источник
+стоил отдельного вызова wall.get. Здесь вызовы wall.get объединяются по VK_EXECUTE_BATCH (25)
+в один метод execute, а частота запросов ограничивается token bucket (VK_REQUESTS_PER_SECOND).
+Новые посты отбираются по курсору (id последнего полученного поста), стена листается
+страницами, пока не дойдет до курсора или не исчерпает VK_MAX_PAGES.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import aiohttp
+
+from config.settings import (
+    VK_API_URL, VK_API_VERSION, VK_REQUESTS_PER_SECOND, VK_EXECUTE_BATCH, VK_WALL_COUNT, VK_MAX_PAGES,
+    VK_GET_BY_ID_BATCH
+)
+from utils.metrics import registry, span
+from utils.rate_limit import TokenBucket
+from utils.resolver_cache import ResolverCache, resolver_cache, VK_OWNER, _MISSING
+
+logger = logging.getLogger(__name__)
+
+VK_REQUESTS = registry.counter("vk_requests_total", "HTTP запросы к VK API по методу и результату")
+
+# Ошибки VK, после которых запрос стоит повторить
+VK_TOO_MANY_REQUESTS = 6
+VK_RETRYABLE_CODES = (VK_TOO_MANY_REQUESTS, 10)  # 10 - внутренняя ошибка сервера VK
+# Коды ошибок VK API, означающие, что такого владельца нет
+VK_NOT_FOUND_CODES = (100, 113)
+VK_GROUPS_PER_REQUEST = 500
+
+
+def select_new_posts(items: List[Dict], last_id: int = 0, since_ts: float = 0) -> Tuple[List[Dict], bool]:
+    """
+    Отбирает со страницы стены посты новее курсора last_id (без курсора - не старше since_ts).
+    Возвращает (новые посты, дошли ли до старых постов): стена отдается от новых к старым,
+    поэтому старый незакрепленный пост означает, что следующие страницы не нужны.
+    """
+    new_items = []
+    reached = False
+    for post in items:
+        is_new = post['id'] > last_id if last_id else post['date'] >= since_ts
+        if is_new:
+            new_items.append(post)
+        elif not post.get('is_pinned'):
+            # Закрепленный пост может быть старым и стоять первым
+            reached = True
+    return new_items, reached
+
+
+class VKAPIError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(f"[{code}] {message}")
+        self.code = code
+        self.message = message
+
+
+class AsyncVKClient:
+    """Асинхронный клиент VK API с батчингом через execute и ограничением частоты"""
+
+    def __init__(self, token: str, api_url: str = VK_API_URL, version: str = VK_API_VERSION,
+                 requests_per_second: float = VK_REQUESTS_PER_SECOND, max_retries: int = 3,
+                 cache: ResolverCache = resolver_cache):
+        self.token = token
+        self.cache = cache
+        self.api_url = api_url.rstrip('/')
+        self.version = version
+        self.max_retries = max_retries
+        # Без всплесков: VK считает лимит по скользящему окну в секунду
+        self.bucket = TokenBucket(requests_per_second, capacity=1)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self._session
+
+    async def _request(self, method: str, params: Dict) -> Dict:
+        """Один HTTP запрос к методу API с повторами при 'слишком много запросов'"""
+        session = await self._get_session()
+        data = {**params, 'access_token': self.token, 'v': self.version}
+
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            async with span("vk.request", method=method):
+                async with session.post(f"{self.api_url}/{method}", data=data) as response:
+                    payload = await response.json(content_type=None)
+
+            error = payload.get('error')
+            if not error:
+                VK_REQUESTS.inc(method=method, status="ok")
+                return payload
+
+            code = error.get('error_code')
+            if code in VK_RETRYABLE_CODES and attempt < self.max_retries:
+                VK_REQUESTS.inc(method=method, status="retry")
+                delay = 1.0 * (attempt + 1)
+                logger.warning(f"⏳ VK {method}: ошибка {code}, повтор через {delay:.0f}с")
+                if code == VK_TOO_MANY_REQUESTS:
+                    self.bucket.penalize(delay)
+                else:
+                    await asyncio.sleep(delay)
+                continue
+
+            VK_REQUESTS.inc(method=method, status="error")
+            raise VKAPIError(code, error.get('error_msg', ''))
+
+    async def call(self, method: str, **params):
+        """Вызывает метод API и возвращает поле response"""
+        return (await self._request(method, params))['response']
+
+    async def execute(self, calls: List[Tuple[str, Dict]]) -> List:
+        """
+        Выполняет до VK_EXECUTE_BATCH вызовов одним запросом execute.
+        Возвращает результаты в том же порядке; для вызовов, завершившихся ошибкой, - None.
+        """
+        if len(calls) > VK_EXECUTE_BATCH:
+            raise ValueError(f"execute поддерживает не больше {VK_EXECUTE_BATCH} вызовов")
+        code = "return [" + ",".join(
+            f"API.{method}({json.dumps(params, ensure_ascii=False)})" for method, params in calls
+        ) + "];"
+        payload = await self._request('execute', {'code': code})
+        for error in payload.get('execute_errors', []):
+            logger.warning(f"⚠️ VK execute: {error.get('method')} - [{error.get('error_code')}] {error.get('error_msg')}")
+        return [item if item is not False else None for item in payload['response']]
+
+    async def iter_wall_batches(self, owner_ids: Iterable[int], count: int = 20, offset: int = 0):
+        """
+        Получает стены по VK_EXECUTE_BATCH вызовов wall.get на запрос и отдает результаты
+        пачками по мере готовности: {owner_id: список постов или None при ошибке}.
+        """
+        owner_ids = list(dict.fromkeys(owner_ids))
+        batches = [owner_ids[i:i + VK_EXECUTE_BATCH] for i in range(0, len(owner_ids), VK_EXECUTE_BATCH)]
+
+        async def run_batch(batch):
+            calls = [('wall.get', {'owner_id': owner_id, 'count': count, 'offset': offset}) for owner_id in batch]
+            try:
+                results = await self.execute(calls)
+            except (VKAPIError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"❌ Ошибка execute для {len(batch)} стен VK: {e}")
+                results = [None] * len(batch)
+            return {owner_id: (result or {}).get('items') if result is not None else None
+                    for owner_id, result in zip(batch, results)}
+
+        for future in asyncio.as_completed([run_batch(batch) for batch in batches]):
+            yield await future
+
+    async def iter_new_posts(self, cursors: Dict[int, int], since_ts: float = 0, count: int = VK_WALL_COUNT,
+                             max_pages: int = VK_MAX_PAGES):
+        """
+        Листает стены от новых постов к старым до курсора владельца ({owner_id: id последнего поста},
+        0 - курсора нет, берутся посты не старше since_ts), но не больше max_pages страниц.
+        Отдает владельцев по мере готовности: (owner_id, новые посты или None при ошибке, исчерпан ли бюджет страниц).
+        """
+        collected = {owner_id: {} for owner_id in cursors}
+        pending = list(collected)
+        page = 0
+        while pending:
+            next_pending = []
+            async for walls in self.iter_wall_batches(pending, count=count, offset=page * count):
+                for owner_id, items in walls.items():
+                    if items is None:
+                        collected.pop(owner_id)
+                        yield owner_id, None, False
+                        continue
+                    new_items, reached = select_new_posts(items, cursors[owner_id], since_ts)
+                    # Если за время листания вышли новые посты, стена сдвигается и посты повторяются
+                    for post in new_items:
+                        collected[owner_id][post['id']] = post
+                    if reached or len(items) < count:
+                        yield owner_id, list(collected.pop(owner_id).values()), False
+                    elif page + 1 >= max_pages:
+                        yield owner_id, list(collected.pop(owner_id).values()), True
+                    else:
+                        next_pending.append(owner_id)
+            pending = next_pending
+            page += 1
+
+    async def get_posts_metrics(self, post_ids: Iterable[str]) -> Tuple[Dict[str, Dict[str, int]], Set[str]]:
+        """
+        Актуальные лайки, просмотры и комментарии постов по id вида "{owner_id}_{post_id}".
+        wall.getById принимает до VK_GET_BY_ID_BATCH постов, а вызовы объединяются в execute,
+        так что один запрос обновляет до 2500 постов. Удаленные посты в ответ не попадают.
+
+        Returns:
+            tuple: (метрики по id поста, id постов, метрики которых получить не удалось - ошибка execute или вызова)
+        """
+        post_ids = list(dict.fromkeys(post_ids))
+        chunks = [post_ids[i:i + VK_GET_BY_ID_BATCH] for i in range(0, len(post_ids), VK_GET_BY_ID_BATCH)]
+        batches = [chunks[i:i + VK_EXECUTE_BATCH] for i in range(0, len(chunks), VK_EXECUTE_BATCH)]
+
+        async def run_batch(batch):
+            calls = [('wall.getById', {'posts': ",".join(chunk)}) for chunk in batch]
+            try:
+                return batch, await self.execute(calls)
+            except (VKAPIError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"❌ Ошибка execute wall.getById для {sum(map(len, batch))} постов VK: {e}")
+                return batch, [None] * len(batch)
+
+        metrics = {}
+        failed = set()
+        for batch, results in await asyncio.gather(*(run_batch(batch) for batch in batches)):
+            for chunk, posts in zip(batch, results):
+                if posts is None:
+                    failed.update(chunk)
+                    continue
+                # В старых версиях API ответ - список, в новых - {'items': [...]}
+                items = posts.get('items', []) if isinstance(posts, dict) else posts or []
+                for post in items:
+                    metrics[f"{post['owner_id']}_{post['id']}"] = {
+                        'likes': post.get('likes', {}).get('count', 0),
+                        'views': post.get('views', {}).get('count', 0),
+                        'comments_count': post.get('comments', {}).get('count', 0),
+                    }
+        return metrics, failed
+
+    async def wall_get_many(self, owner_ids: Iterable[int], count: int = 20, offset: int = 0) -> Dict[int, Optional[List[Dict]]]:
+        """Получает стены нескольких владельцев: {owner_id: список постов или None при ошибке}"""
+        walls = {}
+        async for batch_result in self.iter_wall_batches(owner_ids, count, offset):
+            walls.update(batch_result)
+        return walls
+
+    async def resolve_owners(self, names: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Разрешает короткие имена VK в {'type', 'id'} (id групп отрицательный) через кэш.
+        Промахи разрешаются пачками: groups.getById по 500 имен, затем users.get для остальных.
+        """
+        result = {}
+        missing = []
+        for name in dict.fromkeys(names):
+            cached = await asyncio.to_thread(self.cache.get, VK_OWNER, name)
+            if cached is _MISSING:
+                missing.append(name)
+            else:
+                result[name] = cached
+        if not missing:
+            return result
+
+        by_alias = {}
+        for name in missing:
+            by_alias.setdefault(name.lower(), []).append(name)
+        resolved = {}
+        for i in range(0, len(missing), VK_GROUPS_PER_REQUEST):
+            chunk = missing[i:i + VK_GROUPS_PER_REQUEST]
+            try:
+                groups = await self.call('groups.getById', group_ids=",".join(chunk))
+            except VKAPIError as e:
+                if e.code not in VK_NOT_FOUND_CODES:
+                    raise
+                groups = []
+            for group in groups:
+                aliases = (str(group['id']), f"club{group['id']}", f"public{group['id']}", str(group.get('screen_name', '')).lower())
+                for alias in aliases:
+                    for name in by_alias.get(alias, []):
+                        resolved[name] = {'type': 'group', 'id': -group['id']}
+
+        not_groups = [name for name in missing if name not in resolved]
+        if not_groups:
+            try:
+                users = await self.call('users.get', user_ids=",".join(not_groups), fields='screen_name')
+            except VKAPIError as e:
+                if e.code not in VK_NOT_FOUND_CODES:
+                    raise
+                users = []
+            for user in users:
+                aliases = (str(user['id']), f"id{user['id']}", str(user.get('screen_name', '')).lower())
+                for alias in aliases:
+                    for name in by_alias.get(alias, []):
+                        resolved.setdefault(name, {'type': 'user', 'id': user['id']})
+
+        for name in missing:
+            value = resolved.get(name)
+            if value is None:
+                logger.warning(f"⚠️ VK владелец {name} не найден")
+            await asyncio.to_thread(self.cache.set, VK_OWNER, name, value)
+            result[name] = value
+        return result
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
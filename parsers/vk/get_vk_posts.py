@@ -1,111 +1,152 @@
 import vk_api
 from vk_api.exceptions import ApiError
-from config.settings import VK_API_VERSION
+from config.settings import VK_API_VERSION, VK_WALL_COUNT, VK_MAX_PAGES
+from parsers.vk.async_vk_client import select_new_posts
 from database.DatabaseManager import DatabaseManager
+from utils.resolver_cache import resolver_cache, VK_OWNER
 from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Коды ошибок VK API, означающие, что такого владельца нет (остальные ошибки не кэшируем)
+VK_NOT_FOUND_CODES = (100, 113)
+
 class VKPostParser:
     def __init__(self, token):
         self.vk_session = vk_api.VkApi(token=token)
         self.vk = self.vk_session.get_api()
         self.db = DatabaseManager()
 
+    @staticmethod
+    def clean_name(name):
+        """Очищает URL от параметров запроса и протокола"""
+        if '?' in name:
+            name = name.split('?')[0]
+        if '//' in name:
+            name = name.split('//')[-1]
+        if 'vk.com/' in name:
+            name = name.replace('vk.com/', '')
+        return name.strip('/')
+
+    @staticmethod
+    def format_post(name, owner_id, post):
+        """Преобразует пост из wall.get в формат таблицы posts"""
+        # Получаем фото из поста, если есть
+        photo_url = None
+        for attachment in post.get('attachments', []):
+            if attachment['type'] == 'photo':
+                sizes = attachment['photo']['sizes']
+                photo_url = max(sizes, key=lambda x: x['height'])['url']
+                break
+
+        return {
+            'group_link': f"https://vk.com/{name}",
+            'post_link': f"https://vk.com/wall{owner_id}_{post['id']}",
+            'text': post.get('text', ''),
+            'date': datetime.fromtimestamp(post['date']).strftime("%d.%m.%Y"),
+            'likes': post.get('likes', {}).get('count', 0),
+            'views': post.get('views', {}).get('count', 0),
+            'comments_count': post.get('comments', {}).get('count', 0),
+            'comments_likes': 0,
+            'photo_url': photo_url
+        }
+
+    @classmethod
+    def format_posts(cls, name, owner_id, items):
+        """Преобразует посты стены в формат таблицы posts; посты без текста пропускаются, как в Telegram"""
+        return [cls.format_post(name, owner_id, post) for post in items if post.get('text')]
+
     def get_owner_info(self, name):
-        """Получает информацию о владельце (группа или пользователь)"""
+        """Получает информацию о владельце (группа или пользователь), результат кэшируется"""
         try:
-            # Очищаем URL от параметров запроса и протокола
-            if '?' in name:
-                name = name.split('?')[0]
-            if '//' in name:
-                name = name.split('//')[-1]
-            if 'vk.com/' in name:
-                name = name.replace('vk.com/', '')
-                
-            logger.info(f"Получаем информацию о: {name}")
-            
-            # Сначала пробуем как группу
-            try:
-                if name.isdigit():
-                    group_info = self.vk.groups.getById(group_id=name)
-                else:
-                    group_info = self.vk.groups.getById(group_ids=name)
-                return {'type': 'group', 'id': -group_info[0]['id']}  # Минус для групп
-            except ApiError:
-                # Если не группа, пробуем как пользователя
-                try:
-                    user_info = self.vk.users.get(user_ids=name)
-                    if user_info:
-                        return {'type': 'user', 'id': user_info[0]['id']}
-                except ApiError as e:
-                    logger.error(f"Ошибка при получении информации о пользователе {name}: {e}")
-                    return None
-                    
-            return None
+            name = self.clean_name(name)
+            return resolver_cache.resolve_sync(VK_OWNER, name, lambda: self._load_owner_info(name))
         except Exception as e:
             logger.error(f"Ошибка при получении информации о {name}: {e}")
             return None
 
-    def get_posts(self, name):
+    def _load_owner_info(self, name):
+        """Запрашивает владельца у VK API. None - имя не найдено (кэшируется как отрицательный результат)"""
+        logger.info(f"Получаем информацию о: {name}")
+        
+        # Сначала пробуем как группу
+        try:
+            if name.isdigit():
+                group_info = self.vk.groups.getById(group_id=name)
+            else:
+                group_info = self.vk.groups.getById(group_ids=name)
+            return {'type': 'group', 'id': -group_info[0]['id']}  # Минус для групп
+        except ApiError as e:
+            if e.code not in VK_NOT_FOUND_CODES:
+                raise
+            # Если не группа, пробуем как пользователя
+            try:
+                user_info = self.vk.users.get(user_ids=name)
+                if user_info:
+                    return {'type': 'user', 'id': user_info[0]['id']}
+            except ApiError as e:
+                if e.code not in VK_NOT_FOUND_CODES:
+                    raise
+                logger.error(f"Ошибка при получении информации о пользователе {name}: {e}")
+                return None
+                
+        return None
+
+    def get_new_posts(self, name, last_id=0, max_pages=VK_MAX_PAGES):
+        """
+        Получает посты новее курсора last_id (id последнего полученного поста), листая стену
+        по VK_WALL_COUNT постов, но не больше max_pages страниц. Без курсора - посты со вчерашнего дня.
+
+        Returns:
+            tuple: (посты в формате для save_posts_to_db, новый курсор)
+        """
         owner_info = self.get_owner_info(name)
         if not owner_info:
             logger.error(f"Не удалось получить информацию о {name}, пропускаем парсинг")
-            return []
+            return [], last_id
 
+        name = self.clean_name(name)
+        since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
         try:
-            logger.info(f"Начинаем получение постов из {'группы' if owner_info['type'] == 'group' else 'страницы'} {name}")
-            yesterday = (datetime.now() - timedelta(days=1)).strftime("%d.%m.%Y")
-            logger.info(f"Ищем посты за {yesterday}")
-            
-            # Получаем последние 20 постов
-            posts = self.vk.wall.get(
-                owner_id=owner_info['id'],
-                count=20,
-                v=VK_API_VERSION
-            )
-            
-            # Фильтруем только вчерашние посты
-            yesterday_posts = []
-            for post in posts['items']:
-                post_date = datetime.fromtimestamp(post['date']).strftime("%d.%m.%Y")
-                if post_date == yesterday:
-                    yesterday_posts.append(post)
-            
-            logger.info(f"Найдено {len(yesterday_posts)} постов за вчера в {'группе' if owner_info['type'] == 'group' else 'на странице'} {name}")
-            
-            # Преобразуем посты в нужный формат
-            formatted_posts = []
-            for post in yesterday_posts:
-                # Получаем фото из поста, если есть
-                photo_url = None
-                if 'attachments' in post:
-                    for attachment in post['attachments']:
-                        if attachment['type'] == 'photo':
-                            sizes = attachment['photo']['sizes']
-                            photo_url = max(sizes, key=lambda x: x['height'])['url']
-                            break
-
-                post_data = {
-                    'group_link': f"https://vk.com/{name}",
-                    'post_link': f"https://vk.com/wall{owner_info['id']}_{post['id']}",
-                    'text': post.get('text', ''),
-                    'date': datetime.fromtimestamp(post['date']).strftime("%d.%m.%Y"),
-                    'likes': post.get('likes', {}).get('count', 0),
-                    'comments_count': post.get('comments', {}).get('count', 0),
-                    'photo_url': photo_url
-                }
-                formatted_posts.append(post_data)
-            
-            return formatted_posts
-            
+            logger.info(f"Начинаем получение постов из {'группы' if owner_info['type'] == 'group' else 'страницы'} {name} (last_id={last_id})")
+            collected = {}
+            for page in range(max_pages):
+                wall = self.vk.wall.get(
+                    owner_id=owner_info['id'],
+                    count=VK_WALL_COUNT,
+                    offset=page * VK_WALL_COUNT,
+                    v=VK_API_VERSION
+                )
+                items = wall['items']
+                new_items, reached = select_new_posts(items, last_id, since.timestamp())
+                for post in new_items:
+                    collected[post['id']] = post
+                if reached or len(items) < VK_WALL_COUNT:
+                    break
+            else:
+                logger.warning(f"Курсор {name} не найден за {max_pages} страниц, более старые новые посты пропущены")
+
+            max_id = max(collected, default=last_id)
+            posts = self.format_posts(name, owner_info['id'], collected.values())
+            logger.info(f"Найдено {len(posts)} новых постов в {'группе' if owner_info['type'] == 'group' else 'на странице'} {name}")
+            return posts, max(max_id, last_id)
+
         except ApiError as e:
             logger.error(f"Ошибка при получении постов из {'группы' if owner_info['type'] == 'group' else 'страницы'} {name}: {e}")
-            return []
+            return [], last_id
+
+    def get_posts(self, name, last_id=0):
+        posts, _ = self.get_new_posts(name, last_id)
+        return posts
 
     def save_posts(self, name):
-        posts = self.get_posts(name)
+        """Сохраняет посты новее курсора источника и сдвигает курсор (как цикл парсинга всех источников)"""
+        source_url = f"https://vk.com/{self.clean_name(name)}"
+        last_id = self.db.get_source_cursors().get(source_url, {}).get('last_message_id') or 0
+        posts, max_id = self.get_new_posts(name, last_id)
         if posts:
             self.db.save_posts_to_db(posts)
-            logger.info(f"Сохранено {len(posts)} постов из {name}") 
\ No newline at end of file
+            logger.info(f"Сохранено {len(posts)} постов из {name}")
+        if max_id > last_id:
+            self.db.update_source_cursors({source_url: max_id})
@@ -11,6 +11,10 @@ from bot.handlers import source_handlers
 from autopost_manager import AutopostManager
 from database.DatabaseManager import DatabaseManager
 from utils.telegram_client import TelegramClientManager
+from utils.metrics import log_summary_loop, registry
+from utils.metrics_server import MetricsServer
+from utils.db_notify import NotificationListener
+from config.settings import METRICS_LOG_INTERVAL, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, PARSER_WORKER_ID
 
 # Загружаем переменные окружения
 from dotenv import load_dotenv
@@ -28,6 +32,18 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+PARSER_HEARTBEAT_AGE = registry.gauge("parser_heartbeat_age_seconds", "Секунд с последнего пульса процесса парсера")
+
+
+def collect_parser_metrics(db: DatabaseManager):
+    """Коллектор метрик: как давно процесс парсера (run_parser.py) писал пульс в БД"""
+    def collect():
+        state = db.get_parser_state(PARSER_WORKER_ID)
+        if state and state['heartbeat_age'] is not None:
+            PARSER_HEARTBEAT_AGE.set(state['heartbeat_age'])
+    return collect
+
+
 async def main():
     """Основная функция запуска бота"""
     
@@ -57,10 +73,31 @@ async def main():
     # Инициализация Telegram клиента
     telegram_manager = TelegramClientManager()
     
+    # Парсинг работает в отдельном процессе (run_parser.py) и сообщает о новых постах через NOTIFY
+    new_posts_listener = NotificationListener(db.conn_params)
+    new_posts_listener.start()
+    
     # Инициализация и запуск автопостинга
-    autopost_manager = AutopostManager(bot, db, telegram_manager)
+    autopost_manager = AutopostManager(bot, db, telegram_manager, new_posts_listener)
     autopost_task = asyncio.create_task(autopost_manager.start_autopost_loop())
     
+    # HTTP-эндпоинт метрик
+    metrics_server = None
+    if METRICS_ENABLED:
+        registry.add_collector(autopost_manager.collect_queue_metrics)
+        registry.add_collector(collect_parser_metrics(db))
+        metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик на {METRICS_HOST}:{METRICS_PORT}: {e}")
+            metrics_server = None
+    
+    # Периодическая сводка метрик этапов в лог
+    metrics_log_task = None
+    if METRICS_LOG_INTERVAL > 0:
+        metrics_log_task = asyncio.create_task(log_summary_loop(METRICS_LOG_INTERVAL))
+    
     try:
         logger.info("🚀 Бот запущен")
         await dp.start_polling(bot)
@@ -70,9 +107,14 @@ async def main():
         # Остановка автопостинга
         await autopost_manager.stop()
         autopost_task.cancel()
+        if metrics_log_task:
+            metrics_log_task.cancel()
+        if metrics_server:
+            await metrics_server.stop()
+        new_posts_listener.stop()
         
         # Остановка Telegram клиента
-        await telegram_manager.stop()
+        await telegram_manager.close_all()
         
         # Закрытие бота
         await bot.session.close()
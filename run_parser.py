@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отдельный процесс парсера источников.
+
+Парсинг (Telethon, VK, сохранение в БД) больше не делит event loop с ботом:
+процесс пишет посты в БД, сообщает боту о новых постах через NOTIFY и раз в
+PARSER_HEARTBEAT_INTERVAL секунд пишет пульс в таблицу parser_state.
+
+Запуск:
+    python run_parser.py            - супервизор: запускает рабочий процесс и перезапускает его
+                                      при падении или если пульс пропал дольше PARSER_HEARTBEAT_TIMEOUT
+    python run_parser.py --worker   - только рабочий процесс (например, под systemd с Restart=always)
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+from config.settings import (
+    PARSER_WORKER_ID, PARSER_HEARTBEAT_INTERVAL, PARSER_HEARTBEAT_TIMEOUT, PARSER_RESTART_BACKOFF_MAX,
+    METRICS_ENABLED, METRICS_HOST, PARSER_METRICS_PORT, YANDEX_DISK_TOKEN
+)
+from database.DatabaseManager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Рабочий процесс, проработавший дольше, считается стабильным: задержка перезапуска сбрасывается
+STABLE_RUN_SECONDS = 600
+
+
+def setup_logging(log_file: str):
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler()
+        ]
+    )
+
+
+async def heartbeat_loop(db: DatabaseManager, parser, started_at: float):
+    """Периодически пишет пульс рабочего процесса в parser_state"""
+    while True:
+        try:
+            await asyncio.to_thread(
+                db.update_parser_heartbeat, PARSER_WORKER_ID, os.getpid(), "running", started_at,
+                parser.last_cycle_at, parser.cycles, parser.saved_posts
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось записать пульс парсера: {e}")
+        await asyncio.sleep(PARSER_HEARTBEAT_INTERVAL)
+
+
+async def run_worker():
+    """Рабочий процесс: адаптивный парсинг источников, обновление метрик постов и очистка старых медиа"""
+    from parsers.parse_all_sources import SourceParser
+    from utils.media_retention import MediaRetention
+    from utils.metrics_server import MetricsServer
+    from utils.yandex_disk import AsyncYandexDisk
+
+    parser = SourceParser()
+    db = parser.db
+    started_at = time.time()
+    await parser.initialize_db()
+
+    metrics_server = None
+    if METRICS_ENABLED:
+        metrics_server = MetricsServer(METRICS_HOST, PARSER_METRICS_PORT)
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик парсера на {METRICS_HOST}:{PARSER_METRICS_PORT}: {e}")
+            metrics_server = None
+
+    tasks = [
+        parser.start_periodic_parsing(),
+        parser.start_periodic_metrics_refresh(),
+        heartbeat_loop(db, parser, started_at)
+    ]
+    disk = None
+    if YANDEX_DISK_TOKEN:
+        disk = AsyncYandexDisk(token=YANDEX_DISK_TOKEN)
+        tasks.append(MediaRetention(disk, db).start_periodic())
+
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, main_task.cancel)
+
+    logger.info(f"🚀 Процесс парсера запущен (pid {os.getpid()})")
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        logger.info("👋 Получен сигнал остановки")
+    finally:
+        await parser.close()
+        if disk:
+            await disk.close()
+        if metrics_server:
+            await metrics_server.stop()
+        try:
+            await asyncio.to_thread(
+                db.update_parser_heartbeat, PARSER_WORKER_ID, os.getpid(), "stopped", started_at,
+                parser.last_cycle_at, parser.cycles, parser.saved_posts
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось записать статус остановки парсера: {e}")
+        logger.info("✅ Процесс парсера остановлен")
+
+
+class ParserSupervisor:
+    """Запускает рабочий процесс парсера и перезапускает его при падении или зависании"""
+
+    def __init__(self, heartbeat_timeout: float = PARSER_HEARTBEAT_TIMEOUT,
+                 max_backoff: float = PARSER_RESTART_BACKOFF_MAX):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_backoff = max_backoff
+        self.db = DatabaseManager()
+        self.process = None
+        self.restarts = 0
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+        if self.process and self.process.returncode is None:
+            logger.info("🛑 Останавливаем рабочий процесс парсера")
+            self.process.terminate()
+
+    async def _watchdog(self, process):
+        """Убивает рабочий процесс, если его пульс не обновлялся дольше heartbeat_timeout"""
+        # Даем процессу время на запуск и первую запись пульса
+        await asyncio.sleep(self.heartbeat_timeout)
+        while process.returncode is None:
+            try:
+                state = await asyncio.to_thread(self.db.get_parser_state, PARSER_WORKER_ID)
+            except Exception as e:
+                # БД недоступна - это не повод убивать парсер
+                logger.warning(f"Супервизор не смог прочитать пульс парсера: {e}")
+                await asyncio.sleep(PARSER_HEARTBEAT_INTERVAL)
+                continue
+            age = state['heartbeat_age'] if state and state['pid'] == process.pid else None
+            if age is None or age > self.heartbeat_timeout:
+                logger.error(f"💀 Пульс парсера (pid {process.pid}) пропал, перезапускаем процесс")
+                process.kill()
+                return
+            await asyncio.sleep(PARSER_HEARTBEAT_INTERVAL)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        backoff = 1
+        while not self._stopping:
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--worker"
+            )
+            logger.info(f"▶️ Запущен рабочий процесс парсера (pid {self.process.pid})")
+            watchdog = asyncio.create_task(self._watchdog(self.process))
+            code = await self.process.wait()
+            watchdog.cancel()
+
+            if self._stopping:
+                break
+            if time.monotonic() - started > STABLE_RUN_SECONDS:
+                backoff = 1
+            self.restarts += 1
+            logger.error(f"💥 Рабочий процесс парсера завершился с кодом {code}, перезапуск #{self.restarts} через {backoff}с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+        logger.info("✅ Супервизор парсера остановлен")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Процесс парсера источников")
+    arg_parser.add_argument("--worker", action="store_true", help="запустить рабочий процесс без супервизора")
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        setup_logging('parser.log')
+        asyncio.run(run_worker())
+    else:
+        setup_logging('parser_supervisor.log')
+        asyncio.run(ParserSupervisor().run())
+
+
+if __name__ == "__main__":
+    main()
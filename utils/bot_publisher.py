@@ -0,0 +1,218 @@
+"""
+Очередь отправки сообщений бота (Bot API, aiogram) с лимитами Telegram.
+
+Публикация и превью на одобрение вызывали bot.send_photo/send_message напрямую: пачка одобрений
+упиралась в лимиты Telegram (около 20 сообщений в минуту в группу и 30 в секунду на бота) и получала 429.
+Теперь каждая отправка проходит через издателя:
+    - у каждого чата своя очередь и свой token bucket (BOT_GROUP_MESSAGES_PER_MINUTE для групп и каналов,
+      BOT_PRIVATE_MESSAGES_PER_SECOND для личных чатов); сообщения одного чата уходят по одному и по порядку;
+      очередь и ее обработчик живут, пока есть сообщения, а token bucket чата хранится дольше (LRU),
+      поэтому лимит и пауза после RetryAfter действуют и между отдельными отправками;
+    - общий token bucket бота (BOT_GLOBAL_MESSAGES_PER_SECOND) выдает разрешения по приоритету:
+      публикация запланированных постов раньше превью, превью раньше уведомлений;
+    - при TelegramRetryAfter чат ставится на паузу на указанное время и отправка повторяется,
+      если ждать не дольше BOT_MAX_RETRY_AFTER.
+
+Использование:
+    await bot_publisher.send(chat_id, lambda: bot.send_message(chat_id, text), priority=PRIORITY_PUBLISH)
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from config.settings import (
+    BOT_GLOBAL_MESSAGES_PER_SECOND, BOT_GROUP_MESSAGES_PER_MINUTE, BOT_PRIVATE_MESSAGES_PER_SECOND,
+    BOT_MAX_RETRY_AFTER
+)
+from utils.metrics import registry
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - важнее
+PRIORITY_PUBLISH = 0
+PRIORITY_PREVIEW = 10
+PRIORITY_NOTIFY = 20
+PRIORITY_NAMES = {
+    PRIORITY_PUBLISH: "publish",
+    PRIORITY_PREVIEW: "preview",
+    PRIORITY_NOTIFY: "notify",
+}
+
+BOT_SEND_WAIT = registry.histogram(
+    "bot_send_wait_seconds",
+    "Ожидание отправки сообщения бота в очереди издателя (лимиты чата и бота, RetryAfter), секунд",
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+BOT_RETRY_AFTER = registry.counter("bot_retry_after_total", "Полученные ответы 429 (RetryAfter) при отправке сообщений бота")
+BOT_PUBLISHER_QUEUE = registry.gauge("bot_publisher_queue", "Сообщения бота, ожидающие отправки")
+
+
+@dataclass(order=True)
+class _Send:
+    priority: int
+    seq: int
+    func: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+@dataclass
+class _ChatQueue:
+    bucket: TokenBucket
+    items: List[_Send] = field(default_factory=list)
+    worker: Optional[asyncio.Task] = None
+
+
+class BotPublisher:
+    """Очереди отправки по чатам с лимитами чата и бота, приоритетами и повтором после RetryAfter"""
+
+    def __init__(self, global_rate: float = BOT_GLOBAL_MESSAGES_PER_SECOND,
+                 group_per_minute: float = BOT_GROUP_MESSAGES_PER_MINUTE,
+                 private_per_second: float = BOT_PRIVATE_MESSAGES_PER_SECOND,
+                 max_retry_after: float = BOT_MAX_RETRY_AFTER, retries: int = 3, max_buckets: int = 1000):
+        self.group_rate = group_per_minute / 60
+        self.private_rate = private_per_second
+        self.max_retry_after = max_retry_after
+        self.retries = retries
+        self.max_buckets = max_buckets
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: Dict[str, _ChatQueue] = {}
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()  # лимиты чатов, в том числе без очереди
+        self._waiters: List[tuple] = []  # (приоритет, seq, future) - ожидающие токен бота
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._queued = 0
+
+    @staticmethod
+    def _chat_key(chat_id) -> str:
+        return str(chat_id).lstrip('@').lower()
+
+    def _chat_bucket(self, key: str, chat_id) -> TokenBucket:
+        """Token bucket чата: сохраняется после опустошения очереди, чтобы лимит не сбрасывался"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+        # Положительный числовой id - личный чат с пользователем, остальное - группы, каналы и @username
+        private = isinstance(chat_id, int) and chat_id > 0
+        rate = self.private_rate if private else self.group_rate
+        bucket = self._buckets[key] = TokenBucket(rate, capacity=1)
+        self._evict_buckets()
+        return bucket
+
+    def _evict_buckets(self):
+        """Забывает давно неиспользуемые чаты; ведро с паузой или неполным запасом не выбрасывается"""
+        for key in list(self._buckets):
+            if len(self._buckets) <= self.max_buckets:
+                return
+            if key not in self._chats and self._buckets[key].delay() == 0:
+                del self._buckets[key]
+
+    async def send(self, chat_id, func: Callable[[], Awaitable[Any]], priority: int = PRIORITY_PUBLISH):
+        """
+        Ставит func() (вызов Bot API) в очередь чата и возвращает ее результат.
+        TelegramRetryAfter дольше max_retry_after или после retries повторов пробрасывается вызывающему.
+        """
+        key = self._chat_key(chat_id)
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _ChatQueue(self._chat_bucket(key, chat_id))
+        item = _Send(priority, next(self._seq), func, asyncio.get_running_loop().create_future())
+        heapq.heappush(chat.items, item)
+        self._queued += 1
+        BOT_PUBLISHER_QUEUE.set(self._queued)
+        if chat.worker is None or chat.worker.done():
+            chat.worker = asyncio.create_task(self._chat_worker(key, chat))
+        return await item.future
+
+    async def _chat_worker(self, key: str, chat: _ChatQueue):
+        """Отправляет сообщения одного чата строго по одному: следующее - только после предыдущего"""
+        try:
+            while chat.items:
+                item = heapq.heappop(chat.items)
+                self._queued -= 1
+                BOT_PUBLISHER_QUEUE.set(self._queued)
+                if item.future.done():
+                    continue
+                try:
+                    result = await self._deliver(key, chat, item)
+                except Exception as e:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                else:
+                    if not item.future.done():
+                        item.future.set_result(result)
+        finally:
+            # Убираем только очередь с обработчиком - token bucket чата остается в self._buckets
+            if self._chats.get(key) is chat and not chat.items:
+                del self._chats[key]
+
+    async def _deliver(self, key: str, chat: _ChatQueue, item: _Send):
+        attempt = 0
+        while True:
+            await chat.bucket.acquire()
+            await self._admit(item.priority)
+            if attempt == 0:
+                BOT_SEND_WAIT.observe(time.monotonic() - item.enqueued_at,
+                                      priority=PRIORITY_NAMES.get(item.priority, str(item.priority)))
+            try:
+                return await item.func()
+            except TelegramRetryAfter as e:
+                attempt += 1
+                BOT_RETRY_AFTER.inc()
+                # Пауза только для этого чата: остальные чаты продолжают отправку
+                chat.bucket.penalize(e.retry_after)
+                if e.retry_after > self.max_retry_after or attempt > self.retries:
+                    logger.warning(f"⛔ RetryAfter {e.retry_after}с для чата {key}, сообщение не отправлено")
+                    raise
+                logger.warning(f"⏳ RetryAfter {e.retry_after}с для чата {key}, повтор #{attempt} после ожидания")
+
+    def _ensure_dispatcher(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _admit(self, priority: int):
+        """Ждет токен общего лимита бота; при нехватке токенов первыми получают более важные отправки"""
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    async def _dispatch(self):
+        while True:
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._global.delay()
+            if delay == 0:
+                self._global.try_acquire()
+                heapq.heappop(self._waiters)[2].set_result(None)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+bot_publisher = BotPublisher()
@@ -0,0 +1,97 @@
+"""
+Сигналы между процессами через PostgreSQL LISTEN/NOTIFY.
+
+Процесс парсера (run_parser.py) после записи постов делает NOTIFY, а бот слушает канал
+и будит цикл автопостинга, не дожидаясь очередного интервала опроса БД.
+"""
+
+import asyncio
+import logging
+import select
+import threading
+from typing import Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from config.settings import NEW_POSTS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationListener:
+    """
+    Слушает канал NOTIFY в отдельном потоке на выделенном соединении.
+    Использование:
+        listener = NotificationListener(db.conn_params)
+        listener.start()
+        await listener.wait(timeout=30)  # True - пришло уведомление
+    """
+
+    def __init__(self, conn_params: dict, channel: str = NEW_POSTS_CHANNEL, poll_timeout: float = 5.0):
+        self.conn_params = conn_params
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.received = 0
+        self._event: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Запускает поток слушателя; вызывать из работающего event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.conn_params)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        logger.info(f"👂 Подписались на уведомления канала {self.channel}")
+        return conn
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    self.received += len(conn.notifies)
+                    conn.notifies.clear()
+                    self._loop.call_soon_threadsafe(self._event.set)
+            except Exception as e:
+                logger.warning(f"Ошибка слушателя уведомлений {self.channel}: {e}. Переподключение через 10с")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                self._stop.wait(10)
+        if conn is not None and not conn.closed:
+            conn.close()
+
+    async def wait(self, timeout: float) -> bool:
+        """Ждет уведомления не дольше timeout секунд; True, если оно пришло"""
+        if self._event is None:
+            await asyncio.sleep(timeout)
+            return False
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_timeout + 1)
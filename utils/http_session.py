@@ -0,0 +1,177 @@
+"""
+Общая HTTP-сессия aiohttp и кэш скачанных медиа.
+
+send_to_group открывал новую ClientSession на каждое фото (новое TCP/TLS соединение и DNS-запрос)
+и читал ответ целиком без ограничения размера. Теперь:
+    - одна сессия на процесс с пулом соединений (HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST),
+      кэшем DNS (HTTP_DNS_CACHE_TTL) и таймаутами;
+    - медиа читается потоком кусками и обрывается, если больше MEDIA_FETCH_MAX_MB;
+    - недавно скачанные медиа хранятся в LRU-кэше в памяти (MEDIA_BYTES_CACHE_MB, MEDIA_BYTES_CACHE_TTL),
+      а одновременные запросы одного URL ждут одно скачивание - публикация одного поста
+      в несколько групп скачивает картинку один раз.
+
+Использование:
+    media = await fetch_media(url)
+    photo_io = io.BytesIO(media.data)
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import aiohttp
+
+from config.settings import (
+    HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT,
+    MEDIA_FETCH_MAX_MB, MEDIA_BYTES_CACHE_MB, MEDIA_BYTES_CACHE_TTL
+)
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MEDIA_FETCHES = registry.counter("http_media_fetches_total", "Получение медиа по URL по результату (hit/miss/shared/error/too_large)")
+MEDIA_FETCHED_BYTES = registry.counter("http_media_fetched_bytes_total", "Байты медиа, скачанные по сети")
+MEDIA_CACHE_BYTES = registry.gauge("http_media_cache_bytes", "Размер кэша скачанных медиа в памяти, байт")
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class MediaFetchError(Exception):
+    pass
+
+
+class MediaTooLargeError(MediaFetchError):
+    pass
+
+
+@dataclass
+class FetchedMedia:
+    data: bytes
+    content_type: str
+
+    @property
+    def filename(self) -> str:
+        """Имя файла по типу содержимого (Telethon определяет по нему, как отправить медиа)"""
+        if 'png' in self.content_type:
+            return "photo.png"
+        if 'webp' in self.content_type:
+            return "photo.webp"
+        return "photo.jpg"
+
+
+class SharedHttpSession:
+    """Ленивая общая ClientSession; пересоздается, если ее закрыли"""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def get(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST, ttl_dns_cache=HTTP_DNS_CACHE_TTL
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class MediaBytesCache:
+    """LRU-кэш содержимого медиа по URL с ограничением общего размера и сроком жизни записей"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()  # url -> (FetchedMedia, сохранено в)
+        self._size = 0
+
+    def get(self, url: str) -> Optional[FetchedMedia]:
+        item = self._items.get(url)
+        if item is None:
+            return None
+        media, stored_at = item
+        if time.monotonic() - stored_at > self.ttl:
+            self._pop(url)
+            return None
+        self._items.move_to_end(url)
+        return media
+
+    def put(self, url: str, media: FetchedMedia) -> None:
+        if len(media.data) > self.max_bytes:
+            return
+        self._pop(url)
+        self._items[url] = (media, time.monotonic())
+        self._size += len(media.data)
+        while self._size > self.max_bytes:
+            self._pop(next(iter(self._items)))
+        MEDIA_CACHE_BYTES.set(self._size)
+
+    def _pop(self, url: str) -> None:
+        item = self._items.pop(url, None)
+        if item is not None:
+            self._size -= len(item[0].data)
+            MEDIA_CACHE_BYTES.set(self._size)
+
+
+http_session = SharedHttpSession()
+media_cache = MediaBytesCache(int(MEDIA_BYTES_CACHE_MB * 1024 * 1024), MEDIA_BYTES_CACHE_TTL)
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+async def _download(url: str, max_bytes: int) -> FetchedMedia:
+    session = await http_session.get()
+    async with session.get(url) as response:
+        if response.status != 200:
+            raise MediaFetchError(f"HTTP {response.status}")
+        if response.content_length is not None and response.content_length > max_bytes:
+            raise MediaTooLargeError(f"{response.content_length} байт, допустимо {max_bytes}")
+        chunks = []
+        received = 0
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            received += len(chunk)
+            if received > max_bytes:
+                raise MediaTooLargeError(f"больше {max_bytes} байт")
+            chunks.append(chunk)
+        MEDIA_FETCHED_BYTES.inc(received)
+        return FetchedMedia(b"".join(chunks), response.headers.get('content-type', '').lower())
+
+
+async def fetch_media(url: str, max_bytes: int = int(MEDIA_FETCH_MAX_MB * 1024 * 1024)) -> FetchedMedia:
+    """Содержимое медиа по URL: из кэша, из уже идущего скачивания того же URL или по сети"""
+    cached = media_cache.get(url)
+    if cached is not None:
+        MEDIA_FETCHES.inc(result="hit")
+        return cached
+
+    pending = _in_flight.get(url)
+    if pending is not None:
+        MEDIA_FETCHES.inc(result="shared")
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[url] = future
+    try:
+        media = await _download(url, max_bytes)
+    except BaseException as e:
+        # BaseException: при отмене первого запроса ожидающие тоже должны получить ошибку, а не зависнуть
+        MEDIA_FETCHES.inc(result="too_large" if isinstance(e, MediaTooLargeError) else "error")
+        if not future.done():
+            future.set_exception(e if isinstance(e, MediaFetchError) else MediaFetchError(str(e) or type(e).__name__))
+            # Исключение получат ожидающие; если их нет, не даем asyncio ругаться на непрочитанную ошибку
+            future.exception()
+        raise
+    finally:
+        _in_flight.pop(url, None)
+    MEDIA_FETCHES.inc(result="miss")
+    media_cache.put(url, media)
+    future.set_result(media)
+    return media
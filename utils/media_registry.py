@@ -0,0 +1,122 @@
+"""
+Реестр медиа с дедупликацией по содержимому.
+
+Одни и те же фото и видео расходятся по многим каналам, а загрузчик скачивал и заново
+выкладывал их на Яндекс.Диск под новым именем при каждой обработке. Теперь:
+    - до скачивания проверяется ключ источника (id файла Telegram, ссылка на VK видео);
+    - после скачивания - SHA-256 содержимого, а для изображений еще и перцептивный хэш (dHash),
+      который совпадает у пережатых копий;
+    - загружается только действительно новый файл, остальные получают ссылку на уже загруженный
+      и увеличивают счетчик использований (ref_count) - статистика дедупликации.
+Файлы с диска удаляет utils.media_retention: по возрасту папки, не трогая медиа постов из очереди.
+"""
+
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from config.settings import MEDIA_PHASH_MAX_DISTANCE
+from utils.metrics import registry
+
+try:
+    from PIL import Image
+except ImportError:
+    # Без Pillow дедупликация работает только по точному совпадению содержимого
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DEDUP = registry.counter("media_dedup_total", "Поиск медиа в реестре по способу совпадения (source/sha256/phash/miss)")
+MEDIA_DEDUP_BYTES = registry.counter("media_dedup_saved_bytes_total", "Байты, которые не пришлось загружать повторно")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class StoredMedia:
+    sha256: str
+    remote_path: str
+    public_url: Optional[str]
+    media_type: Optional[str] = None
+    size_bytes: int = 0
+    reused: bool = False  # True - файл уже был на диске и не загружался
+
+    @classmethod
+    def from_row(cls, row: dict, reused: bool = True) -> "StoredMedia":
+        return cls(row['sha256'], row['remote_path'], row['public_url'], row['media_type'], row['size_bytes'] or 0, reused)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_dhash(path: str, hash_size: int = 8) -> Optional[int]:
+    """
+    Разностный хэш изображения (64 бита): уменьшенная серая копия 9x8, бит - ярче ли пиксель соседа справа.
+    Возвращается как знаковое 64-битное число (для BIGINT); None - не изображение или нет Pillow.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as image:
+            pixels = list(image.convert('L').resize((hash_size + 1, hash_size)).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class MediaRegistry:
+    """Поиск и регистрация загруженных медиа в таблицах media_registry/media_sources"""
+
+    def __init__(self, db, max_phash_distance: int = MEDIA_PHASH_MAX_DISTANCE):
+        self.db = db
+        self.max_phash_distance = max_phash_distance
+
+    async def find_by_source(self, source_key: str) -> Optional[StoredMedia]:
+        """Проверка до скачивания: этот файл источника уже загружен"""
+        row = await asyncio.to_thread(self.db.find_media_by_source, source_key)
+        if row is None:
+            return None
+        MEDIA_DEDUP.inc(match="source")
+        MEDIA_DEDUP_BYTES.inc(row['size_bytes'] or 0)
+        await asyncio.to_thread(self.db.add_media_reference, row['sha256'])
+        return StoredMedia.from_row(row)
+
+    async def store(self, local_path: str, media_type: str, source_key: Optional[str],
+                    upload: Callable[[str], Awaitable[Optional[StoredMedia]]]) -> Optional[StoredMedia]:
+        """
+        Возвращает медиа из реестра, если такое содержимое уже загружено, иначе вызывает upload(sha256)
+        и регистрирует результат. upload получает хэш, чтобы назвать файл на диске по содержимому.
+        """
+        sha256 = await asyncio.to_thread(file_sha256, local_path)
+        phash = await asyncio.to_thread(image_dhash, local_path) if media_type == 'photo' else None
+
+        row = await asyncio.to_thread(self.db.find_media_by_hash, sha256, phash, self.max_phash_distance)
+        if row is not None:
+            MEDIA_DEDUP.inc(match="sha256" if row['sha256'] == sha256 else "phash")
+            MEDIA_DEDUP_BYTES.inc(row['size_bytes'] or 0)
+            await asyncio.to_thread(self.db.add_media_reference, row['sha256'], source_key)
+            logger.info(f"♻️ Медиа уже загружено ({row['remote_path']}), повторная загрузка не нужна")
+            return StoredMedia.from_row(row)
+
+        MEDIA_DEDUP.inc(match="miss")
+        stored = await upload(sha256)
+        if stored is None:
+            return None
+        await asyncio.to_thread(
+            self.db.register_media, stored.sha256, phash, media_type, stored.size_bytes,
+            stored.remote_path, stored.public_url, source_key
+        )
+        return stored
@@ -0,0 +1,160 @@
+"""
+Очистка старых медиа на Яндекс.Диске.
+
+Загрузчики складывают файлы в папки с датой (/tg_media/2025_01_31, /vk_videos/..., /media/...).
+Задача раз в MEDIA_RETENTION_INTERVAL секунд:
+    - постранично обходит корневые папки и находит папки с датой старше MEDIA_RETENTION_DAYS;
+    - удаляет их параллельно (не больше MEDIA_RETENTION_CONCURRENCY запросов одновременно)
+      одним запросом на папку, а не по файлу;
+    - не трогает файлы, на которые ссылаются еще не опубликованные посты очереди автопостинга:
+      из такой папки удаляются только остальные файлы;
+    - удаляет записи реестра медиа для удаленных файлов, чтобы дедупликация не выдала ссылку на них;
+    - считает освобожденное место.
+"""
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+from urllib.parse import parse_qs, unquote, urlparse
+
+from config.settings import (
+    MEDIA_RETENTION_DAYS, MEDIA_RETENTION_FOLDERS, MEDIA_RETENTION_INTERVAL, MEDIA_RETENTION_CONCURRENCY
+)
+from utils.metrics import registry
+from utils.yandex_disk import AsyncYandexDisk
+
+logger = logging.getLogger(__name__)
+
+MEDIA_RETENTION_DELETED = registry.counter("media_retention_deleted_total", "Удаленные при очистке папки и файлы Яндекс.Диска")
+MEDIA_RETENTION_BYTES = registry.counter("media_retention_reclaimed_bytes_total", "Место, освобожденное очисткой медиа, байт")
+MEDIA_RETENTION_KEPT = registry.counter("media_retention_kept_total", "Файлы в устаревших папках, оставленные из-за постов в очереди")
+
+DATE_FOLDER_FORMAT = "%Y_%m_%d"
+
+
+@dataclass
+class RetentionReport:
+    folders_deleted: int = 0
+    files_deleted: int = 0
+    files_kept: int = 0
+    bytes_reclaimed: int = 0
+    errors: int = 0
+
+
+def referenced_file_name(url: str) -> Optional[str]:
+    """Имя файла из ссылки на медиа: параметр filename прямой ссылки Яндекса или последний сегмент пути"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    filename = parse_qs(parsed.query).get('filename')
+    if filename:
+        return unquote(filename[0])
+    name = os.path.basename(unquote(parsed.path))
+    return name or None
+
+
+class MediaRetention:
+    """Удаление устаревших папок с медиа с учетом ссылок из очереди автопостинга"""
+
+    def __init__(self, disk: AsyncYandexDisk, db, retention_days: int = MEDIA_RETENTION_DAYS,
+                 folders: List[str] = None, concurrency: int = MEDIA_RETENTION_CONCURRENCY):
+        self.disk = disk
+        self.db = db
+        self.retention_days = retention_days
+        self.folders = folders or MEDIA_RETENTION_FOLDERS
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def _protected(self) -> Set[str]:
+        """
+        Имена файлов, на которые ссылаются неопубликованные посты.
+        Файлы реестра названы по хэшу содержимого, поэтому имя однозначно определяет файл.
+        """
+        names = set()
+        for url in await asyncio.to_thread(self.db.get_queued_media_references):
+            name = referenced_file_name(url)
+            if name:
+                names.add(name)
+        return names
+
+    def _is_expired(self, folder_name: str, cutoff: datetime) -> bool:
+        try:
+            return datetime.strptime(folder_name, DATE_FOLDER_FORMAT) < cutoff
+        except ValueError:
+            # Не папка с датой - не наша, не трогаем
+            return False
+
+    async def _delete(self, path: str) -> bool:
+        async with self._slots:
+            return await self.disk.delete(path)
+
+    async def _clean_folder(self, folder: dict, protected_names: Set[str], report: RetentionReport) -> None:
+        # Любая ошибка (в том числе листинга) считается ошибкой этой папки и не прерывает весь проход
+        try:
+            files = [item async for item in self.disk.list_dir(folder['path']) if item.get('type') == 'file']
+            kept = [item for item in files if item['name'] in protected_names]
+            if not kept:
+                if await self._delete(folder['path']):
+                    size = sum(item.get('size') or 0 for item in files)
+                    report.folders_deleted += 1
+                    report.files_deleted += len(files)
+                    report.bytes_reclaimed += size
+                    MEDIA_RETENTION_DELETED.inc(kind="folder")
+                    MEDIA_RETENTION_BYTES.inc(size)
+                    await asyncio.to_thread(self.db.delete_media_by_paths, (), [folder['path']])
+                return
+
+            # В папке есть медиа неопубликованных постов - удаляем только остальные файлы
+            report.files_kept += len(kept)
+            MEDIA_RETENTION_KEPT.inc(len(kept))
+            kept_paths = {item['path'] for item in kept}
+            expired = [item for item in files if item['path'] not in kept_paths]
+            results = await asyncio.gather(*(self._delete(item['path']) for item in expired), return_exceptions=True)
+            deleted = [item for item, result in zip(expired, results) if result is True]
+            report.errors += sum(isinstance(result, Exception) for result in results)
+            size = sum(item.get('size') or 0 for item in deleted)
+            report.files_deleted += len(deleted)
+            report.bytes_reclaimed += size
+            MEDIA_RETENTION_DELETED.inc(len(deleted), kind="file")
+            MEDIA_RETENTION_BYTES.inc(size)
+            await asyncio.to_thread(self.db.delete_media_by_paths, [item['path'] for item in deleted], ())
+            logger.info(f"📌 {folder['path']}: оставлено {len(kept)} файлов постов из очереди")
+        except Exception as e:
+            report.errors += 1
+            logger.error(f"❌ Ошибка очистки {folder['path']}: {e}")
+
+    async def run(self) -> RetentionReport:
+        """Один проход очистки по всем корневым папкам"""
+        report = RetentionReport()
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        protected_names = await self._protected()
+
+        expired = []
+        for root in self.folders:
+            try:
+                async for item in self.disk.list_dir(root):
+                    if item.get('type') == 'dir' and self._is_expired(item['name'], cutoff):
+                        expired.append(item)
+            except Exception as e:
+                report.errors += 1
+                logger.error(f"❌ Не удалось получить содержимое {root}: {e}")
+
+        await asyncio.gather(*(
+            self._clean_folder(folder, protected_names, report) for folder in expired
+        ))
+        logger.info(
+            f"🧹 Очистка медиа: удалено папок {report.folders_deleted}, файлов {report.files_deleted}, "
+            f"освобождено {report.bytes_reclaimed / 1024 / 1024:.1f} MB, оставлено {report.files_kept}, ошибок {report.errors}"
+        )
+        return report
+
+    async def start_periodic(self, interval: float = MEDIA_RETENTION_INTERVAL):
+        """Запускает очистку сразу и затем раз в interval секунд"""
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"Ошибка в цикле очистки медиа: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,353 @@
+"""
+Легковесные метрики процесса: счетчики, gauge, гистограммы длительностей этапов и таймеры (span).
+
+Пример:
+    with span("rewrite", group=group_link, user=user_id):
+        ...
+
+    @timed("db.get_published_posts_today")
+    def get_published_posts_today(...):
+        ...
+
+    PUBLISHED_POSTS.inc(group=group_link)
+
+Накопленные значения можно выгрузить в текстовом формате Prometheus (render_prometheus,
+HTTP-эндпоинт в utils/metrics_server.py) или периодически писать сводку в лог (log_summary_loop).
+"""
+
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин в секундах: от быстрых запросов к БД до долгих ответов GPT
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class _Metric:
+    """Общая часть метрик с одним числовым значением на набор меток"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str = ""):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, float] = {}
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0.0)
+
+    def snapshot(self) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение (глубина очереди, число подключений и т.п.)"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def replace(self, series: Iterable[Tuple[Dict[str, object], float]]) -> None:
+        """Полностью заменяет набор серий парами (метки, значение) - для значений, собираемых из БД целиком"""
+        values = {_label_key(labels): value for labels, value in series}
+        with self._lock:
+            self._values = values
+
+
+class Histogram:
+    """Гистограмма значений с произвольными метками"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str = "", buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # метки -> [счетчики по корзинам (+Inf последним), сумма, количество]
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[LabelKey, Tuple[List[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q: float, counts: List[int], count: int) -> float:
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    return lower  # значение больше последней границы
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Хранилище всех метрик процесса"""
+
+    def __init__(self, prefix: str = "rewriter_"):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        full_name = f"{self.prefix}{name}"
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {full_name} уже зарегистрирована с другим типом")
+            return metric
+
+    def histogram(self, name: str, help_text: str = "", buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str = "") -> Gauge:
+        return self._get_or_create(Gauge, name, help_text)
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """
+        Регистрирует функцию, которая обновляет метрики перед выгрузкой
+        (например, читает глубину очереди из БД). Функция синхронная и может блокировать,
+        поэтому HTTP-эндпоинт вызывает collect() в отдельном потоке.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> None:
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Ошибка в сборщике метрик {getattr(collector, '__name__', collector)}: {e}")
+
+    def metrics(self) -> List[object]:
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self, group_by: Tuple[str, ...] = ("stage",)) -> str:
+        """
+        Сводка по гистограммам для лога. Серии объединяются по меткам group_by
+        (по умолчанию только по этапу, без разбивки по группам и пользователям).
+        """
+        lines = ["📊 Метрики этапов:"]
+        for metric in self.metrics():
+            if not isinstance(metric, Histogram):
+                continue
+            merged: Dict[LabelKey, list] = {}
+            for key, (counts, total, count) in metric.snapshot().items():
+                short_key = tuple(item for item in key if item[0] in group_by)
+                target = merged.setdefault(short_key, [[0] * len(counts), 0.0, 0])
+                target[0] = [a + b for a, b in zip(target[0], counts)]
+                target[1] += total
+                target[2] += count
+            for key, (counts, total, count) in sorted(merged.items()):
+                label = ",".join(value for _, value in key) or metric.name
+                lines.append(
+                    f"   {label}: n={count}, avg={total / count * 1000:.0f}мс, "
+                    f"p50≈{metric.quantile(0.5, counts, count) * 1000:.0f}мс, "
+                    f"p95≈{metric.quantile(0.95, counts, count) * 1000:.0f}мс"
+                )
+        if len(lines) == 1:
+            lines.append("   данных пока нет")
+        return "\n".join(lines)
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "stage_duration_seconds",
+    "Длительность этапов обработки (автопостинг, БД, GPT), секунд"
+)
+STAGE_ERRORS = registry.counter("stage_errors_total", "Этапы, завершившиеся исключением")
+
+# Автопостинг
+QUEUE_DEPTH = registry.gauge("autopost_queue_depth", "Количество постов в очереди автопостинга по статусам")
+PUBLISHED_POSTS = registry.counter("posts_published_total", "Опубликованные посты по группам")
+PUBLISH_FAILURES = registry.counter("posts_publish_failed_total", "Неудачные публикации по группам")
+
+# OpenAI
+OPENAI_REQUESTS = registry.counter("openai_requests_total", "Запросы к OpenAI по операциям и результату")
+
+# База данных
+DB_QUERIES = registry.counter("db_queries_total", "Выполненные SQL-запросы")
+DB_CONNECTIONS = registry.counter("db_connections_total", "Открытые подключения к БД")
+
+# Парсеры
+PARSER_FETCHES = registry.counter("parser_fetches_total", "Обращения к источникам по типу и результату")
+PARSER_POSTS = registry.counter("parser_posts_fetched_total", "Полученные из источников посты")
+PARSER_SAVED = registry.counter("parser_posts_saved_total", "Посты, записанные писателем парсера, по результату")
+PARSER_PIPELINE_DEPTH = registry.gauge("parser_pipeline_queue_depth", "Пачки постов, ожидающие записи в БД")
+PARSER_METRICS_REFRESHED = registry.counter("parser_metrics_refreshed_total", "Посты с обновленными метриками по типу источника")
+
+# Сравнение текстов
+TEXT_COMPARISONS = registry.counter("text_comparisons_total", "Сравнения текстов по методу (spacy/jaccard)")
+
+
+class span:
+    """
+    Таймер этапа: контекстный менеджер (sync и async) и декоратор.
+    Длительность записывается в STAGE_DURATION с меткой stage и дополнительными метками.
+    """
+
+    def __init__(self, stage: str, histogram: Histogram = None, **labels):
+        self.stage = stage
+        self.histogram = histogram or STAGE_DURATION
+        self.labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self._start, stage=self.stage, **self.labels)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            STAGE_ERRORS.inc(stage=self.stage, error=exc_type.__name__)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with type(self)(self.stage, self.histogram, **self.labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with type(self)(self.stage, self.histogram, **self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class openai_call(span):
+    """Таймер запроса к OpenAI: кроме длительности считает запросы по результату (ok/rate_limited/error)"""
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            status = "ok"
+        elif exc_type.__name__ == "RateLimitError":
+            status = "rate_limited"
+        else:
+            status = "error"
+        OPENAI_REQUESTS.inc(operation=self.stage, status=status)
+        return False
+
+
+def timed(stage: str, **labels):
+    """Декоратор: замеряет время выполнения функции (sync или async)"""
+    return span(stage, **labels)
+
+
+async def log_summary_loop(interval: float):
+    """Периодически пишет сводку метрик в лог"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            logger.info(registry.format_summary())
+        except Exception as e:
+            logger.error(f"Ошибка при формировании сводки метрик: {e}")
@@ -0,0 +1,54 @@
+"""
+Встроенный HTTP-экспортер метрик в формате Prometheus.
+
+GET /metrics - все метрики из utils.metrics.registry
+GET /health  - проверка, что процесс жив
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from utils.metrics import registry, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsServer:
+    """HTTP-сервер метрик, работающий в том же event loop, что и бот"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, metrics_registry: MetricsRegistry = None):
+        self.host = host
+        self.port = port
+        self.registry = metrics_registry or registry
+        self._runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        self.app.router.add_get('/metrics', self.metrics)
+        self.app.router.add_get('/health', self.health)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        # Сборщики ходят в БД синхронно, поэтому выполняем их вне event loop
+        await asyncio.to_thread(self.registry.collect)
+        return web.Response(
+            body=self.registry.render_prometheus().encode('utf-8'),
+            headers={'Content-Type': PROMETHEUS_CONTENT_TYPE}
+        )
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,121 @@
+"""
+Дневной план публикаций автопостинга.
+
+calculate_next_post_time выбирал следующий интервал случайно после каждой публикации:
+расписания дня не было видно, а группы одного бота публиковались в одни и те же минуты.
+Планировщик раз в день (и при изменении posts_per_day группы) строит для каждой группы
+весь список слотов на день и сохраняет его в таблицу posting_plan:
+    - слоты равномерно распределены по рабочим часам (AUTOPOST_WORK_START_HOUR - AUTOPOST_WORK_END_HOUR)
+      по числу публикаций группы в день (posts_per_day, по умолчанию AUTOPOST_POSTS_PER_DAY);
+    - группы сдвинуты друг относительно друга на долю интервала (соседние группы одного пользователя - рядом
+      в порядке обхода), чтобы публикации бота не собирались в пики;
+    - случайный сдвиг слота (AUTOPOST_SLOT_JITTER_MINUTES) детерминирован по дню и группе:
+      перестроенный план совпадает с прежним;
+    - цикл автопостинга берет следующее время из плана (DatabaseManager.update_next_post_time).
+"""
+
+import asyncio
+import logging
+import random
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Tuple
+
+import pytz
+
+from config.settings import (
+    AUTOPOST_WORK_START_HOUR, AUTOPOST_WORK_END_HOUR, AUTOPOST_SLOT_JITTER_MINUTES,
+    AUTOPOST_PLAN_CHECK_INTERVAL, AUTOPOST_PLAN_KEEP_DAYS
+)
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+# Первый слот не раньше чем через столько минут после начала рабочего дня
+FIRST_SLOT_OFFSET_MINUTES = 10
+
+PLANNED_SLOTS = registry.gauge("autopost_planned_slots", "Оставшиеся на сегодня слоты плана публикаций")
+
+
+class PostingPlanner:
+    """Строит и сохраняет дневной план публикаций для всех активных групп"""
+
+    def __init__(self, db, work_start_hour: int = AUTOPOST_WORK_START_HOUR, work_end_hour: int = AUTOPOST_WORK_END_HOUR,
+                 jitter_minutes: int = AUTOPOST_SLOT_JITTER_MINUTES):
+        self.db = db
+        self.work_start_hour = work_start_hour
+        self.work_end_hour = work_end_hour
+        self.jitter_minutes = jitter_minutes
+        self._pruned_for = None
+
+    def day_start(self, day: date) -> datetime:
+        """Начало рабочего дня по Москве"""
+        return MOSCOW_TZ.localize(datetime.combine(day, time(self.work_start_hour)))
+
+    def build_plan(self, groups: List[Dict], day: date) -> Dict[Tuple[int, str], List[datetime]]:
+        """
+        Слоты дня для групп [{user_id, group_link, posts_per_day}] по ключу (user_id, group_link) -
+        время по Москве, по возрастанию. Одну группу могут вести несколько пользователей, у каждого свой план.
+        Группа с индексом k из total сдвинута на k/total своего интервала.
+        """
+        window_start = self.day_start(day) + timedelta(minutes=FIRST_SLOT_OFFSET_MINUTES)
+        window_end = MOSCOW_TZ.localize(datetime.combine(day, time(self.work_end_hour)))
+        window = (window_end - window_start).total_seconds()
+        ordered = sorted(groups, key=lambda group: (group['user_id'], group['group_link']))
+        total = max(len(ordered), 1)
+
+        plan = {}
+        for index, group in enumerate(ordered):
+            count = max(group['posts_per_day'], 1)
+            interval = window / count
+            phase = interval * index / total
+            # Сдвиг меньше половины расстояния между соседними группами, чтобы не сломать разнос
+            jitter = min(self.jitter_minutes * 60, interval / total / 2)
+            rng = random.Random(f"{day.isoformat()}:{group['user_id']}:{group['group_link']}")
+            slots = []
+            for slot_index in range(count):
+                offset = phase + slot_index * interval + rng.uniform(-jitter, jitter)
+                offset = min(max(offset, 0), window - 60)
+                slots.append(window_start + timedelta(seconds=offset))
+            plan[(group['user_id'], group['group_link'])] = sorted(slots)
+        return plan
+
+    async def plan_day(self, day: date = None) -> int:
+        """Строит план на день для групп без плана или с измененным posts_per_day; возвращает число таких групп"""
+        day = day or datetime.now(MOSCOW_TZ).date()
+        groups = await asyncio.to_thread(self.db.get_autopost_groups_for_planning, day)
+        stale = [group for group in groups if group['needs_plan']]
+        if not stale:
+            return 0
+
+        # Сдвиги считаются по всем активным группам, чтобы новая группа не встала на слоты существующих
+        plan = self.build_plan(groups, day)
+        to_utc = lambda slot: slot.astimezone(pytz.UTC).replace(tzinfo=None)
+        rows = [
+            (group['user_id'], group['group_link'], group['posts_per_day'],
+             [to_utc(slot) for slot in plan[(group['user_id'], group['group_link'])]])
+            for group in stale
+        ]
+        now_utc = datetime.utcnow()
+        upcoming = await asyncio.to_thread(self.db.save_posting_plan, day, rows, now_utc, to_utc(self.day_start(day)))
+        logger.info(f"📅 План публикаций на {day}: {len(stale)} групп, {upcoming} предстоящих слотов")
+        for group in stale:
+            times = ", ".join(slot.strftime('%H:%M') for slot in plan[(group['user_id'], group['group_link'])])
+            logger.debug(f"   {group['group_link']} (user {group['user_id']}): {times}")
+        return len(stale)
+
+    async def start_periodic(self, interval: float = AUTOPOST_PLAN_CHECK_INTERVAL):
+        """Проверяет план каждые interval секунд: новый день, новые группы и изменение posts_per_day"""
+        while True:
+            try:
+                today = datetime.now(MOSCOW_TZ).date()
+                await self.plan_day(today)
+                # Слоты дня расходуются циклом автопостинга, поэтому метрика обновляется на каждой проверке
+                pending = await asyncio.to_thread(self.db.count_pending_plan_slots, today, datetime.utcnow())
+                PLANNED_SLOTS.set(pending)
+                if self._pruned_for != today:
+                    await asyncio.to_thread(self.db.prune_posting_plan, today - timedelta(days=AUTOPOST_PLAN_KEEP_DAYS))
+                    self._pruned_for = today
+            except Exception as e:
+                logger.error(f"Ошибка построения плана публикаций: {e}")
+            await asyncio.sleep(interval)
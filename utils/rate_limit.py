@@ -0,0 +1,62 @@
+"""
+Ограничение частоты запросов к внешним API (VK, Telegram).
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket: в среднем не больше rate операций в секунду,
+    кратковременные всплески - до capacity операций подряд.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1):
+        """Ждет, пока в ведре наберется tokens токенов, и забирает их"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Забирает токены без ожидания; False, если их недостаточно"""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1) -> float:
+        """Через сколько секунд в ведре будет tokens токенов (0 - уже есть), не забирая их"""
+        self._refill()
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def penalize(self, seconds: float):
+        """Опустошает ведро на seconds секунд (например, после ответа "слишком много запросов")"""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
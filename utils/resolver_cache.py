@@ -0,0 +1,178 @@
+"""
+Кэш разрешения имен в идентификаторы.
+
+username Telegram канала -> id/access_hash (для парсера), username -> chat_id (для Bot API),
+короткое имя VK -> owner_id. Эти данные практически не меняются, а запросы на их получение
+расходуют лимиты (FloodWait у Telegram, rate limit у VK).
+
+Записи хранятся в памяти процесса и в таблице resolver_cache с TTL.
+Отрицательный результат (имя не существует) тоже кэшируется, но на меньший срок.
+Ошибки запросов (сеть, FloodWait) не кэшируются.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config.settings import RESOLVER_CACHE_TTL, RESOLVER_NEGATIVE_TTL
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+RESOLVER_LOOKUPS = registry.counter("resolver_lookups_total", "Обращения к кэшу разрешения имен по результату")
+
+# Виды записей
+TG_ENTITY = "tg_entity"  # username -> {"id", "access_hash", "type"} для клиента парсера
+BOT_CHAT = "bot_chat"  # username -> chat_id для Bot API
+VK_OWNER = "vk_owner"  # короткое имя -> {"type", "id"}
+TG_FILE_ID = "tg_file_id"  # "photo|video:хэш медиа" -> file_id Bot API (utils.telegram_file_cache)
+
+_MISSING = object()
+
+
+class ResolverCache:
+    """Двухуровневый кэш (память + БД) с TTL и отрицательным кэшированием"""
+
+    def __init__(self, ttl: int = RESOLVER_CACHE_TTL, negative_ttl: int = RESOLVER_NEGATIVE_TTL, db=None,
+                 persistent: bool = True):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._db = db
+        # persistent=False - только память процесса (бенчмарки, разовые скрипты без БД)
+        self.persistent = persistent
+        self._memory: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        if self._db is None:
+            from database.DatabaseManager import DatabaseManager
+            self._db = DatabaseManager()
+        return self._db
+
+    @staticmethod
+    def normalize(key: str) -> str:
+        key = str(key).strip()
+        for prefix in ('https://', 'http://', 'www.'):
+            if key.startswith(prefix):
+                key = key[len(prefix):]
+        for prefix in ('t.me/', 'vk.com/', '@'):
+            if key.startswith(prefix):
+                key = key[len(prefix):]
+        return key.split('?')[0].rstrip('/').lower()
+
+    def get(self, kind: str, key: str):
+        """
+        Возвращает закэшированное значение, None для отрицательной записи
+        или _MISSING, если записи нет (нужно разрешать имя заново).
+        """
+        key = self.normalize(key)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get((kind, key))
+        if entry and entry[0] > now:
+            RESOLVER_LOOKUPS.inc(kind=kind, result="memory_hit")
+            return entry[1]
+
+        if not self.persistent:
+            RESOLVER_LOOKUPS.inc(kind=kind, result="miss")
+            return _MISSING
+
+        try:
+            row = self.db.get_resolver_entry(kind, key)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш разрешения имен {kind}:{key}: {e}")
+            row = None
+        if row is None:
+            RESOLVER_LOOKUPS.inc(kind=kind, result="miss")
+            return _MISSING
+
+        value = json.loads(row['value']) if row['resolved'] and row['value'] is not None else None
+        expires_at = row['expires_at'].timestamp() if hasattr(row['expires_at'], 'timestamp') else now + self.negative_ttl
+        with self._lock:
+            self._memory[(kind, key)] = (min(expires_at, now + self.ttl), value)
+        RESOLVER_LOOKUPS.inc(kind=kind, result="db_hit")
+        return value
+
+    def set(self, kind: str, key: str, value) -> None:
+        """Сохраняет результат; value=None - отрицательная запись"""
+        key = self.normalize(key)
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._memory[(kind, key)] = (time.time() + ttl, value)
+        if not self.persistent:
+            return
+        try:
+            self.db.set_resolver_entry(
+                kind, key,
+                json.dumps(value) if value is not None else None,
+                value is not None,
+                ttl
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш разрешения имен {kind}:{key}: {e}")
+
+    def invalidate(self, kind: str, key: str) -> None:
+        """Удаляет запись (например, если закэшированный access_hash перестал работать)"""
+        key = self.normalize(key)
+        with self._lock:
+            self._memory.pop((kind, key), None)
+        if not self.persistent:
+            return
+        try:
+            self.db.delete_resolver_entry(kind, key)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить запись кэша разрешения имен {kind}:{key}: {e}")
+
+    def resolve_sync(self, kind: str, key: str, loader: Callable[[], Optional[Any]]):
+        """Синхронное разрешение через кэш: loader вызывается только при промахе"""
+        value = self.get(kind, key)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        self.set(kind, key, value)
+        return value
+
+    async def resolve(self, kind: str, key: str, loader: Callable[[], Awaitable[Optional[Any]]],
+                      retry_negative: bool = False):
+        """
+        Асинхронное разрешение через кэш: обращения к БД выполняются в отдельном потоке.
+        retry_negative=True - отрицательную запись не использовать, а проверить имя заново
+        (когда пользователь явно просит перепроверить, например, после добавления бота в канал).
+        """
+        value = await asyncio.to_thread(self.get, kind, key)
+        if value is not _MISSING and not (value is None and retry_negative):
+            return value
+        value = await loader()
+        await asyncio.to_thread(self.set, kind, key, value)
+        return value
+
+
+resolver_cache = ResolverCache()
+
+
+async def resolve_bot_chat_id(bot, channel: str, retry_negative: bool = False):
+    """
+    Возвращает числовой chat_id канала для Bot API по ссылке, @username или id.
+    Если канал не найден, возвращает None (отрицательный результат кэшируется).
+    """
+    channel = str(channel).strip()
+    if channel.lstrip('-').isdigit():
+        return int(channel)
+
+    username = resolver_cache.normalize(channel)
+
+    async def load():
+        from aiogram.exceptions import TelegramBadRequest
+        try:
+            chat = await bot.get_chat(f"@{username}")
+            return chat.id
+        except TelegramBadRequest as e:
+            if 'not found' in str(e).lower():
+                return None
+            raise
+
+    return await resolver_cache.resolve(BOT_CHAT, username, load, retry_negative=retry_negative)
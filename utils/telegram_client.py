@@ -1,154 +1,118 @@
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 import logging
 import asyncio
 from config.telegram_config import TELEGRAM_API_ID, TELEGRAM_API_HASH, BOT_TOKEN
+import glob
 import os
-import aiohttp
 import io
-from typing import Optional, Dict
-from datetime import datetime
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from config.settings import TG_PUBLISH_MAX_FLOOD_WAIT, TG_SESSION_PATH, TG_BOT_POOL_SIZE
+from utils.http_session import fetch_media, http_session
+from utils.metrics import registry
+from utils.telegram_scheduler import bot_scheduler, PRIORITY_PUBLISH, PRIORITY_ADMIN
 
 logger = logging.getLogger(__name__)
 
+TG_BOT_POOL_WAIT = registry.histogram("telegram_bot_pool_wait_seconds", "Ожидание свободного клиента бота в пуле, секунд")
+
 class TelegramClientManager:
+    """
+    Пул из TG_BOT_POOL_SIZE заранее авторизованных клиентов бота.
+    Раньше для параллельной отправки создавался новый клиент с временной сессией (вход бота на каждый вызов),
+    а файлы temp_session_*.session копились на диске. Теперь клиенты с постоянными сессиями
+    запускаются один раз и выдаются через checkout().
+    """
     _instance = None
-    _clients: Dict[str, TelegramClient] = {}
     _lock = asyncio.Lock()
     _main_client: Optional[TelegramClient] = None
-    _session_counter = 0
-    _cleanup_task = None
+    _pool_clients: List[TelegramClient] = []
+    _available: Optional[asyncio.Queue] = None
 
-    @classmethod
-    async def initialize(cls):
-        """Инициализация основного клиента"""
-        if cls._main_client is None:
+    @staticmethod
+    def _session_name(index: int) -> str:
+        return TG_SESSION_PATH if index == 0 else f"{TG_SESSION_PATH}_{index}"
+
+    @staticmethod
+    def _remove_temp_sessions():
+        """Удаляет файлы временных сессий, оставшиеся от прежней схемы с клиентом на каждый вызов"""
+        for path in glob.glob("temp_session_*.session*"):
             try:
-                cls._main_client = TelegramClient(
-                    'bot_session',
-                    api_id=TELEGRAM_API_ID,
-                    api_hash=TELEGRAM_API_HASH
-                )
-                
-                if not cls._main_client.is_connected():
-                    await cls._main_client.start(bot_token=BOT_TOKEN)
-                    
-                logger.info("Основной Telethon клиент успешно инициализирован")
-                
-                # Запускаем задачу очистки
-                if not cls._cleanup_task:
-                    cls._cleanup_task = asyncio.create_task(cls._cleanup_old_sessions())
-            except Exception as e:
-                logger.error(f"Ошибка при инициализации основного Telethon клиента: {str(e)}")
-                raise
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить временную сессию {path}: {e}")
 
     @classmethod
-    async def get_client(cls, unique_session=False) -> TelegramClient:
-        """
-        Получить клиент Telethon
-        
-        Args:
-            unique_session (bool): Если True, создает новую уникальную сессию
-        """
-        if unique_session:
-            async with cls._lock:
-                cls._session_counter += 1
-                session_name = f'temp_session_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{cls._session_counter}'
-                
-                try:
-                    client = TelegramClient(
-                        session_name,
-                        api_id=TELEGRAM_API_ID,
-                        api_hash=TELEGRAM_API_HASH
-                    )
-                    
-                    await client.start(bot_token=BOT_TOKEN)
-                    cls._clients[session_name] = client
-                    
-                    logger.info(f"Создан временный клиент: {session_name}")
-                    return client
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при создании временного клиента: {str(e)}")
-                    if os.path.exists(f"{session_name}.session"):
-                        os.remove(f"{session_name}.session")
-                    raise
-        else:
-            if cls._main_client is None:
-                await cls.initialize()
-            return cls._main_client
+    async def _start_client(cls, index: int) -> TelegramClient:
+        # flood_sleep_threshold=0: любой FloodWait доходит до bot_scheduler, который паркует метод и чат
+        client = TelegramClient(cls._session_name(index), api_id=TELEGRAM_API_ID, api_hash=TELEGRAM_API_HASH,
+                                flood_sleep_threshold=0)
+        # С сохраненной сессией start не выполняет вход заново, а только подключается
+        await client.start(bot_token=BOT_TOKEN)
+        return client
 
     @classmethod
-    async def close_temp_client(cls, client: TelegramClient):
-        """Закрыть временный клиент и удалить его файл сессии"""
-        if client and client.session.filename != 'bot_session.session':
+    async def initialize(cls):
+        """Запускает клиенты пула (первый из них - основной)"""
+        async with cls._lock:
+            if cls._main_client is not None:
+                return
             try:
-                session_name = os.path.splitext(os.path.basename(client.session.filename))[0]
-                
-                # Правильно закрываем все соединения
-                if client.is_connected():
-                    await client.disconnect()
-                await asyncio.sleep(0.1)  # Даем время на закрытие соединений
-                
-                # Удаляем файл сессии
-                if os.path.exists(f"{session_name}.session"):
-                    os.remove(f"{session_name}.session")
-                
-                # Удаляем клиент из словаря
-                if session_name in cls._clients:
-                    del cls._clients[session_name]
-                    
-                logger.info(f"Временный клиент {session_name} успешно закрыт и удален")
-                
+                cls._remove_temp_sessions()
+                clients = await asyncio.gather(*(cls._start_client(i) for i in range(max(TG_BOT_POOL_SIZE, 1))))
             except Exception as e:
-                logger.error(f"Ошибка при закрытии временного клиента: {str(e)}")
+                logger.error(f"Ошибка при инициализации Telethon клиентов бота: {str(e)}")
+                raise
+            cls._pool_clients = list(clients)
+            cls._available = asyncio.Queue()
+            for client in cls._pool_clients:
+                cls._available.put_nowait(client)
+            cls._main_client = cls._pool_clients[0]
+            logger.info(f"Пул Telethon клиентов бота инициализирован: {len(cls._pool_clients)} шт.")
 
     @classmethod
-    async def _cleanup_old_sessions(cls):
-        """Периодическая очистка старых сессий"""
-        while True:
-            try:
-                await asyncio.sleep(300)  # Проверяем каждые 5 минут
-                
-                current_time = datetime.now()
-                sessions_to_close = []
-                
-                for session_name, client in cls._clients.items():
-                    try:
-                        # Извлекаем время создания из имени сессии
-                        session_time = datetime.strptime(session_name.split('_')[2], "%Y%m%d%H%M%S")
-                        
-                        # Если сессия старше 10 минут, закрываем её
-                        if (current_time - session_time).total_seconds() > 600:
-                            sessions_to_close.append((session_name, client))
-                    except (ValueError, IndexError):
-                        continue
-                
-                for session_name, client in sessions_to_close:
-                    await cls.close_temp_client(client)
-                    
-            except Exception as e:
-                logger.error(f"Ошибка при очистке старых сессий: {str(e)}")
+    async def get_client(cls) -> TelegramClient:
+        """Основной клиент (без выдачи из пула) - для коротких запросов, не требующих отдельного соединения"""
+        if cls._main_client is None:
+            await cls.initialize()
+        return cls._main_client
+
+    @classmethod
+    @asynccontextmanager
+    async def checkout(cls):
+        """
+        Берет свободный клиент из пула и возвращает его после блока.
+        Использование:
+            async with TelegramClientManager.checkout() as client:
+                await client.send_message(...)
+        """
+        if cls._main_client is None:
+            await cls.initialize()
+        started = time.monotonic()
+        client = await cls._available.get()
+        TG_BOT_POOL_WAIT.observe(time.monotonic() - started)
+        try:
+            if not client.is_connected():
+                logger.warning("🔄 Клиент бота из пула отключен, переподключаемся")
+                await client.connect()
+            yield client
+        finally:
+            cls._available.put_nowait(client)
 
     @classmethod
     async def close_all(cls):
         """Закрыть все соединения"""
         try:
-            # Отменяем задачу очистки
-            if cls._cleanup_task:
-                cls._cleanup_task.cancel()
-                try:
-                    await cls._cleanup_task
-                except asyncio.CancelledError:
-                    pass
-            
-            # Закрываем все временные клиенты
-            for session_name, client in list(cls._clients.items()):
-                await cls.close_temp_client(client)
-            
-            # Закрываем основной клиент
-            if cls._main_client and cls._main_client.is_connected():
-                await cls._main_client.disconnect()
-                cls._main_client = None
+            for client in cls._pool_clients:
+                if client.is_connected():
+                    await client.disconnect()
+            cls._pool_clients = []
+            cls._available = None
+            cls._main_client = None
+
+            await http_session.close()
                 
             logger.info("Все клиенты Telethon успешно закрыты")
             
@@ -160,6 +124,87 @@ class TelegramClientManager:
         """Алиас для close_all для обратной совместимости"""
         await cls.close_all()
 
+    @classmethod
+    async def _deliver(cls, client, entity, group_username: str, text: str, photo_url: str = None,
+                       is_video: bool = False, is_local: bool = False):
+        """Отправляет пост в уже разрешенный чат (FloodWaitError пробрасывается планировщику)"""
+        if photo_url:
+            # Отправляем с медиафайлом
+            if is_local:
+                # Локальный файл - отправляем напрямую
+                try:
+                    if is_video:
+                        # Для локального видео
+                        await client.send_file(
+                            entity,
+                            photo_url,
+                            caption=text,
+                            supports_streaming=True,
+                            force_document=False,
+                            parse_mode='markdown'  # Поддержка разметки для жирных заголовков
+                        )
+                        logger.info(f"Локальное видео успешно отправлено в {group_username}")
+                    else:
+                        # Для локального фото
+                        await client.send_file(
+                            entity,
+                            photo_url,
+                            caption=text,
+                            force_document=False,
+                            parse_mode='markdown'  # Поддержка разметки для жирных заголовков
+                        )
+                        logger.info(f"Локальное фото успешно отправлено в {group_username}")
+                except FloodWaitError:
+                    raise
+                except Exception as local_error:
+                    logger.error(f"Ошибка при отправке локального файла {photo_url}: {local_error}")
+                    # Отправляем только текст
+                    await client.send_message(entity, text, parse_mode='markdown')
+                    logger.info(f"Отправлен только текст в {group_username}")
+            else:
+                # URL файл - скачиваем и отправляем
+                if is_video:
+                    # Для видео указываем supports_streaming=True и force_document=False
+                    await client.send_file(
+                        entity,
+                        photo_url,
+                        caption=text,
+                        supports_streaming=True,
+                        force_document=False,
+                        mime_type='video/mp4',
+                        parse_mode='markdown'  # Поддержка разметки для жирных заголовков
+                    )
+                    logger.info(f"Видео успешно отправлено в {group_username}")
+                else:
+                    # Для фото всегда скачиваем и отправляем как изображение
+                    try:
+                        # Общая сессия и кэш: при публикации в несколько групп картинка скачивается один раз
+                        media = await fetch_media(photo_url)
+                        photo_io = io.BytesIO(media.data)
+                        photo_io.name = media.filename
+
+                        # Используем send_file с caption для корректной отправки фото с текстом
+                        await client.send_file(
+                            entity,
+                            photo_io,
+                            caption=text,
+                            force_document=False,
+                            attributes=[],
+                            parse_mode='markdown'  # Поддержка разметки для жирных заголовков
+                        )
+                        logger.info(f"Фото успешно отправлено как изображение в {group_username}")
+                    except FloodWaitError:
+                        raise
+                    except Exception as download_error:
+                        logger.error(f"Ошибка при скачивании и отправке изображения: {download_error}")
+                        # В крайнем случае отправляем только текст
+                        await client.send_message(entity, f"{text}\n\n📷 Изображение: {photo_url}", parse_mode='markdown')
+                        logger.info(f"Отправлен только текст с ссылкой на изображение в {group_username}")
+        else:
+            # Отправляем только текст
+            await client.send_message(entity, text, parse_mode='markdown')
+            logger.info(f"Текст успешно отправлен в {group_username}")
+
     @classmethod
     async def send_to_group(cls, group_username: str, text: str, photo_url: str = None, is_video: bool = False, is_local: bool = False):
         """
@@ -180,111 +225,27 @@ class TelegramClientManager:
                 group_username = group_username[1:]
             
             # Получаем сущность группы/канала
-            entity = await client.get_entity(group_username)
-            
-            if photo_url:
-                # Отправляем с медиафайлом
-                if is_local:
-                    # Локальный файл - отправляем напрямую
-                    try:
-                        if is_video:
-                            # Для локального видео
-                            await client.send_file(
-                                entity,
-                                photo_url,
-                                caption=text,
-                                supports_streaming=True,
-                                force_document=False,
-                                parse_mode='markdown'  # Поддержка разметки для жирных заголовков
-                            )
-                            logger.info(f"Локальное видео успешно отправлено в {group_username}")
-                        else:
-                            # Для локального фото
-                            await client.send_file(
-                                entity,
-                                photo_url,
-                                caption=text,
-                                force_document=False,
-                                parse_mode='markdown'  # Поддержка разметки для жирных заголовков
-                            )
-                            logger.info(f"Локальное фото успешно отправлено в {group_username}")
-                    except Exception as local_error:
-                        logger.error(f"Ошибка при отправке локального файла {photo_url}: {local_error}")
-                        # Отправляем только текст
-                        await client.send_message(entity, text, parse_mode='markdown')
-                        logger.info(f"Отправлен только текст в {group_username}")
-                else:
-                    # URL файл - скачиваем и отправляем
-                    if is_video:
-                        # Для видео указываем supports_streaming=True и force_document=False
-                        await client.send_file(
-                            entity,
-                            photo_url,
-                            caption=text,
-                            supports_streaming=True,
-                            force_document=False,
-                            mime_type='video/mp4',
-                            parse_mode='markdown'  # Поддержка разметки для жирных заголовков
-                        )
-                        logger.info(f"Видео успешно отправлено в {group_username}")
-                    else:
-                        # Для фото всегда скачиваем и отправляем как изображение
-                        try:
-                            async with aiohttp.ClientSession() as session:
-                                async with session.get(photo_url) as response:
-                                    if response.status == 200:
-                                        photo_bytes = await response.read()
-                                        
-                                        # Определяем формат изображения по заголовкам
-                                        content_type = response.headers.get('content-type', '').lower()
-                                        if 'jpeg' in content_type or 'jpg' in content_type:
-                                            filename = "photo.jpg"
-                                        elif 'png' in content_type:
-                                            filename = "photo.png"
-                                        elif 'webp' in content_type:
-                                            filename = "photo.webp"
-                                        else:
-                                            filename = "photo.jpg"  # По умолчанию
-                                        
-                                        photo_io = io.BytesIO(photo_bytes)
-                                        photo_io.name = filename
-                                        
-                                        # Отправляем как фото, используя специальный метод
-                                        try:
-                                            # Используем send_file с caption для корректной отправки фото с текстом
-                                            await client.send_file(
-                                                entity,
-                                                photo_io,
-                                                caption=text,
-                                                force_document=False,
-                                                attributes=[],
-                                                parse_mode='markdown'  # Поддержка разметки для жирных заголовков
-                                            )
-                                        except:
-                                            # Если не получилось, используем send_file с принудительными параметрами
-                                            await client.send_file(
-                                                entity,
-                                                photo_io,
-                                                caption=text,
-                                                force_document=False,
-                                                attributes=[],
-                                                parse_mode='markdown'  # Поддержка разметки для жирных заголовков
-                                            )
-                                        logger.info(f"Фото успешно отправлено как изображение в {group_username}")
-                                    else:
-                                        raise Exception(f"Не удалось скачать изображение: HTTP {response.status}")
-                        except Exception as download_error:
-                            logger.error(f"Ошибка при скачивании и отправке изображения: {download_error}")
-                            # В крайнем случае отправляем только текст
-                            await client.send_message(entity, f"{text}\n\n📷 Изображение: {photo_url}", parse_mode='markdown')
-                            logger.info(f"Отправлен только текст с ссылкой на изображение в {group_username}")
-            else:
-                # Отправляем только текст
-                await client.send_message(entity, text, parse_mode='markdown')
-                logger.info(f"Текст успешно отправлен в {group_username}")
+            entity = await bot_scheduler.run(
+                "resolve", lambda: client.get_entity(group_username), entity=group_username,
+                priority=PRIORITY_PUBLISH, max_flood_wait=TG_PUBLISH_MAX_FLOOD_WAIT
+            )
+
+            async def deliver():
+                # Клиент из пула занимается только на время самой отправки, не на ожидание в планировщике
+                async with cls.checkout() as send_client:
+                    await cls._deliver(send_client, entity, group_username, text, photo_url, is_video, is_local)
+
+            # Отправка идет через планировщик: лимит на чат, ожидание и повтор после FloodWait
+            await bot_scheduler.run(
+                "send", deliver, entity=group_username, priority=PRIORITY_PUBLISH,
+                max_flood_wait=TG_PUBLISH_MAX_FLOOD_WAIT
+            )
                 
             return True
             
+        except FloodWaitError as e:
+            logger.error(f"⛔ FloodWait {e.seconds}с при отправке поста в {group_username}, пост не отправлен")
+            return False
         except Exception as e:
             logger.error(f"Ошибка при отправке поста в {group_username}: {e}")
             return False
@@ -308,10 +269,13 @@ class TelegramClientManager:
                 group_username = group_username[1:]
             
             # Получаем сущность группы/канала
-            entity = await client.get_entity(group_username)
+            entity = await bot_scheduler.run(
+                "resolve", lambda: client.get_entity(group_username), entity=group_username,
+                priority=PRIORITY_ADMIN, max_flood_wait=TG_PUBLISH_MAX_FLOOD_WAIT
+            )
             
             # Получаем информацию о боте
-            bot_info = await client.get_me()
+            bot_info = await bot_scheduler.run("get_me", client.get_me, priority=PRIORITY_ADMIN)
             
             # Получаем права участника (бота) в группе/канале
             try:
@@ -320,10 +284,11 @@ class TelegramClientManager:
                 
                 try:
                     # Используем правильный метод для получения участника
-                    result = await client(GetParticipantRequest(
-                        channel=entity,
-                        participant=bot_info.id
-                    ))
+                    result = await bot_scheduler.run(
+                        "participant",
+                        lambda: client(GetParticipantRequest(channel=entity, participant=bot_info.id)),
+                        priority=PRIORITY_ADMIN, max_flood_wait=TG_PUBLISH_MAX_FLOOD_WAIT
+                    )
                     participant = result.participant
                     
                     # Проверяем, является ли бот администратором
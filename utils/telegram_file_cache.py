@@ -0,0 +1,100 @@
+"""
+Повторное использование file_id медиа, отправленных ботом.
+
+Картинка поста отправлялась через URLInputFile/FSInputFile: сначала в превью на одобрение,
+потом в канал (и в каждую группу) - Telegram каждый раз заново скачивал URL или принимал файл.
+После первой отправки Bot API возвращает file_id, по которому то же медиа отправляется
+без повторной загрузки. file_id хранятся в кэше разрешения имен (память + таблица resolver_cache)
+с ключом по типу медиа и хэшу URL или содержимого локального файла, поэтому переживают перезапуск.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message, URLInputFile
+
+from config.settings import TG_FILE_ID_TTL
+from utils.media_registry import file_sha256
+from utils.metrics import registry
+from utils.resolver_cache import ResolverCache, TG_FILE_ID, _MISSING
+
+logger = logging.getLogger(__name__)
+
+TG_FILE_ID_LOOKUPS = registry.counter("telegram_file_id_lookups_total", "Отправки медиа по результату поиска file_id (hit/miss/stale)")
+
+# Отдельный экземпляр со своим сроком жизни записей, таблица - общая с кэшем разрешения имен
+telegram_file_ids = ResolverCache(ttl=TG_FILE_ID_TTL)
+
+# Фрагменты ответов Bot API, означающие, что не принят именно file_id (остальные ошибки - подпись, чат и т.п.)
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file_id", "file reference")
+
+
+def is_stale_file_id_error(error: TelegramBadRequest) -> bool:
+    message = str(getattr(error, 'message', None) or error).lower()
+    return any(marker in message for marker in STALE_FILE_ID_ERRORS)
+
+
+def media_input(media: str):
+    """FSInputFile для существующего локального файла, URLInputFile для http(s) ссылки, иначе None"""
+    if os.path.isfile(media):
+        return FSInputFile(media)
+    if media.startswith(('http://', 'https://')):
+        return URLInputFile(media)
+    return None
+
+
+async def media_cache_key(media: str, kind: str) -> Optional[str]:
+    """Ключ медиа: хэш содержимого локального файла или хэш URL; file_id фото нельзя отправить как видео"""
+    if os.path.isfile(media):
+        digest = await asyncio.to_thread(file_sha256, media)
+    elif media.startswith(('http://', 'https://')):
+        digest = hashlib.sha256(media.encode()).hexdigest()
+    else:
+        return None
+    return f"{kind}:{digest}"
+
+
+def sent_file_id(message: Message, kind: str) -> Optional[str]:
+    """file_id медиа из ответа send_photo/send_video"""
+    if kind == 'photo' and message.photo:
+        return message.photo[-1].file_id
+    media = message.video or message.animation or message.document
+    return media.file_id if media else None
+
+
+async def send_cached_media(send: Callable[[Any], Awaitable[Message]], media: str, kind: str = 'photo') -> Message:
+    """
+    Отправляет медиа через send(file) (например, lambda file: bot.send_photo(chat_id, file, caption=...)):
+    по закэшированному file_id, если медиа уже отправлялось, иначе файлом/URL с сохранением file_id.
+    Ошибки отправки пробрасываются вызывающему (у него свой запасной вариант - отправка без медиа).
+    """
+    key = await media_cache_key(media, kind)
+    if key is not None:
+        cached = await asyncio.to_thread(telegram_file_ids.get, TG_FILE_ID, key)
+        if cached is not _MISSING and cached:
+            try:
+                message = await send(cached)
+                TG_FILE_ID_LOOKUPS.inc(kind=kind, result="hit")
+                return message
+            except TelegramBadRequest as e:
+                # Ошибка подписи, разметки или чата повторится и с файлом - кэш не трогаем
+                if not is_stale_file_id_error(e):
+                    raise
+                # file_id стал недействительным - отправляем файл заново
+                TG_FILE_ID_LOOKUPS.inc(kind=kind, result="stale")
+                logger.warning(f"⚠️ Закэшированный file_id для {media} не принят: {e}. Отправляем файл заново")
+                await asyncio.to_thread(telegram_file_ids.invalidate, TG_FILE_ID, key)
+
+    file = media_input(media)
+    if file is None:
+        raise ValueError(f"Медиа не найдено локально и не является URL: {media}")
+    message = await send(file)
+    TG_FILE_ID_LOOKUPS.inc(kind=kind, result="miss")
+    file_id = sent_file_id(message, kind)
+    if key is not None and file_id:
+        await asyncio.to_thread(telegram_file_ids.set, TG_FILE_ID, key, file_id)
+    return message
@@ -0,0 +1,227 @@
+"""
+Планировщик запросов к Telegram через Telethon.
+
+Раньше FloodWaitError в парсере и при публикации просто логировался, а работа терялась.
+Все запросы аккаунта проходят через один планировщик:
+    - лимит запросов в секунду по методу (TG_METHOD_RATES) и минимальный интервал
+      между запросами к одному чату (TG_ENTITY_MIN_INTERVAL);
+    - после FloodWait метод (для send - пара метод+чат) "паркуется" на указанное Telegram время,
+      ожидающие запросы не отправляются, а сам запрос повторяется, если ждать не дольше max_flood_wait;
+    - очередь упорядочена по приоритету: публикация важнее проверки прав, а та - парсинга.
+
+Использование:
+    entity = await bot_scheduler.run("resolve", lambda: client.get_entity(name), entity=name,
+                                     priority=PRIORITY_PUBLISH)
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telethon.errors import FloodWaitError
+
+from config.settings import TG_METHOD_RATES, TG_ENTITY_MIN_INTERVAL
+from utils.metrics import registry
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - важнее
+PRIORITY_PUBLISH = 0
+PRIORITY_ADMIN = 10
+PRIORITY_PARSE = 20
+PRIORITY_METRICS = 30
+PRIORITY_NAMES = {
+    PRIORITY_PUBLISH: "publish",
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_PARSE: "parse",
+    PRIORITY_METRICS: "metrics",
+}
+
+# FloodWait у этих методов относится к конкретному чату, у остальных - ко всему аккаунту
+ENTITY_SCOPED_METHODS = ("send",)
+# Как часто удалять из памяти прошедшие паузы и интервалы чатов, секунд
+PRUNE_INTERVAL = 300
+
+TG_REQUEST_WAIT = registry.histogram(
+    "telegram_request_wait_seconds",
+    "Ожидание запроса Telegram в очереди планировщика (лимиты и FloodWait), секунд",
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+TG_FLOOD_WAITS = registry.counter("telegram_flood_waits_total", "Полученные FloodWait по клиенту и методу")
+TG_FLOOD_WAIT_SECONDS = registry.counter("telegram_flood_wait_seconds_total", "Суммарная длительность FloodWait, секунд")
+TG_SCHEDULER_QUEUE = registry.gauge("telegram_scheduler_queue", "Запросы Telegram, ожидающие в очереди планировщика")
+
+
+@dataclass(order=True)
+class _Request:
+    priority: int
+    seq: int
+    method: str = field(compare=False)
+    entity: Optional[str] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+class TelegramRequestScheduler:
+    """Очередь запросов одного Telegram аккаунта с лимитами, FloodWait и приоритетами"""
+
+    def __init__(self, name: str, method_rates: Dict[str, float] = None,
+                 entity_min_interval: Dict[str, float] = None):
+        self.name = name
+        self.method_rates = dict(method_rates or TG_METHOD_RATES)
+        self.entity_min_interval = dict(entity_min_interval or TG_ENTITY_MIN_INTERVAL)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._parked: Dict[Tuple[str, Optional[str]], float] = {}  # (метод, чат или None) -> monotonic до
+        self._entity_next: Dict[Tuple[str, str], float] = {}  # (метод, чат) -> monotonic следующего разрешенного
+        self._pruned_at = time.monotonic()
+        self._queue: List[_Request] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _method_key(self, method: str) -> str:
+        return method if method in self.method_rates else "default"
+
+    def _bucket(self, method: str) -> TokenBucket:
+        key = self._method_key(method)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.method_rates[key], capacity=1)
+        return bucket
+
+    @staticmethod
+    def _entity_key(entity) -> Optional[str]:
+        return str(entity).lstrip('@').lower() if entity is not None else None
+
+    def park(self, method: str, entity: Optional[str], seconds: float) -> None:
+        """Запрещает запросы метода (или метода к чату) на seconds секунд"""
+        key = (method, entity if method in ENTITY_SCOPED_METHODS else None)
+        until = time.monotonic() + seconds
+        self._parked[key] = max(self._parked.get(key, 0.0), until)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @staticmethod
+    def _deadline(deadlines: Dict, key, now: float) -> float:
+        """Срок из словаря; прошедший срок удаляется, чтобы словари не росли по всем затронутым чатам"""
+        until = deadlines.get(key)
+        if until is None:
+            return 0.0
+        if until <= now:
+            del deadlines[key]
+            return 0.0
+        return until
+
+    def _prune(self, now: float) -> None:
+        """Удаляет прошедшие сроки чатов, к которым больше нет запросов"""
+        for deadlines in (self._parked, self._entity_next):
+            for key in [key for key, until in deadlines.items() if until <= now]:
+                del deadlines[key]
+        self._pruned_at = now
+
+    def _ready_in(self, request: _Request, now: float) -> float:
+        """Через сколько секунд запрос можно отправить, не считая лимита метода"""
+        waits = [
+            self._deadline(self._parked, (request.method, None), now),
+            self._deadline(self._parked, (request.method, request.entity), now),
+        ]
+        if request.entity is not None and request.method in self.entity_min_interval:
+            waits.append(self._deadline(self._entity_next, (request.method, request.entity), now))
+        return max(max(waits) - now, 0.0)
+
+    def _ensure_dispatcher(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        """Выдает разрешения на запросы по приоритету, пока лимиты позволяют"""
+        while True:
+            now = time.monotonic()
+            if now - self._pruned_at > PRUNE_INTERVAL:
+                self._prune(now)
+            next_check = None
+            blocked_methods = set()
+            remaining = []
+            for request in sorted(self._queue):
+                if request.future.done():
+                    continue
+                ready_in = self._ready_in(request, now)
+                bucket_key = self._method_key(request.method)
+                if ready_in == 0 and bucket_key not in blocked_methods:
+                    bucket_delay = self._bucket(request.method).delay()
+                    if bucket_delay == 0:
+                        self._bucket(request.method).try_acquire()
+                        if request.entity is not None and request.method in self.entity_min_interval:
+                            self._entity_next[(request.method, request.entity)] = now + self.entity_min_interval[request.method]
+                        TG_REQUEST_WAIT.observe(
+                            now - request.enqueued_at, client=self.name, method=request.method,
+                            priority=PRIORITY_NAMES.get(request.priority, str(request.priority))
+                        )
+                        request.future.set_result(None)
+                        continue
+                    # Менее важные запросы того же метода не должны забрать следующий токен
+                    blocked_methods.add(bucket_key)
+                    ready_in = bucket_delay
+                elif ready_in == 0:
+                    ready_in = self._bucket(request.method).delay()
+                remaining.append(request)
+                next_check = ready_in if next_check is None else min(next_check, ready_in)
+
+            self._queue = remaining
+            heapq.heapify(self._queue)
+            TG_SCHEDULER_QUEUE.set(len(self._queue), client=self.name)
+            if not self._queue and next_check is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(next_check or 0.0, 0.005))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _admit(self, method: str, entity: Optional[str], priority: int):
+        self._ensure_dispatcher()
+        request = _Request(priority, next(self._seq), method, entity, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, request)
+        self._wakeup.set()
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+
+    async def run(self, method: str, func: Callable[[], Awaitable[Any]], entity=None,
+                  priority: int = PRIORITY_PARSE, max_flood_wait: float = 60, retries: int = 3):
+        """
+        Выполняет func() (корутину Telethon), когда позволяют лимиты.
+        При FloodWait не дольше max_flood_wait паркует метод и повторяет запрос (до retries раз),
+        при более долгом - паркует и пробрасывает FloodWaitError вызывающему.
+        """
+        entity = self._entity_key(entity)
+        attempt = 0
+        while True:
+            await self._admit(method, entity, priority)
+            try:
+                return await func()
+            except FloodWaitError as e:
+                attempt += 1
+                TG_FLOOD_WAITS.inc(client=self.name, method=method)
+                TG_FLOOD_WAIT_SECONDS.inc(e.seconds, client=self.name, method=method)
+                self.park(method, entity, e.seconds)
+                if e.seconds > max_flood_wait or attempt > retries:
+                    logger.warning(f"⛔ [{self.name}] FloodWait {e.seconds}с на {method} {entity or ''}, запрос не повторяем")
+                    raise
+                logger.warning(f"⏳ [{self.name}] FloodWait {e.seconds}с на {method} {entity or ''}, повтор #{attempt} после ожидания")
+
+
+# По планировщику на аккаунт: лимиты Telegram считаются для каждого аккаунта отдельно
+bot_scheduler = TelegramRequestScheduler("bot")
+parser_scheduler = TelegramRequestScheduler("parser")
@@ -0,0 +1,104 @@
+import asyncio
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.media_retention import MediaRetention
+from utils.yandex_disk import AsyncYandexDisk, YandexDiskError
+
+OLD_FOLDER = (datetime.now() - timedelta(days=30)).strftime("%Y_%m_%d")
+NEW_FOLDER = datetime.now().strftime("%Y_%m_%d")
+QUEUED_NAME = "a" * 32 + ".jpg"
+
+
+class FakeYandexDisk(AsyncYandexDisk):
+    """REST API Яндекс.Диска в памяти: листинг отдает пути с префиксом disk:, как настоящий API"""
+
+    def __init__(self, tree, broken=()):
+        super().__init__(token="test")
+        self.tree = tree  # путь папки -> [(имя, тип, размер)]
+        self.broken = set(broken)  # папки, листинг которых отвечает ошибкой сервера
+        self.deleted = []
+
+    async def _request(self, http_method, resource, operation, ok_statuses=(200, 201, 202), **params):
+        path = params['path']
+        if http_method == "GET" and path in self.broken:
+            raise YandexDiskError(500, "InternalServerError")
+        if http_method == "DELETE":
+            self.deleted.append(path)
+            return {}
+        items = [
+            {'name': name, 'path': f"disk:{path}/{name}", 'type': kind, 'size': size}
+            for name, kind, size in self.tree.get(path, [])
+        ]
+        return {'_embedded': {'items': items, 'total': len(items)}}
+
+
+class FakeDatabase:
+    def __init__(self, queued_links):
+        self.queued_links = queued_links
+        self.deleted_paths = []
+        self.deleted_folders = []
+
+    def get_queued_media_references(self):
+        return self.queued_links
+
+    def delete_media_by_paths(self, paths=(), folders=()):
+        self.deleted_paths.extend(paths)
+        self.deleted_folders.extend(folders)
+        return len(paths) + len(folders)
+
+
+def make_tree():
+    return {
+        "/tg_media": [(OLD_FOLDER, 'dir', 0), (NEW_FOLDER, 'dir', 0)],
+        f"/tg_media/{OLD_FOLDER}": [(QUEUED_NAME, 'file', 100), ("b" * 32 + ".jpg", 'file', 200)],
+        f"/tg_media/{NEW_FOLDER}": [("c" * 32 + ".jpg", 'file', 300)],
+        "/vk_videos": [(OLD_FOLDER, 'dir', 0)],
+        f"/vk_videos/{OLD_FOLDER}": [("d" * 32 + ".mp4", 'file', 400)],
+    }
+
+
+def test_list_dir_strips_disk_prefix():
+    """Пути листинга совпадают с remote_path реестра медиа (без disk:)"""
+    disk = FakeYandexDisk(make_tree())
+
+    async def collect():
+        return [item['path'] async for item in disk.list_dir("/tg_media")]
+
+    assert asyncio.run(collect()) == [f"/tg_media/{OLD_FOLDER}", f"/tg_media/{NEW_FOLDER}"]
+
+
+def test_retention_keeps_queued_media_and_cleans_registry():
+    """Файл поста из очереди остается, остальные удаляются вместе с записями реестра"""
+    disk = FakeYandexDisk(make_tree())
+    db = FakeDatabase([f"https://downloader.disk.yandex.ru/disk/xyz?filename={QUEUED_NAME}&disposition=attachment"])
+    retention = MediaRetention(disk, db, retention_days=7, folders=["/tg_media", "/vk_videos"])
+
+    report = asyncio.run(retention.run())
+
+    # Папка без медиа из очереди удаляется целиком, из папки с таким медиа - только остальные файлы
+    assert sorted(disk.deleted) == sorted([f"/tg_media/{OLD_FOLDER}/{'b' * 32}.jpg", f"/vk_videos/{OLD_FOLDER}"])
+    assert db.deleted_paths == [f"/tg_media/{OLD_FOLDER}/{'b' * 32}.jpg"]
+    assert db.deleted_folders == [f"/vk_videos/{OLD_FOLDER}"]
+    assert report.folders_deleted == 1
+    assert report.files_deleted == 2
+    assert report.files_kept == 1
+    assert report.bytes_reclaimed == 600
+    assert report.errors == 0
+
+
+def test_retention_counts_listing_error_and_finishes_pass():
+    """Ошибка листинга одной папки учитывается в отчете, остальные папки очищаются"""
+    disk = FakeYandexDisk(make_tree(), broken=[f"/tg_media/{OLD_FOLDER}"])
+    db = FakeDatabase([])
+    retention = MediaRetention(disk, db, retention_days=7, folders=["/tg_media", "/vk_videos"])
+
+    report = asyncio.run(retention.run())
+
+    assert disk.deleted == [f"/vk_videos/{OLD_FOLDER}"]
+    assert report.folders_deleted == 1
+    assert report.errors == 1
@@ -1,10 +1,280 @@
 import yadisk
 import os
+from datetime import datetime
+import asyncio
 import logging
-from config.settings import YANDEX_DISK_TOKEN
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+
+from config.settings import (
+    YANDEX_DISK_TOKEN, YANDEX_DISK_API_URL, YANDEX_UPLOAD_CONCURRENCY, YANDEX_UPLOAD_CHUNK_SIZE,
+    YANDEX_UPLOAD_TIMEOUT, YANDEX_DIRECT_LINK_TTL
+)
+from utils.metrics import registry, span
 
 logger = logging.getLogger(__name__)
 
+YANDEX_REQUESTS = registry.counter("yandex_disk_requests_total", "Запросы к REST API Яндекс.Диска по операции и результату")
+YANDEX_UPLOADED_BYTES = registry.counter("yandex_disk_uploaded_bytes_total", "Байты, загруженные на Яндекс.Диск")
+YANDEX_CACHE = registry.counter("yandex_disk_cache_total", "Обращения к кэшам клиента Яндекс.Диска (папки, прямые ссылки) по результату")
+YANDEX_CALLS_PER_OPERATION = registry.histogram(
+    "yandex_disk_api_calls_per_operation",
+    "Запросы к REST API Яндекс.Диска на одну операцию (например, загрузку файла со ссылкой)",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10)
+)
+
+# Прямую ссылку обновляем заранее, чтобы не отдать ту, что истечет, пока Telegram ее скачивает
+DIRECT_LINK_MARGIN = 300  # секунд
+
+# Счетчик запросов текущей операции (см. AsyncYandexDisk.count_calls)
+_operation_calls: ContextVar[Optional[List[int]]] = ContextVar("yandex_operation_calls", default=None)
+
+
+def strip_disk_prefix(path: str) -> str:
+    """Путь из ответа REST API (disk:/tg_media/...) в том виде, в каком его передают в запросы и хранят в БД"""
+    return path[len("disk:"):] if path and path.startswith("disk:") else path
+
+
+class YandexDiskError(Exception):
+    def __init__(self, status: int, error: str, message: str = ""):
+        super().__init__(f"[{status}] {error}: {message}")
+        self.status = status
+        self.error = error
+        self.message = message
+
+
+class AsyncYandexDisk:
+    """
+    Асинхронный клиент REST API Яндекс.Диска на aiohttp.
+    Загрузки идут через ограниченный пул (upload_concurrency одновременных файлов),
+    файл читается с диска кусками по chunk_size и отправляется потоком, не целиком в память.
+    Созданные папки и временные прямые ссылки на скачивание кэшируются в памяти процесса.
+    """
+
+    def __init__(self, token: str = YANDEX_DISK_TOKEN, api_url: str = YANDEX_DISK_API_URL,
+                 upload_concurrency: int = YANDEX_UPLOAD_CONCURRENCY, chunk_size: int = YANDEX_UPLOAD_CHUNK_SIZE,
+                 upload_timeout: float = YANDEX_UPLOAD_TIMEOUT):
+        self.token = token
+        self.api_url = api_url.rstrip('/')
+        self.chunk_size = chunk_size
+        self.upload_timeout = upload_timeout
+        self._upload_slots = asyncio.Semaphore(upload_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._known_dirs = set()
+        self._download_links: Dict[str, Tuple[str, float]] = {}  # путь -> (ссылка, действует до)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self._session
+
+    async def _request(self, http_method: str, resource: str, operation: str, ok_statuses=(200, 201, 202),
+                       **params) -> Dict:
+        """Запрос к REST API; возвращает JSON ответа или бросает YandexDiskError"""
+        calls = _operation_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        session = await self._get_session()
+        async with span("yandex_disk.request", operation=operation):
+            async with session.request(http_method, f"{self.api_url}{resource}", params=params,
+                                       headers={'Authorization': f"OAuth {self.token}"}) as response:
+                try:
+                    payload = await response.json(content_type=None) if response.status != 204 else {}
+                except ValueError:
+                    payload = {'error': 'InvalidResponse', 'message': (await response.text())[:200]}
+        if response.status in ok_statuses or response.status == 204:
+            YANDEX_REQUESTS.inc(operation=operation, status="ok")
+            return payload or {}
+        YANDEX_REQUESTS.inc(operation=operation, status="error")
+        payload = payload or {}
+        raise YandexDiskError(response.status, payload.get('error', ''), payload.get('message', ''))
+
+    @contextmanager
+    def count_calls(self, operation: str):
+        """Считает запросы к API внутри блока (в текущей задаче) и пишет их число в гистограмму"""
+        calls = [0]
+        token = _operation_calls.set(calls)
+        try:
+            yield calls
+        finally:
+            _operation_calls.reset(token)
+            YANDEX_CALLS_PER_OPERATION.observe(calls[0], operation=operation)
+
+    async def exists(self, path: str) -> bool:
+        try:
+            await self._request("GET", "/resources", "exists", path=path, fields="path")
+            return True
+        except YandexDiskError as e:
+            if e.status == 404:
+                return False
+            raise
+
+    async def mkdir(self, path: str) -> bool:
+        """Создает папку; False, если она уже существует"""
+        try:
+            await self._request("PUT", "/resources", "mkdir", path=path)
+            return True
+        except YandexDiskError as e:
+            if e.status == 409:
+                return False
+            raise
+
+    async def ensure_dir(self, path: str) -> bool:
+        """Создает папку, если этот процесс еще не создавал/не видел ее; True - папка создана сейчас"""
+        if path in self._known_dirs:
+            YANDEX_CACHE.inc(cache="dirs", result="hit")
+            return False
+        YANDEX_CACHE.inc(cache="dirs", result="miss")
+        created = await self.mkdir(path)
+        self._known_dirs.add(path)
+        return created
+
+    def forget_dir(self, path: str) -> None:
+        """Убирает папку (и вложенные) из кэша, например после удаления"""
+        self._known_dirs = {known for known in self._known_dirs if known != path and not known.startswith(path + '/')}
+        for link_path in [link_path for link_path in self._download_links if link_path.startswith(path + '/')]:
+            self._download_links.pop(link_path, None)
+
+    @staticmethod
+    def _link_expires_at(href: str, now: float) -> float:
+        """Срок действия прямой ссылки: из параметра expires, иначе YANDEX_DIRECT_LINK_TTL"""
+        try:
+            expires = int(parse_qs(urlparse(href).query).get('expires', [0])[0])
+        except (TypeError, ValueError):
+            expires = 0
+        return expires if expires > now else now + YANDEX_DIRECT_LINK_TTL
+
+    async def get_download_link(self, path: str) -> Optional[str]:
+        """Временная прямая ссылка на скачивание своего файла; кэшируется до истечения срока"""
+        now = time.time()
+        cached = self._download_links.get(path)
+        if cached and cached[1] - DIRECT_LINK_MARGIN > now:
+            YANDEX_CACHE.inc(cache="download_links", result="hit")
+            return cached[0]
+        YANDEX_CACHE.inc(cache="download_links", result="miss")
+        payload = await self._request("GET", "/resources/download", "download_link", path=path)
+        href = payload.get('href')
+        if href:
+            self._download_links[path] = (href, self._link_expires_at(href, now))
+        return href
+
+    async def get_meta(self, path: str, fields: str = None) -> Dict:
+        params = {'path': path}
+        if fields:
+            params['fields'] = fields
+        return await self._request("GET", "/resources", "get_meta", **params)
+
+    async def list_dir(self, path: str, page_size: int = 100) -> AsyncIterator[Dict]:
+        """
+        Содержимое папки постранично (name, path, type, size, modified); несуществующая папка - пустая.
+        path элементов без префикса disk: - как в remote_path реестра медиа.
+        """
+        offset = 0
+        while True:
+            try:
+                payload = await self._request(
+                    "GET", "/resources", "list", path=path, limit=page_size, offset=offset,
+                    fields="_embedded.items.name,_embedded.items.path,_embedded.items.type,"
+                           "_embedded.items.size,_embedded.items.modified,_embedded.total"
+                )
+            except YandexDiskError as e:
+                if e.status == 404:
+                    return
+                raise
+            embedded = payload.get('_embedded') or {}
+            items = embedded.get('items') or []
+            for item in items:
+                if item.get('path'):
+                    item['path'] = strip_disk_prefix(item['path'])
+                yield item
+            offset += len(items)
+            if not items or offset >= embedded.get('total', 0):
+                return
+
+    async def delete(self, path: str, permanently: bool = True, wait: bool = True) -> bool:
+        """
+        Удаляет файл или папку; False - ресурса уже нет.
+        Непустая папка удаляется асинхронно на стороне Яндекса: при wait дожидаемся завершения операции.
+        """
+        try:
+            payload = await self._request("DELETE", "/resources", "delete", path=path,
+                                          permanently=str(permanently).lower())
+        except YandexDiskError as e:
+            if e.status == 404:
+                return False
+            raise
+        self.forget_dir(path)
+        self._download_links.pop(path, None)
+        if wait and payload.get('href'):
+            await self._wait_operation(payload['href'])
+        return True
+
+    async def _wait_operation(self, href: str, poll_interval: float = 1.0, timeout: float = 120) -> None:
+        """Ждет завершения асинхронной операции Яндекс.Диска (удаление, копирование)"""
+        resource = href[len(self.api_url):] if href.startswith(self.api_url) else f"/operations/{href.rstrip('/').split('/')[-1]}"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = (await self._request("GET", resource, "operation_status")).get('status')
+            if status == 'success':
+                return
+            if status == 'failed':
+                raise YandexDiskError(200, "OperationFailed", href)
+            await asyncio.sleep(poll_interval)
+        raise YandexDiskError(0, "OperationTimeout", href)
+
+    async def publish(self, path: str) -> None:
+        await self._request("PUT", "/resources/publish", "publish", path=path)
+
+    async def get_public_download_link(self, public_key: str) -> Optional[str]:
+        """Прямая (временная) ссылка на скачивание опубликованного файла"""
+        payload = await self._request("GET", "/public/resources/download", "public_download_link", public_key=public_key)
+        return payload.get('href')
+
+    async def _file_chunks(self, local_path: str):
+        """Читает файл кусками в отдельном потоке, не блокируя event loop"""
+        with open(local_path, 'rb') as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def upload(self, local_path: str, remote_path: str, overwrite: bool = True) -> float:
+        """Загружает файл потоком через пул загрузок; возвращает длительность загрузки в секундах"""
+        size = os.path.getsize(local_path)
+        async with self._upload_slots:
+            started = time.monotonic()
+            async with span("yandex_disk.upload"):
+                payload = await self._request("GET", "/resources/upload", "upload_link",
+                                              path=remote_path, overwrite=str(overwrite).lower())
+                session = await self._get_session()
+                async with session.put(
+                    payload['href'],
+                    data=self._file_chunks(local_path),
+                    headers={'Content-Length': str(size)},
+                    timeout=aiohttp.ClientTimeout(total=self.upload_timeout)
+                ) as response:
+                    if response.status not in (201, 202):
+                        YANDEX_REQUESTS.inc(operation="upload", status="error")
+                        raise YandexDiskError(response.status, "UploadError", await response.text())
+            elapsed = time.monotonic() - started
+        YANDEX_REQUESTS.inc(operation="upload", status="ok")
+        YANDEX_UPLOADED_BYTES.inc(size)
+        # Файл мог быть перезаписан - старая прямая ссылка больше не годится
+        self._download_links.pop(remote_path, None)
+        size_mb = size / (1024 * 1024)
+        logger.info(f"☁️ {remote_path}: {size_mb:.2f} MB загружено за {elapsed:.2f}с ({size_mb / max(elapsed, 1e-6):.2f} MB/s)")
+        return elapsed
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
 class YandexDiskManager:
     def __init__(self):
         self.disk = yadisk.YaDisk(token=YANDEX_DISK_TOKEN)
@@ -58,7 +328,7 @@ class YandexDiskManager:
                 return
                 
             for item in self.disk.listdir(directory):
-                if (datetime.now() - item.modified).days > days:
+                if (datetime.now(item.modified.tzinfo) - item.modified).days > days:
                     try:
                         self.disk.remove(item.path)
                         logger.info(f"Удален устаревший файл: {item.path}")